@@ -36,13 +36,34 @@ _json_encode = json.dumps
 
 
 
-_XHTML_ESCAPE_RE = re.compile('[&<>"\']')
-_XHTML_ESCAPE_DICT = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": "&#39;"}
-
-
 def xhtml_escape(value):
     """Escapes a string so it is valid within XML or XHTML."""
-    return _XHTML_ESCAPE_RE.sub(lambda match: _XHTML_ESCAPE_DICT[match.group(0)], to_basestring(value))
+    # A chain of str.replace calls is several times faster than a regex
+    # with a callback or str.translate on the short strings templates
+    # escape, and costs a scan per character when there is nothing to
+    # replace.  "&" must go first.
+    return to_basestring(value).replace("&", "&amp;").replace(
+        "<", "&lt;").replace(">", "&gt;").replace('"', "&quot;").replace(
+        "'", "&#39;")
+
+
+def xhtml_escape_list(values):
+    """Escapes each of the given strings like `xhtml_escape`.
+
+    Many short strings are escaped together in a single pass, which is
+    much faster than escaping them one by one.
+
+    >>> xhtml_escape_list(["<b>", "Tom & Jerry", b"'"])
+    ['&lt;b&gt;', 'Tom &amp; Jerry', '&#39;']
+    """
+    values = [to_basestring(value) for value in values]
+    if not values:
+        return values
+    joined = "\0".join(values)
+    if joined.count("\0") != len(values) - 1:
+        # The separator is part of some value.
+        return [xhtml_escape(value) for value in values]
+    return xhtml_escape(joined).split("\0")
 
 
 def xhtml_unescape(value):
@@ -32,18 +32,21 @@ This module also defines the `HTTPRequest` class which is exposed via
 from __future__ import absolute_import, division, with_statement
 
 from http import cookies as http_cookies
+import collections
+import os
 import socket
 import time
 
 from io import BytesIO as StringIO
-from tempfile import TemporaryFile
+from tempfile import SpooledTemporaryFile, TemporaryFile
 from twisted.python import log
 from twisted.protocols import basic
 from twisted.internet import address
 from twisted.internet import defer
 from twisted.internet import interfaces
+from twisted.internet import tcp
 
-from cyclone.escape import utf8, native_str, parse_qs_bytes, to_unicode
+from cyclone.escape import native_str, parse_qs_bytes, to_unicode
 from cyclone import httputil
 from cyclone.util import bytes_type
 
@@ -53,6 +56,114 @@ class _BadRequestException(Exception):
     pass
 
 
+class _FileProducer(object):
+    """Writes a part of a file to a transport without buffering it whole.
+
+    On plain TCP connections the data is sent with ``os.sendfile`` where
+    available, as a pull producer: the transport asks for more once its
+    buffer is empty, and then we can write straight to the socket.
+    Otherwise the file is read in chunks of `CHUNK_SIZE` bytes, as a
+    streaming producer which is paused when the transport buffer is full.
+    """
+
+    CHUNK_SIZE = 65536
+    SENDFILE_CHUNK_SIZE = 1048576
+
+    def __init__(self, transport, file, offset, count):
+        self.transport = transport
+        self.file = file
+        self.offset = offset
+        self.remaining = count
+        self.deferred = None
+        self._paused = False
+        self._started = False
+        self._sendfile = self._can_sendfile(transport, file)
+
+    @staticmethod
+    def _can_sendfile(transport, file):
+        if not hasattr(os, "sendfile") or \
+                not isinstance(transport, tcp.Connection) or \
+                interfaces.ISSLTransport.providedBy(transport) or \
+                getattr(transport, "TLS", False):
+            return False
+        try:
+            file.fileno()
+        except Exception:
+            return False
+        return True
+
+    def start(self):
+        self.deferred = defer.Deferred()
+        self.file.seek(self.offset)
+        self.transport.registerProducer(self, not self._sendfile)
+        if not self._sendfile:
+            self.resumeProducing()
+        return self.deferred
+
+    def resumeProducing(self):
+        self._paused = False
+        if self.deferred is None:
+            return
+        if self._sendfile and self._started:
+            # Only called by the transport once it has nothing buffered.
+            self._send_some()
+        else:
+            self._started = True
+            while self.remaining and not self._paused:
+                data = self.file.read(min(self.CHUNK_SIZE, self.remaining))
+                if not data:
+                    # The file was truncated.
+                    self.remaining = 0
+                    break
+                self.remaining -= len(data)
+                self.offset += len(data)
+                self.transport.write(data)
+                if self._sendfile:
+                    # Wait for the transport to flush what we wrote.
+                    break
+        if not self.remaining:
+            self._finish()
+
+    def _send_some(self):
+        try:
+            sent = os.sendfile(self.transport.fileno(), self.file.fileno(),
+                               self.offset,
+                               min(self.SENDFILE_CHUNK_SIZE, self.remaining))
+        except BlockingIOError:
+            sent = None
+        except OSError:
+            # e.g. the file system doesn't support it; read the file instead.
+            self._sendfile = False
+            self.transport.unregisterProducer()
+            self.transport.registerProducer(self, True)
+            self.file.seek(self.offset)
+            self._started = False
+            self.resumeProducing()
+            return
+        if sent == 0:
+            # The file was truncated.
+            self.remaining = 0
+            return
+        if sent:
+            self.offset += sent
+            self.remaining -= sent
+        if self.remaining:
+            # Be called back once the socket is writable again.
+            self.transport.startWriting()
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def stopProducing(self):
+        self._finish()
+
+    def _finish(self):
+        if self.deferred is not None:
+            d, self.deferred = self.deferred, None
+            self.transport.unregisterProducer()
+            d.callback(None)
+
+
 class HTTPConnection(basic.LineReceiver):
     """Handles a connection to an HTTP client, executing HTTP requests.
 
@@ -63,18 +174,54 @@ class HTTPConnection(basic.LineReceiver):
     headers, which override the remote IP and HTTP scheme for all requests.
     These headers are useful when running Tornado behind a reverse proxy or
     load balancer.
+
+    HTTP/1.1 pipelining is supported: requests received while another one
+    is still being processed are parsed ahead and queued, and executed one
+    at a time so that responses are written back in the order requests
+    came in. At most ``max_pipelined_requests`` (an application setting,
+    16 by default) requests are queued per connection; when the queue is
+    full we stop reading from the socket until it drains.
+
+    Request bodies are either delimited by ``Content-Length`` or sent with
+    ``Transfer-Encoding: chunked``. If the ``max_body_size`` application
+    setting is set, bigger bodies are refused with a 413 response and the
+    connection is closed.
     """
 
+    # Maximum size of a request head (request line plus headers). Clients
+    # sending more than this without the terminating empty line are
+    # disconnected.
+    MAX_LENGTH = 65536
+
+    # Maximum size of a chunk-size line or of a trailer field in chunked
+    # request bodies.
+    MAX_CHUNK_LINE_LENGTH = 4096
+
     def connectionMade(self):
-        self._headersbuffer = []
+        self._buffer = bytearray()
+        self._buffer_scanned = 0
+        self._busyReceiving = False
         self._contentbuffer = None
         self._finish_callback = None
         self.no_keep_alive = False
         self.content_length = None
+        self._chunked = False
+        self._chunk_buffer = None
+        self._chunk_size = None
+        self._body_size = 0
+        self._trailer_size = 0
         self.request_callback = self.factory
         self.xheaders = self.factory.settings.get('xheaders', False)
+        self.max_pipelined_requests = self.factory.settings.get(
+            'max_pipelined_requests') or 16
+        self.max_body_size = self.factory.settings.get('max_body_size')
         self._request = None
         self._request_finished = False
+        self._incoming_request = None
+        self._body_consumer = None
+        self._pipeline = collections.deque()
+        self._executing_pipeline = False
+        self._pause_reasons = set()
 
     def connectionLost(self, reason):
         if self._finish_callback:
@@ -86,32 +233,202 @@ class HTTPConnection(basic.LineReceiver):
             self._finish_callback = defer.Deferred()
         return self._finish_callback
 
-    def lineReceived(self, line):
-        if line:
-            self._headersbuffer.append(line + self.delimiter)
-        else:
-            buff = b"".join(self._headersbuffer)
-            self._headersbuffer = []
-            self._on_headers(buff)
+    def dataReceived(self, data):
+        """Feeds incoming bytes into the incremental request parser.
+
+        Data is accumulated in a single buffer which is searched once for
+        the end of the request head; the head is then handed to
+        `_on_headers` as a whole. In raw mode (request bodies, or after
+        the connection was upgraded to another protocol) data goes
+        straight to `rawDataReceived`.
+        """
+        self._buffer += data
+        if self._busyReceiving:
+            return
+
+        try:
+            self._busyReceiving = True
+            while self._buffer and not self.paused:
+                if self.line_mode:
+                    if not self._parse_head():
+                        return
+                    if self.transport and self.transport.disconnecting:
+                        return
+                else:
+                    data = bytes(self._buffer)
+                    del self._buffer[:]
+                    self._buffer_scanned = 0
+                    self.rawDataReceived(data)
+        finally:
+            self._busyReceiving = False
+
+    def _parse_head(self):
+        buff = self._buffer
+        # RFC 7230 section 3.5: ignore empty lines before the request-line
+        while buff.startswith(b"\r\n"):
+            del buff[:2]
+            self._buffer_scanned = 0
+
+        # Only look at bytes that were not searched before, taking care of
+        # a terminator that is split between two reads.
+        eoh = buff.find(b"\r\n\r\n", max(self._buffer_scanned - 3, 0))
+        if eoh == -1:
+            self._buffer_scanned = len(buff)
+            if len(buff) > self.MAX_LENGTH:
+                del buff[:]
+                self._buffer_scanned = 0
+                log.msg("Malformed HTTP request from %s: "
+                        "request head too long" % self._remote_ip)
+                self.transport.loseConnection()
+            return False
+
+        # Keep the CRLF of the last header line, drop the empty line.
+        data = bytes(buff[:eoh + 2])
+        del buff[:eoh + 4]
+        self._buffer_scanned = 0
+        self._on_headers(data)
+        return True
 
     def rawDataReceived(self, data):
+        if self._body_consumer is None and self._contentbuffer is None:
+            # The body was refused; the connection is being closed.
+            return
+        if self._chunked:
+            try:
+                self._chunked_data_received(data)
+            except _BadRequestException as e:
+                log.msg("Malformed HTTP request from %s: %s",
+                        self._remote_ip, e)
+                self._abort_request_body()
+            return
+
         if self.content_length is not None:
             data, rest = data[:self.content_length], data[self.content_length:]
             self.content_length -= len(data)
         else:
             rest = b''
 
-        self._contentbuffer.write(data)
+        self._body_data_received(data)
         if self.content_length == 0:
+            self._on_body_complete(rest)
+
+    def _chunked_data_received(self, data):
+        """Decodes a chunked request body as it arrives.
+
+        ``_chunk_size`` is ``None`` while waiting for a chunk-size line, the
+        number of bytes left in the current chunk (0 once only its trailing
+        CRLF is missing), or -1 after the last chunk, while reading the
+        trailer.
+        """
+        buff = self._chunk_buffer
+        buff += data
+        while True:
+            if self._chunk_size is None or self._chunk_size == -1:
+                eol = buff.find(b"\r\n")
+                if eol == -1:
+                    if len(buff) > self.MAX_CHUNK_LINE_LENGTH:
+                        raise _BadRequestException("Chunk line too long")
+                    return
+                line = bytes(buff[:eol])
+                del buff[:eol + 2]
+                if self._chunk_size == -1:
+                    # Trailer fields are ignored; an empty line ends the body.
+                    if not line:
+                        rest = bytes(buff)
+                        del buff[:]
+                        self._on_body_complete(rest)
+                        return
+                    # The trailer is held to the limit of a request head.
+                    self._trailer_size += eol + 2
+                    if self._trailer_size > self.MAX_LENGTH:
+                        raise _BadRequestException("Trailer too long")
+                    continue
+                size = line.split(b";", 1)[0].strip()
+                if not size or size.translate(None, b"0123456789abcdefABCDEF"):
+                    raise _BadRequestException("Malformed chunk size")
+                size = int(size, 16)
+                if size == 0:
+                    self._chunk_size = -1
+                    self._trailer_size = 0
+                    continue
+                self._body_size += size
+                if self.max_body_size is not None and \
+                        self._body_size > self.max_body_size:
+                    self._refuse_request_body()
+                    return
+                self._chunk_size = size
+            else:
+                if self._chunk_size:
+                    data = bytes(buff[:self._chunk_size])
+                    del buff[:len(data)]
+                    self._chunk_size -= len(data)
+                    self._body_data_received(data)
+                    if self._chunk_size:
+                        return
+                if len(buff) < 2:
+                    return
+                if buff[:2] != b"\r\n":
+                    raise _BadRequestException("Malformed chunk")
+                del buff[:2]
+                self._chunk_size = None
+
+    def _body_data_received(self, data):
+        if self._body_consumer is not None:
+            if data:
+                self._body_consumer._data_received(data)
+        else:
+            self._contentbuffer.write(data)
+
+    def _on_body_complete(self, rest):
+        if self._body_consumer is not None:
+            consumer = self._body_consumer
+            self._body_consumer = self._incoming_request = None
+            consumer._body_received()
+        elif isinstance(self._contentbuffer, httputil.MultipartParser):
+            self._contentbuffer.close()
+            self._on_multipart_body()
+        else:
             self._contentbuffer.seek(0, 0)
             self._on_request_body(self._contentbuffer.read())
-            self.content_length = self._contentbuffer = None
-            self.setLineMode(rest)
+        self.content_length = self._contentbuffer = None
+        self._chunked = False
+        self._chunk_buffer = self._chunk_size = None
+        self.setLineMode(rest)
+
+    def _abort_request_body(self):
+        self._body_consumer = self._contentbuffer = None
+        self._incoming_request = None
+        self._chunk_buffer = self._chunk_size = None
+        self.transport.loseConnection()
+
+    def _refuse_request_body(self):
+        log.msg("Request body from %s bigger than max_body_size" %
+                self._remote_ip)
+        # Unless a response to a previous request is being written, or
+        # the handler of this one has started, tell the client why.
+        if self._request is None:
+            self.transport.write(
+                b"HTTP/1.1 413 Request Entity Too Large\r\n"
+                b"Connection: close\r\nContent-Length: 0\r\n\r\n")
+        self._abort_request_body()
 
     def write(self, chunk):
         assert self._request, "Request closed"
         self.transport.write(chunk)
 
+    def write_sequence(self, chunks):
+        assert self._request, "Request closed"
+        self.transport.writeSequence(chunks)
+
+    def write_file(self, file, offset, count):
+        """Writes count bytes of file, starting at offset, to the client.
+
+        Returns a Deferred which fires once the data was written, or the
+        connection was lost. Nothing else should be written before then.
+        """
+        assert self._request, "Request closed"
+        return _FileProducer(self.transport, file, offset, count).start()
+
     def finish(self):
         assert self._request, "Request closed"
         self._request_finished = True
@@ -140,69 +457,181 @@ class HTTPConnection(basic.LineReceiver):
         self._request = None
         self._request_finished = False
         if disconnect is True:
+            # Requests pipelined after this one are dropped along with
+            # the connection.
+            self._pipeline.clear()
             self.transport.loseConnection()
+        elif self._pipeline:
+            self._execute_pipeline()
+
+    def _execute_pipeline(self):
+        """Executes queued requests until one of them is left running.
+
+        A request that finishes right away calls `_finish_request`, and
+        so this method, from within the previous call; that nested call
+        returns at once and the loop below executes the next request, so
+        the stack doesn't grow with the number of pipelined requests.
+        """
+        if self._executing_pipeline:
+            return
+        self._executing_pipeline = True
+        try:
+            while self._request is None and self._pipeline:
+                self._execute_request(self._pipeline.popleft())
+                if len(self._pipeline) < self.max_pipelined_requests:
+                    self.resume_reading("pipeline")
+        finally:
+            self._executing_pipeline = False
+
+    def pause_reading(self, reason):
+        """Stops reading from the socket until `resume_reading` is called
+        with the same reason.
+
+        The pipeline queue and streamed request bodies pause reading for
+        their own reasons; reading resumes only once none of them holds.
+        """
+        if not self._pause_reasons:
+            self.pauseProducing()
+        self._pause_reasons.add(reason)
+
+    def resume_reading(self, reason):
+        if reason in self._pause_reasons:
+            self._pause_reasons.remove(reason)
+            if not self._pause_reasons:
+                self.resumeProducing()
+
+    def _queue_request(self, request):
+        """Executes the request, or queues it if another one is running or
+        waiting."""
+        if self._request is None and not self._pipeline:
+            self._execute_request(request)
+        else:
+            self._pipeline.append(request)
+            if len(self._pipeline) >= self.max_pipelined_requests:
+                self.pause_reading("pipeline")
+
+    def _execute_request(self, request):
+        self._request = request
+        self.request_callback(request)
 
     def _on_headers(self, data):
         try:
-            eol = data.find(b"\r\n")
-            start_line = data[:eol]
             try:
-                method, uri, version = start_line.split(b" ")
+                start_line, sep, lines = to_unicode(data).partition("\r\n")
+            except ValueError:
+                raise _BadRequestException("Malformed HTTP request encoding")
+            try:
+                method, uri, version = start_line.split(" ")
             except ValueError:
                 raise _BadRequestException("Malformed HTTP request line")
-            if not version.startswith(b"HTTP/"):
+            if not version.startswith("HTTP/"):
                 raise _BadRequestException("Malformed HTTP version in HTTP Request-Line")
             try:
-                headers = httputil.HTTPHeaders.parse(to_unicode(data[eol:]))
+                headers = httputil.HTTPHeaders()
+                for line in lines.split("\r\n"):
+                    if line:
+                        headers.parse_line(line)
                 content_length = int(headers.get("Content-Length", 0))
+                if content_length < 0:
+                    raise ValueError("Negative Content-Length")
             except ValueError:
                 raise _BadRequestException("Malformed HTTP headers")
-            self._request = HTTPRequest(
-                connection=self, method=to_unicode(method), uri=to_unicode(uri),
-                version=to_unicode(version),
+            transfer_encoding = headers.get("Transfer-Encoding")
+            if transfer_encoding is not None:
+                # RFC 7230 section 3.3.3: a message with both headers may
+                # be an attempt at request smuggling.
+                if "Content-Length" in headers:
+                    raise _BadRequestException(
+                        "Both Transfer-Encoding and Content-Length")
+                if transfer_encoding.strip().lower() != "chunked":
+                    raise _BadRequestException(
+                        "Unsupported Transfer-Encoding")
+            request = HTTPRequest(
+                connection=self, method=method, uri=uri, version=version,
                 headers=headers, remote_ip=to_unicode(self._remote_ip))
 
-            if content_length:
-                if headers.get("Expect") == "100-continue":
+            if self.max_body_size is not None and \
+                    content_length > self.max_body_size:
+                self._refuse_request_body()
+                return
+
+            if content_length or transfer_encoding is not None:
+                # An interim response can't be sent while the response to
+                # a previous pipelined request is being written; the client
+                # will send the body anyway once its timeout expires.
+                if headers.get("Expect") == "100-continue" and \
+                        self._request is None:
                     self.transport.write(b"HTTP/1.1 100 (Continue)\r\n\r\n")
 
-                if content_length < 100000:
-                    self._contentbuffer = StringIO()
+                self._incoming_request = request
+                if transfer_encoding is not None:
+                    self._chunked = True
+                    self._chunk_buffer = bytearray()
+                    self._body_size = 0
                 else:
-                    self._contentbuffer = TemporaryFile()
-
-                self.content_length = content_length
+                    self.content_length = content_length
                 self.setRawMode()
+                self._start_request_body(request)
                 return
-            self.request_callback(self._request)
+            self._queue_request(request)
         except _BadRequestException as e:
             log.msg("Malformed HTTP request from %s: %s", self._remote_ip, e)
             self.transport.loseConnection()
 
+    def _start_request_body(self, request):
+        """Lets the application consume the body of request as it arrives.
+
+        If the application doesn't stream it, or other requests are still
+        running or waiting, the body is buffered and the request is executed once the
+        body is complete. multipart/form-data bodies are parsed as they
+        arrive instead, with uploaded files bigger than the
+        ``multipart_spool_threshold`` application setting (100000 bytes by
+        default) written to temporary files.
+        """
+        stream = getattr(self.request_callback, "stream_request", None)
+        if stream is not None and self._request is None and \
+                not self._pipeline:
+            self._request = request
+            self._body_consumer = stream(request)
+            if self._body_consumer is not None:
+                return
+            self._request = None
+
+        if request.method in ("POST", "PATCH", "PUT"):
+            boundary = httputil.multipart_boundary(
+                request.headers.get("Content-Type", ""))
+            if boundary:
+                self._contentbuffer = httputil.MultipartParser(
+                    boundary, request.arguments, request.files,
+                    self.factory.settings.get(
+                        "multipart_spool_threshold", 100000))
+                return
+
+        if self._chunked:
+            self._contentbuffer = SpooledTemporaryFile(100000)
+        elif self.content_length < 100000:
+            self._contentbuffer = StringIO()
+        else:
+            self._contentbuffer = TemporaryFile()
+
+    def _on_multipart_body(self):
+        # The body was parsed as it arrived, and isn't kept around.
+        request, self._incoming_request = self._incoming_request, None
+        self._queue_request(request)
+
     def _on_request_body(self, data):
-        self._request.body = data
-        content_type = self._request.headers.get("Content-Type", "")
-        if self._request.method in ("POST", "PATCH", "PUT"):
-            if content_type.startswith("application/x-www-form-urlencoded"):
-                arguments = parse_qs_bytes(native_str(self._request.body))
-                for name, values in arguments.items():
-                    values = [v for v in values if v]
-                    if values:
-                        self._request.arguments.setdefault(name,
-                                                           []).extend(values)
-            elif content_type.startswith("multipart/form-data"):
-                fields = content_type.split(";")
-                for field in fields:
-                    k, sep, v, = field.strip().partition("=")
-                    if k == "boundary" and v:
-                        httputil.parse_multipart_form_data(
-                            utf8(v), data,
-                            self._request.arguments,
-                            self._request.files)
-                        break
-                else:
-                    log.msg("Invalid multipart/form-data")
-        self.request_callback(self._request)
+        request, self._incoming_request = self._incoming_request, None
+        request.body = data
+        content_type = request.headers.get("Content-Type", "")
+        # multipart/form-data bodies went to a MultipartParser instead
+        if request.method in ("POST", "PATCH", "PUT") and \
+                content_type.startswith("application/x-www-form-urlencoded"):
+            arguments = parse_qs_bytes(native_str(request.body))
+            for name, values in arguments.items():
+                values = [v for v in values if v]
+                if values:
+                    request.arguments.setdefault(name, []).extend(values)
+        self._queue_request(request)
 
     @property
     def _remote_ip(self):
@@ -247,7 +676,9 @@ class HTTPRequest(object):
 
     .. attribute:: body
 
-       Request body, if present, as a byte string.
+       Request body, if present, as a byte string. multipart/form-data
+       bodies are parsed into `arguments` and `files` as they are received
+       and are not kept, so ``body`` is empty for them.
 
     .. attribute:: remote_ip
 
@@ -344,6 +775,19 @@ class HTTPRequest(object):
         assert isinstance(chunk, bytes_type)
         self.connection.write(chunk)
 
+    def write_sequence(self, chunks):
+        """Writes the given list of chunks to the response stream, without
+        joining them.
+        """
+        self.connection.write_sequence(chunks)
+
+    def write_file(self, file, offset, count):
+        """Writes a part of the given file to the response stream.
+
+        Returns a Deferred which fires once it was written.
+        """
+        return self.connection.write_file(file, offset, count)
+
     def finish(self):
         """Finishes this HTTP request on the open connection."""
         self.connection.finish()
@@ -21,6 +21,8 @@ from __future__ import absolute_import, division, with_statement
 
 import re
 
+from tempfile import TemporaryFile
+
 from cyclone.util import ObjectDict
 from cyclone.escape import native_str
 from cyclone.escape import parse_qs_bytes
@@ -213,8 +215,19 @@ class HTTPFile(ObjectDict):
     :ivar body:
     :ivar content_type: The content_type comes from the provided HTTP header
         and should not be trusted outright given that it can be easily forged.
+    :ivar size: The size of the file in bytes.
+    :ivar file: A temporary file holding the contents of uploads bigger than
+        the spool threshold of `MultipartParser`, positioned at its start,
+        or ``None``. Reading ``body`` from such a file loads it in memory,
+        so prefer reading from ``file`` in chunks.
     """
-    pass
+    def __missing__(self, key):
+        if key == "body" and self.get("file") is not None:
+            self["file"].seek(0)
+            body = self["file"].read()
+            self["file"].seek(0)
+            return body
+        raise KeyError(key)
 
 
 def parse_body_arguments(content_type, body, arguments, files):
@@ -232,12 +245,9 @@ def parse_body_arguments(content_type, body, arguments, files):
             if values:
                 arguments.setdefault(name, []).extend(values)
     elif content_type.startswith("multipart/form-data"):
-        fields = content_type.split(";")
-        for field in fields:
-            k, sep, v = field.strip().partition("=")
-            if k == "boundary" and v:
-                parse_multipart_form_data(utf8(v), body, arguments, files)
-                break
+        boundary = multipart_boundary(content_type)
+        if boundary:
+            parse_multipart_form_data(boundary, body, arguments, files)
         else:
             log.msg("Invalid multipart/form-data")
 
@@ -249,43 +259,351 @@ def parse_multipart_form_data(boundary, data, arguments, files):
     The dictionaries given in the arguments and files parameters
     will be updated with the contents of the body.
     """
-    # The standard allows for the boundary to be quoted in the header,
-    # although it's rare (it happens at least for google app engine
-    # xmpp).  I think we're also supposed to handle backslash-escapes
-    # here but I'll save that until we see a client that uses them
-    # in the wild.
-    if boundary.startswith(b'"') and boundary.endswith(b'"'):
-        boundary = boundary[1:-1]
-    final_boundary_index = data.rfind(b"--" + boundary + b"--")
-    if final_boundary_index == -1:
-        log.msg("Invalid multipart/form-data: no final boundary")
-        return
-    parts = data[:final_boundary_index].split(b"--" + boundary + b"\r\n")
-    for part in parts:
-        if not part:
-            continue
-        eoh = part.find(b"\r\n\r\n")
-        if eoh == -1:
-            log.msg("multipart/form-data missing headers")
-            continue
-        headers = HTTPHeaders.parse(to_unicode(part[:eoh]))
+    parser = MultipartParser(boundary, arguments, files)
+    parser.write(data)
+    parser.close()
+
+
+def multipart_boundary(content_type):
+    """Returns the boundary of a multipart/form-data content type.
+
+    The boundary is returned as a byte string, or ``None`` if the content
+    type is not multipart/form-data or has no boundary.
+    """
+    if not content_type.startswith("multipart/form-data"):
+        return None
+    for field in content_type.split(";"):
+        k, sep, v = field.strip().partition("=")
+        if k == "boundary" and v:
+            return utf8(v)
+    return None
+
+
+class MultipartParser(object):
+    """Incremental multipart/form-data parser.
+
+    The body is fed in chunks of any size with `write` as it arrives, and
+    `close` is called once it is complete. Form fields are kept in memory,
+    and files are kept in memory until they grow bigger than
+    ``spool_threshold`` bytes, after which they are written to a temporary
+    file exposed as `HTTPFile.file`. Memory usage is thus bounded no matter
+    how big the uploaded files are.
+
+    The dictionaries given in the arguments and files parameters are only
+    updated by `close`, and only if the final boundary was seen.
+    """
+
+    # Maximum size of the headers of a single part.
+    MAX_HEADERS_LENGTH = 65536
+
+    _PREAMBLE, _DELIMITER, _HEADERS, _BODY, _DONE = range(5)
+
+    def __init__(self, boundary, arguments, files, spool_threshold=100000):
+        # The standard allows for the boundary to be quoted in the header,
+        # although it's rare (it happens at least for google app engine
+        # xmpp).  I think we're also supposed to handle backslash-escapes
+        # here but I'll save that until we see a client that uses them
+        # in the wild.
+        if boundary.startswith(b'"') and boundary.endswith(b'"'):
+            boundary = boundary[1:-1]
+        self.arguments = arguments
+        self.files = files
+        self.spool_threshold = spool_threshold
+        self._delimiter = b"\r\n--" + boundary
+        # The first boundary may not be preceded by a line break; adding
+        # one lets us look for the same delimiter everywhere.
+        self._buffer = bytearray(b"\r\n")
+        self._state = self._PREAMBLE
+        self._name = None
+        self._file = None
+        self._value = bytearray()
+        self._arguments = {}
+        self._files = {}
+
+    def write(self, data):
+        """Feeds a chunk of the body to the parser."""
+        if self._state != self._DONE:
+            self._buffer += data
+            self._parse()
+
+    def close(self):
+        """Finishes parsing, updating the arguments and files."""
+        if self._state != self._DONE:
+            log.msg("Invalid multipart/form-data: no final boundary")
+            self._discard_part()
+            # nothing will see the files of the parts that were complete
+            for values in self._files.values():
+                for f in values:
+                    if f.file is not None:
+                        f.file.close()
+            self._arguments.clear()
+            self._files.clear()
+            return
+        for name, values in self._arguments.items():
+            self.arguments.setdefault(name, []).extend(values)
+        for name, values in self._files.items():
+            self.files.setdefault(name, []).extend(values)
+
+    def _parse(self):
+        buff = self._buffer
+        while buff:
+            if self._state in (self._PREAMBLE, self._BODY):
+                delimiter = self._delimiter
+                index = buff.find(delimiter)
+                if index == -1:
+                    # Anything but a partial delimiter at the end of the
+                    # buffer is part of the current value.
+                    keep = len(buff) - len(delimiter) + 1
+                    if keep > 0:
+                        self._part_data(buff[:keep])
+                        del buff[:keep]
+                    return
+                self._part_data(buff[:index])
+                del buff[:index + len(delimiter)]
+                if self._state == self._BODY:
+                    self._end_part()
+                self._state = self._DELIMITER
+            elif self._state == self._DELIMITER:
+                if len(buff) < 2:
+                    return
+                if buff[:2] == b"--":
+                    self._state = self._DONE
+                elif buff[:2] == b"\r\n":
+                    self._state = self._HEADERS
+                else:
+                    log.msg("Invalid multipart/form-data")
+                    self._state = self._DONE
+                if self._state == self._DONE:
+                    del buff[:]
+                else:
+                    del buff[:2]
+            elif self._state == self._HEADERS:
+                if buff[:2] == b"\r\n":
+                    eoh = -2
+                else:
+                    eoh = buff.find(b"\r\n\r\n")
+                if eoh == -1:
+                    if len(buff) > self.MAX_HEADERS_LENGTH:
+                        log.msg("multipart/form-data headers too long")
+                        self._state = self._DONE
+                        del buff[:]
+                    return
+                if eoh == -2:
+                    headers = HTTPHeaders()
+                else:
+                    try:
+                        headers = HTTPHeaders.parse(
+                            to_unicode(bytes(buff[:eoh])))
+                    except (ValueError, KeyError):
+                        # the part is skipped for lack of a disposition
+                        headers = HTTPHeaders()
+                del buff[:eoh + 4]
+                self._start_part(headers)
+                self._state = self._BODY
+
+    def _start_part(self, headers):
         disp_header = headers.get("Content-Disposition", "")
         disposition, disp_params = _parse_header(disp_header)
-        if disposition != "form-data" or not part.endswith(b"\r\n"):
+        if disposition != "form-data":
             log.msg("Invalid multipart/form-data")
-            continue
-        value = part[eoh + 4:-2]
+            return
         if not disp_params.get("name"):
             log.msg("multipart/form-data value missing name")
-            continue
-        name = disp_params["name"]
+            return
+        self._name = disp_params["name"]
         if disp_params.get("filename"):
             ctype = headers.get("Content-Type", "application/unknown")
-            files.setdefault(name, []).append(HTTPFile(
-                filename=disp_params["filename"], body=value,
-                content_type=ctype))
+            self._file = HTTPFile(
+                filename=disp_params["filename"], content_type=ctype,
+                size=0, file=None)
+
+    def _part_data(self, data):
+        if self._name is None:
+            return
+        f = self._file
+        if f is None:
+            self._value += data
+        elif f.file is not None:
+            f.file.write(data)
+            f.size += len(data)
+        else:
+            self._value += data
+            f.size += len(data)
+            if f.size > self.spool_threshold:
+                f.file = TemporaryFile()
+                f.file.write(self._value)
+                self._value = bytearray()
+
+    def _end_part(self):
+        if self._name is None:
+            return
+        f = self._file
+        if f is None:
+            self._arguments.setdefault(self._name, []).append(
+                bytes(self._value))
+        else:
+            if f.file is not None:
+                f.file.seek(0)
+            else:
+                f.body = bytes(self._value)
+            self._files.setdefault(self._name, []).append(f)
+        self._name = self._file = None
+        self._value = bytearray()
+
+    def _discard_part(self):
+        if self._file is not None and self._file.file is not None:
+            self._file.file.close()
+        self._name = self._file = None
+        self._value = bytearray()
+
+
+def parse_accept_encoding(value):
+    """Parses an Accept-Encoding header into a dict of coding to q-value.
+
+    Codings are lowercased; a coding without a q parameter has a q-value
+    of 1 and a malformed q parameter counts as 0.
+
+    >>> sorted(parse_accept_encoding("gzip;q=0.8, BR, *;q=0").items())
+    [('*', 0.0), ('br', 1.0), ('gzip', 0.8)]
+    """
+    codings = {}
+    for item in value.split(","):
+        coding, params = _parse_header(item)
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        try:
+            q = float(params.get("q", 1))
+        except ValueError:
+            q = 0.0
+        codings[coding] = min(max(q, 0.0), 1.0)
+    return codings
+
+
+def accepted_encodings(value, offered):
+    """Returns the codings in offered that an Accept-Encoding header value
+    allows, best first.
+
+    Codings the client weighs equally keep the order they are offered in,
+    so offered should list the server's preference first.
+
+    >>> accepted_encodings("gzip, br", ["br", "gzip"])
+    ['br', 'gzip']
+    >>> accepted_encodings("gzip;q=1, br;q=0.5", ["br", "gzip"])
+    ['gzip', 'br']
+    >>> accepted_encodings("*, br;q=0", ["br", "zstd", "gzip"])
+    ['zstd', 'gzip']
+    >>> accepted_encodings("", ["gzip"])
+    []
+    """
+    if not value:
+        return []
+    codings = parse_accept_encoding(value)
+    default = codings.get("*", 0.0)
+    weighed = [(codings.get(coding, default), coding) for coding in offered]
+    # sorted() is stable, so ties keep the server's order.
+    return [coding for q, coding in
+            sorted(weighed, key=lambda item: -item[0]) if q > 0]
+
+
+def parse_websocket_extensions(value):
+    """Parses a Sec-WebSocket-Extensions header into a list of
+    ``(extension, params)`` pairs, in the order they are offered.
+
+    Extension and parameter names are lowercased; a parameter without a
+    value maps to None.
+
+    >>> parse_websocket_extensions("permessage-deflate; "
+    ...                            "server_max_window_bits=10; "
+    ...                            "client_no_context_takeover, x-foo")
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [('permessage-deflate', {'server_max_window_bits': '10',
+                             'client_no_context_takeover': None}),
+     ('x-foo', {})]
+    """
+    extensions = []
+    for item in value.split(","):
+        parts = _parseparam(";" + item)
+        name = next(parts).strip().lower()
+        if not name:
+            continue
+        params = {}
+        for part in parts:
+            key, sep, param = part.partition("=")
+            param = param.strip()
+            if len(param) >= 2 and param[0] == param[-1] == '"':
+                param = param[1:-1]
+            params[key.strip().lower()] = param if sep else None
+        extensions.append((name, params))
+    return extensions
+
+
+def _parse_request_ranges(range_header, size):
+    """Parses a Range header for a resource of the given size.
+
+    Returns a list of ``(start, end)`` tuples, where ``end`` is exclusive,
+    or ``None`` if the header is malformed or not about bytes, in which
+    case it should be ignored. The list is empty if none of the ranges can
+    be satisfied.
+
+    >>> _parse_request_ranges("bytes=1-2", 10)
+    [(1, 3)]
+    >>> _parse_request_ranges("bytes=6-", 10)
+    [(6, 10)]
+    >>> _parse_request_ranges("bytes=-6", 10)
+    [(4, 10)]
+    >>> _parse_request_ranges("bytes=0-0, 8-20", 10)
+    [(0, 1), (8, 10)]
+    >>> _parse_request_ranges("bytes=10-", 10)
+    []
+    >>> _parse_request_ranges("bytes=3-1", 10)
+    >>> _parse_request_ranges("lines=1-2", 10)
+    """
+    unit, sep, value = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not sep:
+        return None
+    ranges = []
+    for spec in value.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        start, sep, end = spec.partition("-")
+        start, end = start.strip(), end.strip()
+        if not sep or not (start or end) or \
+                (start and not start.isdigit()) or \
+                (end and not end.isdigit()):
+            return None
+        if not start:
+            # A suffix range: the last "end" bytes.
+            if int(end) == 0:
+                continue
+            ranges.append((max(size - int(end), 0), size))
+            continue
+        start = int(start)
+        if end:
+            if int(end) < start:
+                return None
+            end = min(int(end) + 1, size)
         else:
-            arguments.setdefault(name, []).append(value)
+            end = size
+        if start < size:
+            ranges.append((start, end))
+    return ranges
+
+
+def _get_content_range(start, end, total):
+    """Returns a suitable Content-Range header:
+
+    >>> print(_get_content_range(None, 1, 4))
+    bytes 0-0/4
+    >>> print(_get_content_range(1, 3, 4))
+    bytes 1-2/4
+    >>> print(_get_content_range(None, None, 4))
+    bytes 0-3/4
+    """
+    start = start or 0
+    end = (end or total) - 1
+    return "bytes %s-%s/%s" % (start, end, total)
 
 
 # _parseparam and _parse_header are copied and modified from python2.7's cgi.py
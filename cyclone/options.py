@@ -222,7 +222,7 @@ class _Option(object):
         if self.multiple:
             self._value = []
             for part in value.split(","):
-                if isnumeric(self):
+                if issubclass(self.type, int):
                     # allow ranges of the form X:Y (inclusive at both ends)
                     lo, _, hi = part.partition(":")
                     lo = _parse(lo)
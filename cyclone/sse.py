@@ -24,15 +24,18 @@ For more information, check out the `SEE demo
 """
 
 from cyclone import escape
+from cyclone.web import BackpressureMixin
 from cyclone.web import RequestHandler
 from twisted.python import log
 
 
-class SSEHandler(RequestHandler):
+class SSEHandler(RequestHandler, BackpressureMixin):
     """Subclass this class and define `bind` and `unbind` to get
     notified when a new client connects or disconnects, respectively.
 
     Once connected, you may send events to the browser via `sendEvent`.
+    Events for a client that reads slower than they are sent wait in
+    `send_queue`, see `cyclone.web.BackpressureMixin` for its limits.
     """
     def __init__(self, application, request, **kwargs):
         RequestHandler.__init__(self, application, request, **kwargs)
@@ -53,6 +56,9 @@ class SSEHandler(RequestHandler):
              e.lastEventId property
 
         retry: set the retry timeout in ms. default 3 secs.
+
+        Returns False if the event was dropped because the client is too
+        slow, see `cyclone.web.BackpressureMixin`.
         """
         if isinstance(message, dict):
             message = escape.json_encode(message)
@@ -60,14 +66,17 @@ class SSEHandler(RequestHandler):
             message = message.encode("utf-8")
         assert isinstance(message, bytes)
 
+        fields = []
         if eid:
-            self.transport.write("id: %s\n" % eid)
+            fields.append(escape.utf8("id: %s\n" % eid))
         if event:
-            self.transport.write("event: %s\n" % event)
+            fields.append(escape.utf8("event: %s\n" % event))
         if retry:
-            self.transport.write("retry: %s\n" % retry)
+            fields.append(escape.utf8("retry: %s\n" % retry))
+        fields.append(b"data: " + message + b"\n\n")
 
-        self.transport.write("data: %s\n\n" % message)
+        # the whole event is queued, or dropped, as one write
+        return self.send_queue.write(b"".join(fields))
 
     def _execute(self, transforms, *args, **kwargs):
         self._transforms = []  # transforms
@@ -128,6 +128,23 @@ with ``{# ... #}``.
         {% extends "base.html" %}
         {% block title %}My page title{% end %}
 
+``{% cache *key* *ttl* %}...{% end %}``
+    Caches the output of the template code between ``cache`` and ``end``
+    for ``ttl`` seconds (0 keeps it until it is evicted).  ``key`` is an
+    expression telling apart the variants of the fragment, and is combined
+    with the template name and line so that it only needs to be unique
+    within the block.  Rendered output is kept in the cache of the
+    `Loader`, a `TemplateCache` unless another backend was given::
+
+        {% cache current_user.name 300 %}{% module Sidebar() %}{% end %}
+
+    UI modules used within the block are activated again when its output
+    comes from the cache, so that their JavaScript and CSS are included.
+
+    ``{% break %}`` and ``{% continue %}`` are not allowed inside a cache
+    block, and cache blocks are not allowed inside an ``{% apply %}``
+    block, which can not wait on a cache backend returning Deferreds.
+
 ``{% comment ... %}``
     A comment which will be removed from the template output.  Note that
     there is no ``{% end %}`` tag; the comment goes from the word ``comment``
@@ -189,25 +206,41 @@ from __future__ import absolute_import, division, with_statement
 import collections
 import contextlib
 import datetime
+import getopt
+import hashlib
+import importlib.util
 import linecache
+import marshal
 import os.path
 import posixpath
 import re
 import sys
 import threading
+import time
 import traceback
+import types
 from io import StringIO
 from cyclone import escape
+from cyclone.util import LRUCache
 from cyclone.util import ObjectDict
 from cyclone.util import bytes_type
 from cyclone.util import unicode_type
 
 from twisted.python.failure import Failure
 from twisted.internet.defer import Deferred
+from twisted.internet.defer import inlineCallbacks
 
 _DEFAULT_AUTOESCAPE = "xhtml_escape"
 _UNSET = object()
 
+# The files `Loader.precompile` compiles, other files under the template
+# directory (images, scripts, ...) being left alone.
+TEMPLATE_EXTENSIONS = (".html", ".htm", ".xhtml", ".xml", ".txt")
+
+# Identifies the format of the files Loader saves compiled templates in;
+# marshalled code objects are only valid for the python that wrote them.
+_COMPILED_MAGIC = (1, importlib.util.MAGIC_NUMBER)
+
 
 class Template(object):
     """A compiled template.
@@ -216,7 +249,8 @@ class Template(object):
     the template from variables with generate().
     """
     def __init__(self, template_string, name="<string>", loader=None,
-                 compress_whitespace=None, autoescape=_UNSET):
+                 compress_whitespace=None, autoescape=_UNSET, cache=None,
+                 compiled=None):
         self.name = name
         if compress_whitespace is None:
             compress_whitespace = name.endswith(".html") or \
@@ -228,27 +262,50 @@ class Template(object):
         else:
             self.autoescape = _DEFAULT_AUTOESCAPE
         self.namespace = loader.namespace if loader else {}
-        reader = _TemplateReader(name, escape.native_str(template_string))
-        try:
-            self.file = _File(self, _parse(reader, self))
-            self.code = self._generate_python(loader, compress_whitespace)
-        except ParseError as e:
-            raise TemplateError("Error parsing template %s, line %d: %s" %(name, reader.line, str(e)))
-
+        if cache is not None:
+            self.cache = cache
+        elif loader:
+            self.cache = loader.cache
+        else:
+            self.cache = TemplateCache()
         self.loader = loader
-        try:
-            # Under python2.5, the fake filename used here must match
-            # the module name used in __name__ below.
-            self.compiled = compile(
-                escape.to_unicode(self.code),
-                "%s.generated.py" % self.name.replace('.', '_'),
-                "exec")
-        except Exception:
-            raise TemplateError("Error compiling template " + name + ":\n" +
-                                _format_code(self.code).rstrip())
-
-    def generate(self, **kwargs):
-        """Generate this template with the given arguments."""
+        self._source = escape.native_str(template_string)
+        self._file = None
+        filename = "%s.generated.py" % self.name.replace('.', '_')
+        if compiled is not None:
+            # Precompiled by a Loader: the template is only parsed if
+            # another one extends it.
+            self.code, self.compiled, self.dependencies = compiled
+        else:
+            reader = _TemplateReader(name, self._source)
+            try:
+                self._file = _File(self, _parse(reader, self))
+                self.code = self._generate_python(loader,
+                                                  compress_whitespace)
+            except ParseError as e:
+                raise TemplateError("Error parsing template %s, line %d: %s" %(name, reader.line, str(e)))
+
+            try:
+                # Under python2.5, the fake filename used here must match
+                # the module name used in __name__ below.
+                self.compiled = compile(
+                    escape.to_unicode(self.code), filename, "exec")
+            except Exception:
+                raise TemplateError("Error compiling template " + name +
+                                    ":\n" + _format_code(self.code).rstrip())
+        # The traceback module may still hold the source of a previous
+        # template of the same name (mainly in this module's unittests).
+        linecache.cache.pop(filename, None)
+
+        # The generated module is only run once, to build the namespace
+        # every render starts from.  Each render then binds the code of
+        # its _execute function to a copy of that namespace holding the
+        # render's arguments.
+        self._namespace = self._default_namespace()
+        exec(self.compiled, self._namespace, self._namespace)
+        self._execute_code = self._namespace.pop("_execute").__code__
+
+    def _default_namespace(self):
         namespace = {
             "escape": escape.xhtml_escape,
             "xhtml_escape": escape.xhtml_escape,
@@ -259,32 +316,106 @@ class Template(object):
             "datetime": datetime,
             "_utf8": escape.utf8,  # for internal use
             "_string_types": (unicode_type, bytes_type),
+            "_template_cache": self.cache,
+            # Hooks through which cached output keeps track of the UI
+            # modules used to render it; see RequestHandler.
+            "_record_modules": set,
+            "_stop_recording": _ignore,
+            "_activate_modules": _ignore,
+            "_pack_cached": _pack_cached,  # for internal use
+            "_unpack_cached": _unpack_cached,  # for internal use
             # __name__ and __loader__ allow the traceback mechanism to find
             # the generated source code.
             "__name__": self.name.replace('.', '_'),
             "__loader__": ObjectDict(get_source=lambda name: self.code),
         }
         namespace.update(self.namespace)
+        return namespace
+
+    def generate(self, **kwargs):
+        """Generate this template with the given arguments."""
+        namespace = self._namespace.copy()
         namespace.update(kwargs)
-        exec(self.compiled, namespace, namespace)
-        execute = namespace["_execute"]
-        # Clear the traceback module's cache of source data now that
-        # we've generated a new template (mainly for this module's
-        # unittests, where different tests reuse the same name).
-        linecache.clearcache()
+        execute = types.FunctionType(self._execute_code, namespace,
+                                     "_execute")
         try:
-            rv = execute()
-            assert isinstance(rv, Deferred), rv
+            # _execute is a generator that only yields the Deferreds the
+            # template has to wait for.  Templates that meet none run to
+            # completion here and never create a Deferred.
+            generator = execute()
+            try:
+                deferred = generator.send(None)
+            except StopIteration as e:
+                return e.value
+            rv = _resume(generator, deferred)
             if hasattr(rv, "result"):
                 # Deferred is already resolved.
                 # Return the result immidiatly to avoid compatibility problems.
-                rv = rv.result
+                d, rv = rv, rv.result
                 if isinstance(rv, Failure):
+                    # The failure is raised here, so the Deferred must
+                    # not report it as unhandled.
+                    d.addErrback(lambda failure: None)
                     rv.raiseException()
             return rv
         except Exception:
             raise TemplateError("Error executing template " + self.name + ":\n" + _format_code(traceback.format_exception(*sys.exc_info())))
 
+    def generate_cached(self, cache_key, ttl=0, **kwargs):
+        """Generate this template, keeping the output in the template cache
+        under cache_key for ttl seconds (0 keeps it until it is evicted).
+
+        Later calls with the same key return the cached output without
+        running the template.
+        """
+        namespace = self._namespace.copy()
+        namespace.update(kwargs)
+        key = "render:%s:%s" % (self.name, cache_key)
+
+        def cached(value):
+            if value is None:
+                return self._generate_cached(key, ttl, namespace, kwargs)
+            modules, output = _unpack_cached(value)
+            namespace["_activate_modules"](modules)
+            return output
+
+        value = self.cache.get(key)
+        if isinstance(value, Deferred):
+            return value.addCallback(cached)
+        return cached(value)
+
+    def _generate_cached(self, key, ttl, namespace, kwargs):
+        modules = namespace["_record_modules"]()
+
+        def stop(result):
+            namespace["_stop_recording"](modules)
+            return result
+
+        def store(output):
+            self.cache.set(key, _pack_cached(output, modules), ttl)
+            return output
+
+        try:
+            rv = self.generate(**kwargs)
+        except Exception:
+            stop(None)
+            raise
+        if isinstance(rv, Deferred):
+            return rv.addBoth(stop).addCallback(store)
+        return store(stop(rv))
+
+    @property
+    def file(self):
+        """The parsed template, parsed on first use for precompiled ones."""
+        if self._file is None:
+            reader = _TemplateReader(self.name, self._source)
+            try:
+                self._file = _File(self, _parse(reader, self))
+            except ParseError as e:
+                raise TemplateError("Error parsing template %s, line %d: %s" %
+                                    (self.name, reader.line, str(e)))
+        return self._file
+
     def _generate_python(self, loader, compress_whitespace):
         buffer = StringIO()
         try:
@@ -300,6 +431,11 @@ class Template(object):
                                  ancestors[0].template,
                                  compress_whitespace)
             ancestors[0].generate(writer)
+            # The names of the other templates the generated code was
+            # built from.
+            self.dependencies = frozenset(
+                [ancestor.template.name for ancestor in ancestors] +
+                list(writer.includes)) - frozenset([self.name])
             return buffer.getvalue()
         finally:
             buffer.close()
@@ -316,9 +452,76 @@ class Template(object):
         return ancestors
 
 
+def _ignore(*args):
+    pass
+
+
+def _pack_cached(output, modules):
+    # Cached output skips the {% module %} calls that produced it, so the
+    # names of the modules they used are kept with it to be activated
+    # again whenever it is reused.
+    return escape.utf8(",".join(sorted(modules))) + b"\n" + output
+
+
+def _unpack_cached(value):
+    modules, _, output = value.partition(b"\n")
+    return [m for m in escape.native_str(modules).split(",") if m], output
+
+
+class TemplateCache(object):
+    """Keeps rendered template output in memory.
+
+    Entries are evicted least recently used first once their total size
+    exceeds ``capacity`` bytes, or when their time to live runs out.
+
+    Other backends, like `RedisTemplateCache`, only need to implement
+    `get` and `set`; `get` may return a Deferred.
+    """
+    def __init__(self, capacity=10 * 1024 * 1024):
+        self._entries = LRUCache(capacity, weigh=lambda entry: len(entry[1]))
+
+    def get(self, key):
+        """Returns the output cached under key, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires and expires < time.time():
+            self._entries.pop(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl=0):
+        """Caches value under key for ttl seconds, or until evicted if ttl
+        is 0."""
+        self._entries[key] = (time.time() + ttl if ttl else 0, value)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class RedisTemplateCache(object):
+    """Keeps rendered template output in redis.
+
+    ``connection`` is a `cyclone.redis` connection; keys are prefixed with
+    ``prefix`` so that the cache can share a database.
+    """
+    def __init__(self, connection, prefix="cyclone:template:"):
+        self.connection = connection
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.connection.get(self.prefix + key).addCallback(escape.utf8)
+
+    def set(self, key, value, ttl=0):
+        return self.connection.set(self.prefix + key, value,
+                                   expire=ttl or None)
+
+
 class BaseLoader(object):
     """Base class for template loaders."""
-    def __init__(self, autoescape=_DEFAULT_AUTOESCAPE, namespace=None):
+    def __init__(self, autoescape=_DEFAULT_AUTOESCAPE, namespace=None,
+                 cache=None):
         """Creates a template loader.
 
         root_directory may be the empty string if this loader does not
@@ -326,9 +529,14 @@ class BaseLoader(object):
 
         autoescape must be either None or a string naming a function
         in the template namespace, such as "xhtml_escape".
+
+        cache keeps the output of ``{% cache %}`` blocks and of
+        `RequestHandler.render_string` calls given a ``cache_key``; a
+        `TemplateCache` is created if it is None.
         """
         self.autoescape = autoescape
         self.namespace = namespace or {}
+        self.cache = TemplateCache() if cache is None else cache
         self.templates = {}
         # self.lock protects self.templates.  It's a reentrant lock
         # because templates may load other templates via `include` or
@@ -338,9 +546,36 @@ class BaseLoader(object):
         self.lock = threading.RLock()
 
     def reset(self):
-        """Resets the cache of compiled templates."""
+        """Resets the cache of compiled templates and their output."""
         with self.lock:
             self.templates = {}
+            if isinstance(self.cache, TemplateCache):
+                self.cache.clear()
+
+    def reload_changed(self):
+        """Forgets the templates whose source changed since they were
+        loaded, and those that were built from them.
+
+        Loaders that cannot tell which sources changed forget every
+        template, like `reset`.
+        """
+        with self.lock:
+            changed = self._changed_sources()
+            if changed is None:
+                self.reset()
+                return
+            if not changed:
+                return
+            for name, template in list(self.templates.items()):
+                if name in changed or template.dependencies & changed:
+                    del self.templates[name]
+            if isinstance(self.cache, TemplateCache):
+                self.cache.clear()
+
+    def _changed_sources(self):
+        """Returns the names of the templates whose source changed since
+        they were loaded, or None if unknown."""
+        return None
 
     def resolve_path(self, name, parent_path=None):
         """Converts a possibly-relative path to absolute (used internally)."""
@@ -364,10 +599,63 @@ class Loader(BaseLoader):
     You must use a template loader to use template constructs like
     {% extends %} and {% include %}. Loader caches all templates after
     they are loaded the first time.
+
+    If ``compiled_path`` is given, compiled templates are also saved in
+    that directory, and loaded from it instead of being parsed and
+    compiled again as long as the sources they were built from are
+    unchanged.  `precompile` fills it ahead of time.
     """
-    def __init__(self, root_directory, **kwargs):
+    def __init__(self, root_directory, compiled_path=None, **kwargs):
         super(Loader, self).__init__(**kwargs)
         self.root = os.path.abspath(root_directory)
+        self.compiled_path = compiled_path and os.path.abspath(compiled_path)
+        # The mtimes and sizes of the sources of the loaded templates and
+        # of the templates they were built from.
+        self._versions = {}
+
+    def reset(self):
+        with self.lock:
+            super(Loader, self).reset()
+            self._versions = {}
+
+    def _changed_sources(self):
+        changed = set()
+        for name, version in list(self._versions.items()):
+            if self._version(name) != version:
+                changed.add(name)
+                del self._versions[name]
+        return changed
+
+    def _version(self, name):
+        try:
+            stat_result = os.stat(os.path.join(self.root, name))
+        except OSError:
+            return None
+        return stat_result.st_mtime_ns, stat_result.st_size
+
+    def precompile(self, extensions=TEMPLATE_EXTENSIONS):
+        """Loads every template under the root directory, that is every
+        file whose name ends with one of ``extensions``.
+
+        Returns a list of ``(name, exception)`` tuples for the files that
+        could not be compiled.
+        """
+        failures = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(
+                d for d in dirnames if not d.startswith(".") and
+                os.path.join(dirpath, d) != self.compiled_path)
+            for filename in sorted(filenames):
+                if filename.startswith(".") or \
+                        not filename.lower().endswith(tuple(extensions)):
+                    continue
+                name = os.path.relpath(os.path.join(dirpath, filename),
+                                       self.root).replace(os.sep, "/")
+                try:
+                    self.load(name)
+                except Exception as e:
+                    failures.append((name, e))
+        return failures
 
     def resolve_path(self, name, parent_path=None):
         if parent_path and not parent_path.startswith("<") and \
@@ -381,12 +669,73 @@ class Loader(BaseLoader):
         return name
 
     def _create_template(self, name):
-        path = os.path.join(self.root, name)
-        f = open(path, "rb")
-        template = Template(f.read(), name=name, loader=self)
-        f.close()
+        version = self._version(name)
+        with open(os.path.join(self.root, name), "rb") as f:
+            source = f.read()
+        template = None
+        if self.compiled_path:
+            template = self._load_compiled(name, source)
+        if template is None:
+            template = Template(source, name=name, loader=self)
+            if self.compiled_path:
+                self._save_compiled(template, source)
+        self._versions[name] = version
+        for dependency in template.dependencies:
+            if dependency not in self._versions:
+                self._versions[dependency] = self._version(dependency)
         return template
 
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.root, name), "rb") as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def _compiled_file(self, name):
+        return os.path.join(self.compiled_path, hashlib.sha1(
+            escape.utf8(name)).hexdigest() + ".tplc")
+
+    def _load_compiled(self, name, source):
+        try:
+            with open(self._compiled_file(name), "rb") as f:
+                entry = marshal.load(f)
+            magic, autoescape, digests, template_autoescape, code, \
+                compiled = entry
+        except Exception:
+            return None
+        if magic != _COMPILED_MAGIC or autoescape != self.autoescape:
+            return None
+        for dependency, digest in digests.items():
+            data = source if dependency == name else self._read(dependency)
+            if data is None or hashlib.sha1(data).hexdigest() != digest:
+                return None
+        return Template(source, name=name, loader=self,
+                        autoescape=template_autoescape,
+                        compiled=(code, compiled, frozenset(digests) -
+                                  frozenset([name])))
+
+    def _save_compiled(self, template, source):
+        digests = {template.name: hashlib.sha1(source).hexdigest()}
+        for dependency in template.dependencies:
+            data = self._read(dependency)
+            if data is None:
+                return
+            digests[dependency] = hashlib.sha1(data).hexdigest()
+        entry = (_COMPILED_MAGIC, self.autoescape, digests,
+                 template.autoescape, template.code, template.compiled)
+        path = self._compiled_file(template.name)
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            if not os.path.isdir(self.compiled_path):
+                os.makedirs(self.compiled_path)
+            with open(temp_path, "wb") as f:
+                marshal.dump(entry, f)
+            os.replace(temp_path, path)
+        except (IOError, OSError):
+            # The cache is only an optimization.
+            pass
+
 
 class DictLoader(BaseLoader):
     """A template loader that loads from a dictionary."""
@@ -405,6 +754,27 @@ class DictLoader(BaseLoader):
     def _create_template(self, name):
         return Template(self.dict[name], name=name, loader=self)
 
+    def _changed_sources(self):
+        return set(name for name, template in self.templates.items()
+                   if name not in self.dict or
+                   escape.native_str(self.dict[name]) != template._source)
+
+
+@inlineCallbacks
+def _resume(generator, deferred):
+    """Runs a template's _execute generator on from the first Deferred it
+    yielded, sending it the result of each Deferred it waits on."""
+    while True:
+        try:
+            try:
+                value = yield deferred
+            except Exception as e:
+                deferred = generator.throw(e)
+            else:
+                deferred = generator.send(value)
+        except StopIteration as e:
+            return e.value
+
 
 class _Node(object):
     def each_child(self):
@@ -418,6 +788,8 @@ class _Node(object):
             child.find_named_blocks(loader, named_blocks)
 
     def maybe_deferred(self, varName, writer):
+        if writer.synchronous:
+            return
         writer.write_line("while isinstance(%s, Deferred):" % varName, self.line)
         with writer.indent():
             writer.write_line("%s = yield %s" % (varName, varName), self.line)
@@ -431,9 +803,8 @@ class _File(_Node):
 
     def generate(self, writer):
         _write_line = lambda txt: writer.write_line(txt, self.line)
-        _write_line("from twisted.internet.defer import inlineCallbacks, returnValue, Deferred")
+        _write_line("from twisted.internet.defer import Deferred")
         _write_line("")
-        _write_line("@inlineCallbacks")
         _write_line("def _execute():")
         with writer.indent():
             # A workaround for the function to be considered a generator
@@ -443,7 +814,7 @@ class _File(_Node):
             _write_line("_buffer = []")
             _write_line("_append = _buffer.append")
             self.body.generate(writer)
-            _write_line("returnValue(_utf8('').join(_buffer))")
+            _write_line("return _utf8('').join(_buffer)")
 
     def each_child(self):
         return (self.body,)
@@ -527,6 +898,7 @@ class _IncludeBlock(_Node):
 
     def generate(self, writer):
         included = writer.loader.load(self.name, self.template_name)
+        writer.includes.add(included.name)
         with writer.include(included, self.line):
             included.file.body.generate(writer)
 
@@ -547,11 +919,70 @@ class _ApplyBlock(_Node):
         with writer.indent():
             writer.write_line("_buffer = []", self.line)
             writer.write_line("_append = _buffer.append", self.line)
-            self.body.generate(writer)
+            synchronous, writer.synchronous = writer.synchronous, True
+            try:
+                self.body.generate(writer)
+            finally:
+                writer.synchronous = synchronous
             writer.write_line("return _utf8('').join(_buffer)", self.line)
         writer.write_line("_append(_utf8(%s(%s())))" % (self.method, method_name), self.line)
 
 
+class _CacheBlock(_Node):
+    def __init__(self, key, ttl, line, body=None):
+        self.key = key
+        self.ttl = ttl
+        self.line = line
+        self.body = body
+
+    def each_child(self):
+        return (self.body,)
+
+    def generate(self, writer):
+        # The body renders into a buffer of its own, swapped in place of
+        # the template's one, rather than into a nested function so that
+        # it can still wait on Deferreds.
+        if writer.synchronous:
+            raise ParseError("cache block inside apply block on line %d" %
+                             self.line)
+        index = writer.apply_counter
+        writer.apply_counter += 1
+        key, cached, outer, modules = (
+            "_cache_key%d" % index, "_cached%d" % index, "_outer%d" % index,
+            "_modules%d" % index)
+        prefix = "block:%s:%d:" % (writer.current_template.name, self.line)
+        writer.write_line("%s = %r + str(%s)" % (key, prefix, self.key),
+                          self.line)
+        writer.write_line("%s = _template_cache.get(%s)" % (cached, key),
+                          self.line)
+        self.maybe_deferred(cached, writer)
+        writer.write_line("if %s is None:" % cached, self.line)
+        with writer.indent():
+            writer.write_line("%s = _record_modules()" % modules, self.line)
+            writer.write_line("%s = _buffer" % outer, self.line)
+            writer.write_line("_buffer = []", self.line)
+            writer.write_line("_append = _buffer.append", self.line)
+            writer.write_line("try:", self.line)
+            with writer.indent():
+                self.body.generate(writer)
+                writer.write_line("%s = _utf8('').join(_buffer)" % cached,
+                                  self.line)
+            writer.write_line("finally:", self.line)
+            with writer.indent():
+                writer.write_line("_stop_recording(%s)" % modules, self.line)
+                writer.write_line("_buffer = %s" % outer, self.line)
+                writer.write_line("_append = _buffer.append", self.line)
+            writer.write_line("_template_cache.set(%s, _pack_cached(%s, %s), "
+                              "%s)" % (key, cached, modules, self.ttl),
+                              self.line)
+        writer.write_line("else:", self.line)
+        with writer.indent():
+            writer.write_line("%s, %s = _unpack_cached(%s)" %
+                              (modules, cached, cached), self.line)
+            writer.write_line("_activate_modules(%s)" % modules, self.line)
+        writer.write_line("_append(%s)" % cached, self.line)
+
+
 class _ControlBlock(_Node):
     def __init__(self, statement, line, body=None):
         self.statement = statement
@@ -652,6 +1083,10 @@ class _CodeWriter(object):
         self.current_template = current_template
         self.compress_whitespace = compress_whitespace
         self.apply_counter = 0
+        self.includes = set()
+        # True while generating the body of a nested function, where
+        # values cannot be waited on.
+        self.synchronous = False
         self.include_stack = []
         self._indent = 0
 
@@ -895,13 +1330,14 @@ def _parse(reader, template, in_block=None, in_loop=None):
             body.chunks.append(block)
             continue
 
-        elif operator in ("apply", "block", "try", "if", "for", "while"):
+        elif operator in ("apply", "block", "cache", "try", "if", "for",
+                          "while"):
             # parse inner body recursively
             if operator in ("for", "while"):
                 block_body = _parse(reader, template, operator, operator)
-            elif operator == "apply":
+            elif operator in ("apply", "cache"):
                 # apply creates a nested function so syntactically it's not
-                # in the loop.
+                # in the loop, and cache must not skip restoring the buffer.
                 block_body = _parse(reader, template, operator, None)
             else:
                 block_body = _parse(reader, template, operator, in_loop)
@@ -915,6 +1351,12 @@ def _parse(reader, template, in_block=None, in_loop=None):
                 if not suffix:
                     raise ParseError("block missing name on line %d" % line)
                 block = _NamedBlock(suffix, block_body, template, line)
+            elif operator == "cache":
+                key, space, ttl = suffix.rpartition(" ")
+                if not key.strip() or not ttl:
+                    raise ParseError("cache missing key or ttl on line %d" %
+                                     line)
+                block = _CacheBlock(key.strip(), ttl, line, block_body)
             else:
                 block = _ControlBlock(contents, line, block_body)
             body.chunks.append(block)
@@ -929,3 +1371,61 @@ def _parse(reader, template, in_block=None, in_loop=None):
 
         else:
             raise ParseError("unknown operator: %r" % operator)
+
+
+def usage():
+    print("""\
+usage: cyclone templates [options] TEMPLATE_PATH
+Options:
+ -h --help              Show this help.
+ -c --compiled-path=DIR Save compiled templates in DIR \
+[default: TEMPLATE_PATH/.compiled]
+ -a --autoescape=NAME   Autoescape function, or None [default: xhtml_escape]
+ -e --extensions=LIST   Comma-separated extensions of the template files \
+[default: %s]
+
+Compiles every template under TEMPLATE_PATH ahead of time, for a Loader
+(or an Application with the compiled_template_path setting) using the
+same directory and autoescape setting to load instead of compiling them
+on first use.
+""" % ",".join(TEMPLATE_EXTENSIONS))
+    sys.exit(0)
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hc:a:e:",
+                                   ["help", "compiled-path=", "autoescape=",
+                                    "extensions="])
+    except getopt.GetoptError:
+        usage()
+
+    compiled_path = None
+    autoescape = _DEFAULT_AUTOESCAPE
+    extensions = TEMPLATE_EXTENSIONS
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+        elif o in ("-c", "--compiled-path"):
+            compiled_path = a
+        elif o in ("-a", "--autoescape"):
+            autoescape = None if a == "None" else a
+        elif o in ("-e", "--extensions"):
+            extensions = tuple(e.strip() for e in a.split(",") if e.strip())
+
+    if len(args) != 1:
+        usage()
+
+    compiled_path = compiled_path or os.path.join(args[0], ".compiled")
+    loader = Loader(args[0], compiled_path=compiled_path,
+                    autoescape=autoescape)
+    failures = loader.precompile(extensions)
+    for name, e in failures:
+        print("%s: %s" % (name, e))
+    print("%d templates compiled into %s" %
+          (len(loader.templates), loader.compiled_path))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,4 +33,23 @@ class TestEscape(unittest.TestCase):
         self.assertEqual(
             escape.xhtml_escape("\"'"),
             "&quot;&#39;"
-        )
\ No newline at end of file
+        )
+        self.assertEqual(
+            escape.xhtml_escape(b"Tom & <Jerry>"),
+            "Tom &amp; &lt;Jerry&gt;"
+        )
+        self.assertEqual(
+            escape.xhtml_escape("&lt;"),
+            "&amp;lt;"
+        )
+
+    def test_xhtml_list(self):
+        self.assertEqual(
+            escape.xhtml_escape_list(["<a>", b"&", "plain", ""]),
+            ["&lt;a&gt;", "&amp;", "plain", ""]
+        )
+        self.assertEqual(escape.xhtml_escape_list([]), [])
+        self.assertEqual(
+            escape.xhtml_escape_list(["a\0<", "b"]),
+            ["a\0&lt;", "b"]
+        )
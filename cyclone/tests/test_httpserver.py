@@ -49,14 +49,48 @@ class HTTPConnectionTest(unittest.TestCase):
         d = self.con.notifyFinish()
         self.assertIsInstance(d, Deferred)
 
-    def test_lineReceived(self):
+    def test_dataReceived(self):
         self.con.connectionMade()
-        line = b"Header: something"
-        self.con.lineReceived(line)
-        self.assertTrue(line + self.con.delimiter in self.con._headersbuffer)
         self.con._on_headers = Mock()
-        self.con.lineReceived(b"")
-        self.con._on_headers.assert_called_with(b'Header: something\r\n')
+        self.con.dataReceived(b"GET / HTTP/1.1\r\nHeader: some")
+        self.assertFalse(self.con._on_headers.called)
+        self.con.dataReceived(b"thing\r")
+        self.con.dataReceived(b"\n\r\n")
+        self.con._on_headers.assert_called_with(
+            b"GET / HTTP/1.1\r\nHeader: something\r\n")
+        self.assertEqual(self.con._buffer, b"")
+
+    def test_dataReceived_pipelined(self):
+        self.con.connectionMade()
+        self.con._on_headers = Mock()
+        self.con.transport = StringTransport()
+        self.con.dataReceived(
+            b"\r\nGET /a HTTP/1.1\r\n\r\nGET /b HTTP/1.1\r\n\r\nGET")
+        self.assertEqual(
+            [c[0][0] for c in self.con._on_headers.call_args_list],
+            [b"GET /a HTTP/1.1\r\n", b"GET /b HTTP/1.1\r\n"])
+        self.assertEqual(self.con._buffer, b"GET")
+
+    def test_dataReceived_raw_mode(self):
+        self.con.connectionMade()
+        self.con.rawDataReceived = Mock()
+
+        def on_headers(data):
+            self.con.setRawMode()
+        self.con._on_headers = on_headers
+        self.con.dataReceived(b"POST / HTTP/1.1\r\n\r\nbody")
+        self.con.rawDataReceived.assert_called_with(b"body")
+        self.con.dataReceived(b"more")
+        self.con.rawDataReceived.assert_called_with(b"more")
+
+    def test_dataReceived_head_too_long(self):
+        self.con.connectionMade()
+        self.con.transport = Mock()
+        self.con._on_headers = Mock()
+        self.con.dataReceived(b"GET / HTTP/1.1\r\n")
+        self.con.dataReceived(b"X" * (self.con.MAX_LENGTH + 1))
+        self.con.transport.loseConnection.assert_called_with()
+        self.assertFalse(self.con._on_headers.called)
 
     def test_rawDataReceived(self):
         self.con.connectionMade()
@@ -142,6 +176,7 @@ class HTTPConnectionTest(unittest.TestCase):
         with mock.patch.object(HTTPConnection, '_remote_ip', return_value=None) as m_obj:
             self.con = HTTPConnection()
             self.con.factory = Mock()
+            self.con.factory.settings = {}
             self.con.request_callback = Mock()
             self.con._remote_ip = "127.0.0.1"
             self.con.connectionMade()
@@ -177,6 +212,7 @@ class HTTPConnectionTest(unittest.TestCase):
         with mock.patch.object(HTTPConnection, '_remote_ip', return_value=None) as m_obj:
             self.con = HTTPConnection()
             self.con.factory = Mock()
+            self.con.factory.settings = {}
             self.con.setRawMode = Mock()
             self.con._remote_ip = "127.0.0.1"
             self.con.connectionMade()
@@ -192,6 +228,7 @@ class HTTPConnectionTest(unittest.TestCase):
         with mock.patch.object(HTTPConnection, '_remote_ip', return_value=None) as m_obj:
             self.con = HTTPConnection()
             self.con.factory = Mock()
+            self.con.factory.settings = {}
             self.con.transport = StringTransport()
             self.con.setRawMode = Mock()
             self.con._remote_ip = "127.0.0.1"
@@ -208,9 +245,11 @@ class HTTPConnectionTest(unittest.TestCase):
         with mock.patch.object(HTTPConnection, '_remote_ip', return_value=None) as m_obj:
             self.con = HTTPConnection()
             self.con.factory = Mock()
+            self.con.factory.settings = {}
             self.con.transport = StringTransport()
             self.con.setRawMode = Mock()
             self.con._remote_ip = "127.0.0.1"
+            self.con.factory.stream_request.return_value = None
             self.con.connectionMade()
             data = \
                 b"GET / HTTP/1.1\r\n"\
@@ -219,35 +258,53 @@ class HTTPConnectionTest(unittest.TestCase):
             self.con._on_headers(data)
             self.assertTrue(self.con._contentbuffer)
 
+    def test_on_headers_streaming_body(self):
+        self.con.factory.settings = {}
+        self.con.makeConnection(StringTransport())
+        consumer = self.con.factory.stream_request.return_value
+        self.con.dataReceived(
+            b"PUT / HTTP/1.1\r\nContent-Length: 6\r\n\r\nabc")
+        self.assertIsNone(self.con._contentbuffer)
+        self.assertTrue(self.con._request)
+        consumer._data_received.assert_called_with(b"abc")
+        self.assertFalse(consumer._body_received.called)
+        self.con.dataReceived(b"defGET")
+        consumer._data_received.assert_called_with(b"def")
+        consumer._body_received.assert_called_with()
+        self.assertEqual(self.con._buffer, b"GET")
+
     def test_on_request_body_get(self):
+        self.con.connectionMade()
         self.con.request_callback = Mock()
-        self.con._request = Mock()
-        self.con._request.method = "GET"
-        self.con._request.headers = {
+        request = self.con._incoming_request = Mock()
+        request.method = "GET"
+        request.headers = {
         }
         data = b""
         self.con._on_request_body(data)
         self.assertEqual(self.con.request_callback.call_count, 1)
 
     def test_on_request_body_post_form_data(self):
+        self.con.connectionMade()
         self.con.request_callback = Mock()
-        self.con._request = Mock()
-        self.con._request.arguments = {}
-        self.con._request.method = "POST"
-        self.con._request.headers = {
+        request = self.con._incoming_request = Mock()
+        request.arguments = {}
+        request.method = "POST"
+        request.headers = {
             "Content-Type": "application/x-www-form-urlencoded"
         }
         data = "a=b"
         self.con._on_request_body(data)
         self.assertEqual(self.con.request_callback.call_count, 1)
-        self.assertEqual(self.con._request.arguments, {"a": ["b"]})
+        self.assertEqual(request.arguments, {"a": ["b"]})
 
     def test_on_request_body_post_multipart_form_data(self):
+        self.con.connectionMade()
         self.con.request_callback = Mock()
-        self.con._request = Mock()
-        self.con._request.arguments = {}
-        self.con._request.method = "POST"
-        self.con._request.headers = {
+        request = self.con._incoming_request = Mock()
+        request.arguments = {}
+        request.method = "POST"
+        request.headers = {
             "Content-Type": "multipart/form-data; boundary=AaB03x"
         }
         data = \
@@ -258,7 +315,211 @@ class HTTPConnectionTest(unittest.TestCase):
             b"--AaB03x--\r\n"
         self.con._on_request_body(data)
         self.assertEqual(self.con.request_callback.call_count, 1)
-        self.assertEqual(self.con._request.arguments, {"a": [b"b"]})
+        # only MultipartParser parses multipart bodies, as they arrive
+        self.assertEqual(request.arguments, {})
+
+    def test_multipart_body_streamed(self):
+        self.con.factory.settings = {"multipart_spool_threshold": 4}
+        self.con.makeConnection(StringTransport())
+        requests = []
+        self.con.request_callback = requests.append
+        body = \
+            b"--AaB03x\r\n"\
+            b'Content-Disposition: form-data; name="a"\r\n'\
+            b"\r\n"\
+            b"b\r\n"\
+            b"--AaB03x\r\n"\
+            b'Content-Disposition: form-data; name="f"; filename="f"\r\n'\
+            b"\r\n"\
+            b"0123456789\r\n"\
+            b"--AaB03x--\r\n"
+        self.con.dataReceived(
+            b"POST / HTTP/1.1\r\n"
+            b"Content-Type: multipart/form-data; boundary=AaB03x\r\n"
+            b"Content-Length: %d\r\n\r\n" % len(body))
+        for i in range(len(body)):
+            self.con.dataReceived(body[i:i + 1])
+        self.assertEqual(len(requests), 1)
+        request = requests[0]
+        self.assertEqual(request.body, b"")
+        self.assertEqual(request.arguments, {"a": [b"b"]})
+        self.assertEqual(request.files["f"][0].file.read(), b"0123456789")
+
+    def test_chunked_body(self):
+        requests = self._pipelining_connection()
+        data = \
+            b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"\
+            b"3;ext=1\r\nabc\r\n"\
+            b"A\r\n0123456789\r\n"\
+            b"0\r\nX-Trailer: 1\r\n\r\n"\
+            b"GET /next HTTP/1.1\r\n\r\n"
+        for i in range(len(data)):
+            self.con.dataReceived(data[i:i + 1])
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0].body, b"abc0123456789")
+        self.assertEqual(len(self.con._pipeline), 1)
+        self.assertEqual(self.con._pipeline[0].path, "/next")
+
+    def test_chunked_body_malformed(self):
+        requests = self._pipelining_connection()
+        self.con.dataReceived(
+            b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"0x3\r\nabc\r\n0\r\n\r\n")
+        self.assertEqual(requests, [])
+        self.assertTrue(self.con.transport.disconnecting)
+
+    def test_chunked_body_trailer_too_long(self):
+        requests = self._pipelining_connection()
+        self.con.dataReceived(
+            b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"3\r\nabc\r\n0\r\n")
+        for i in range(self.con.MAX_LENGTH // 16):
+            self.con.dataReceived(b"X-Trailer: 123\r\n")
+        self.assertFalse(self.con.transport.disconnecting)
+        self.con.dataReceived(b"X-Trailer: 123\r\n")
+        self.assertEqual(requests, [])
+        self.assertTrue(self.con.transport.disconnecting)
+
+    def test_chunked_body_with_content_length(self):
+        requests = self._pipelining_connection()
+        self.con.dataReceived(
+            b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n"
+            b"Content-Length: 3\r\n\r\nabc")
+        self.assertEqual(requests, [])
+        self.assertTrue(self.con.transport.disconnecting)
+
+    def test_max_body_size(self):
+        requests = self._pipelining_connection(max_body_size=4)
+        self.con.dataReceived(
+            b"POST / HTTP/1.1\r\nContent-Length: 5\r\n\r\nabcde")
+        self.assertEqual(requests, [])
+        self.assertTrue(self.con.transport.value().startswith(
+            b"HTTP/1.1 413 Request Entity Too Large\r\n"))
+        self.assertTrue(self.con.transport.disconnecting)
+
+    def test_max_body_size_chunked(self):
+        requests = self._pipelining_connection(max_body_size=4)
+        self.con.dataReceived(
+            b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"3\r\nabc\r\n")
+        self.assertFalse(self.con.transport.disconnecting)
+        self.con.dataReceived(b"3\r\ndef\r\n0\r\n\r\n")
+        self.assertEqual(requests, [])
+        self.assertTrue(self.con.transport.value().startswith(
+            b"HTTP/1.1 413 Request Entity Too Large\r\n"))
+        self.assertTrue(self.con.transport.disconnecting)
+
+    def _pipelining_connection(self, **settings):
+        self.con.factory.settings = settings
+        self.con.makeConnection(StringTransport())
+        requests = []
+        self.con.request_callback = requests.append
+        return requests
+
+    def test_pipelining(self):
+        requests = self._pipelining_connection()
+        self.con.dataReceived(
+            b"GET /a HTTP/1.1\r\n\r\n"
+            b"POST /b HTTP/1.1\r\nContent-Length: 3\r\n"
+            b"Content-Type: application/x-www-form-urlencoded\r\n\r\nb=1"
+            b"GET /c HTTP/1.1\r\n\r\n")
+        self.assertEqual([r.path for r in requests], ["/a"])
+        self.assertEqual(len(self.con._pipeline), 2)
+        self.con.write(b"a")
+        requests[0].finish()
+        self.assertEqual([r.path for r in requests], ["/a", "/b"])
+        self.assertEqual(requests[1].arguments, {"b": ["1"]})
+        self.con.write(b"b")
+        requests[1].finish()
+        self.con.write(b"c")
+        requests[2].finish()
+        self.assertEqual([r.path for r in requests], ["/a", "/b", "/c"])
+        self.assertEqual(self.con.transport.value(), b"abc")
+        self.assertIsNone(self.con._request)
+
+    def test_pipelining_backpressure(self):
+        requests = self._pipelining_connection(max_pipelined_requests=1)
+        self.con.dataReceived(
+            b"GET /a HTTP/1.1\r\n\r\n"
+            b"GET /b HTTP/1.1\r\n\r\n"
+            b"GET /c HTTP/1.1\r\n\r\n")
+        self.assertTrue(self.con.paused)
+        self.assertEqual(self.con.transport.producerState, "paused")
+        self.assertEqual(len(self.con._pipeline), 1)
+        self.assertEqual(self.con._buffer, b"GET /c HTTP/1.1\r\n\r\n")
+        requests[0].finish()
+        self.assertEqual([r.path for r in requests], ["/a", "/b"])
+        self.assertEqual(len(self.con._pipeline), 1)
+        self.assertEqual(self.con._buffer, b"")
+        requests[1].finish()
+        self.assertEqual([r.path for r in requests], ["/a", "/b", "/c"])
+        self.assertFalse(self.con.paused)
+        self.assertEqual(self.con.transport.producerState, "producing")
+
+    def test_pipelining_many_requests(self):
+        requests = self._pipelining_connection()
+
+        def execute(request):
+            requests.append(request)
+            if request.path != "/slow":
+                self.con.write(request.path.encode("ascii") + b",")
+                request.finish()
+        self.con.request_callback = execute
+        self.con.dataReceived(b"GET /slow HTTP/1.1\r\n\r\n" + b"".join(
+            b"GET /%d HTTP/1.1\r\n\r\n" % i for i in range(500)))
+        self.assertEqual(len(requests), 1)
+        self.assertTrue(self.con.paused)
+        self.con.write(b"/slow,")
+        requests[0].finish()
+        self.assertEqual([r.path for r in requests],
+                         ["/slow"] + ["/%d" % i for i in range(500)])
+        self.assertEqual(self.con.transport.value(), b"".join(
+            r.path.encode("ascii") + b"," for r in requests))
+        self.assertFalse(self.con.paused)
+        self.assertIsNone(self.con._request)
+
+    def test_pipelining_streamed_body_waits(self):
+        requests = self._pipelining_connection(max_pipelined_requests=2)
+
+        def execute(request):
+            requests.append(request)
+            if request.path != "/slow":
+                request.finish()
+        execute.stream_request = lambda request: Mock()
+        self.con.request_callback = execute
+        self.con.dataReceived(
+            b"GET /slow HTTP/1.1\r\n\r\n"
+            b"GET /1 HTTP/1.1\r\n\r\n"
+            b"GET /2 HTTP/1.1\r\n\r\n"
+            b"POST /up HTTP/1.1\r\nContent-Length: 3\r\n\r\nabc")
+        self.assertTrue(self.con.paused)
+        requests[0].finish()
+        self.assertEqual([r.path for r in requests],
+                         ["/slow", "/1", "/2", "/up"])
+        self.assertEqual(requests[3].body, b"abc")
+
+    def test_pause_reasons(self):
+        self._pipelining_connection()
+        self.con.pause_reading("body")
+        self.con.pause_reading("pipeline")
+        self.con.pause_reading("pipeline")
+        self.con.resume_reading("pipeline")
+        self.assertTrue(self.con.paused)
+        self.assertEqual(self.con.transport.producerState, "paused")
+        self.con.resume_reading("pipeline")
+        self.con.resume_reading("body")
+        self.assertFalse(self.con.paused)
+        self.assertEqual(self.con.transport.producerState, "producing")
+
+    def test_pipelining_close_drops_queue(self):
+        requests = self._pipelining_connection()
+        self.con.dataReceived(
+            b"GET /a HTTP/1.1\r\nConnection: close\r\n\r\n"
+            b"GET /b HTTP/1.1\r\n\r\n")
+        requests[0].finish()
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(len(self.con._pipeline), 0)
+        self.assertTrue(self.con.transport.disconnecting)
 
     def test_remote_ip(self):
         self.con.transport = StringTransport()
@@ -1,6 +1,7 @@
 from twisted.trial import unittest
 
-from cyclone.httputil import HTTPHeaders
+from cyclone.httputil import HTTPHeaders, MultipartParser
+from cyclone.httputil import multipart_boundary, parse_multipart_form_data
 
 
 class TestHTTPHeaders(unittest.TestCase):
@@ -51,3 +52,106 @@ class TestHTTPHeaders(unittest.TestCase):
             headers.get("foo"), u"bar\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029asdf: jkl"
         )
         self.assertEqual(headers.get("baz"), "qux")
+
+
+class TestMultipartParser(unittest.TestCase):
+    body = (
+        b"--AaB03x\r\n"
+        b'Content-Disposition: form-data; name="a"\r\n'
+        b"\r\n"
+        b"b\r\n"
+        b"--AaB03x\r\n"
+        b'Content-Disposition: form-data; name="f"; filename="f.txt"\r\n'
+        b"Content-Type: text/plain\r\n"
+        b"\r\n"
+        b"0123456789\r\n--AaB0\r\n"
+        b"--AaB03x--\r\n")
+
+    def parse(self, chunk_size, **kwargs):
+        arguments, files = {}, {}
+        parser = MultipartParser(b"AaB03x", arguments, files, **kwargs)
+        for i in range(0, len(self.body), chunk_size):
+            parser.write(self.body[i:i + chunk_size])
+        parser.close()
+        return arguments, files
+
+    def test_chunks(self):
+        for chunk_size in (1, 3, 7, len(self.body)):
+            arguments, files = self.parse(chunk_size)
+            self.assertEqual(arguments, {"a": [b"b"]})
+            f = files["f"][0]
+            self.assertEqual(f.filename, "f.txt")
+            self.assertEqual(f.content_type, "text/plain")
+            self.assertEqual(f.body, b"0123456789\r\n--AaB0")
+            self.assertEqual(f.size, 18)
+            self.assertEqual(f.file, None)
+
+    def test_spool(self):
+        arguments, files = self.parse(5, spool_threshold=4)
+        f = files["f"][0]
+        self.assertNotEqual(f.file, None)
+        self.assertEqual(f.file.read(), b"0123456789\r\n--AaB0")
+        self.assertEqual(f.body, b"0123456789\r\n--AaB0")
+        self.assertEqual(f["body"], b"0123456789\r\n--AaB0")
+        self.assertEqual(arguments, {"a": [b"b"]})
+
+    def test_no_final_boundary(self):
+        arguments, files = {}, {}
+        parse_multipart_form_data(
+            b"AaB03x", self.body[:-12], arguments, files)
+        self.assertEqual(arguments, {})
+        self.assertEqual(files, {})
+
+    def test_no_final_boundary_spooled(self):
+        arguments, files = {}, {}
+        parser = MultipartParser(b"AaB03x", arguments, files,
+                                 spool_threshold=4)
+        parser.write(
+            b"--AaB03x\r\n"
+            b'Content-Disposition: form-data; name="f"; filename="f"\r\n'
+            b"\r\n"
+            b"0123456789\r\n"
+            b"--AaB03x\r\n"
+            b'Content-Disposition: form-data; name="g"; filename="g"\r\n'
+            b"\r\n" + b"0123456789" * 3)
+        complete = parser._files["f"][0].file
+        partial = parser._file.file
+        parser.close()
+        self.assertTrue(complete.closed)
+        self.assertTrue(partial.closed)
+        self.assertEqual(files, {})
+
+    def test_part_without_headers(self):
+        for part in (b"\r\n", b" bad\r\n\r\n"):
+            arguments, files = {}, {}
+            parse_multipart_form_data(
+                b"AaB03x",
+                b"--AaB03x\r\n" + part + b" indented\r\nbody\r\n"
+                b"--AaB03x\r\n"
+                b'Content-Disposition: form-data; name="a"\r\n'
+                b"\r\n"
+                b"b\r\n"
+                b"--AaB03x--\r\n", arguments, files)
+            self.assertEqual(arguments, {"a": [b"b"]})
+            self.assertEqual(files, {})
+
+    def test_missing_name(self):
+        arguments, files = {}, {}
+        parse_multipart_form_data(
+            b'"AaB03x"',
+            b"--AaB03x\r\n"
+            b"Content-Disposition: form-data\r\n"
+            b"\r\n"
+            b"b\r\n"
+            b"--AaB03x\r\n"
+            b"\r\n"
+            b"c\r\n"
+            b"--AaB03x--\r\n", arguments, files)
+        self.assertEqual(arguments, {})
+
+    def test_multipart_boundary(self):
+        self.assertEqual(
+            multipart_boundary("multipart/form-data; boundary=AaB03x"),
+            b"AaB03x")
+        self.assertEqual(multipart_boundary("multipart/form-data"), None)
+        self.assertEqual(multipart_boundary("text/plain"), None)
@@ -0,0 +1,50 @@
+#
+# Copyright 2014 David Novakovic
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+from unittest.mock import Mock
+
+from cyclone.sse import SSEHandler
+from cyclone.web import Application, SendQueue
+
+
+class SSEHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.app = Application(send_high_water_mark=30,
+                               send_queue_policy=SendQueue.DROP_OLDEST)
+        self.request = Mock()
+        self.request.connection.transport = StringTransport()
+        self.transport = self.request.connection.transport
+        self.handler = SSEHandler(self.app, self.request)
+
+    def test_send_event(self):
+        self.assertTrue(self.handler.sendEvent({"a": 1}, event="update",
+                                               eid=7, retry=1000))
+        self.assertEqual(self.transport.value(),
+                         b'id: 7\nevent: update\nretry: 1000\n'
+                         b'data: {"a": 1}\n\n')
+
+    def test_backpressure(self):
+        self.handler.on_backpressure = Mock()
+        queue = self.handler.send_queue
+        self.assertTrue(self.transport.producer is queue)
+        queue.pauseProducing()
+        for i in range(5):
+            self.assertTrue(self.handler.sendEvent("event %d" % i))
+        self.assertEqual(self.handler.on_backpressure.call_count, 3)
+        queue.resumeProducing()
+        self.assertEqual(self.transport.value(),
+                         b"data: event 3\n\ndata: event 4\n\n")
@@ -13,6 +13,9 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import linecache
+import os
+
 from twisted.internet import defer
 from twisted.trial import unittest
 from twisted.internet import reactor
@@ -146,3 +149,160 @@ class TestTemplates(unittest.TestCase):
             txt,
             b"-) hello <-> 3 :!"
         )
+
+    def test_cache(self):
+        calls = []
+
+        def count(value):
+            calls.append(value)
+            return value
+
+        t = template.Template(
+            r"{% for x in [1, 2] %}{% cache x 0 %}[{{ f(x) }}]{% end %}"
+            r"{% end %}{{ f(3) }}")
+        self.assertEqual(t.generate(f=count), b"[1][2]3")
+        self.assertEqual(t.generate(f=count), b"[1][2]3")
+        self.assertEqual(calls, [1, 2, 3, 3])
+
+    def test_cache_ttl(self):
+        cache = template.TemplateCache()
+        t = template.Template(r"{% cache 'k' 60 %}{{ x }}{% end %}",
+                              cache=cache)
+        self.assertEqual(t.generate(x=1), b"1")
+        self.assertEqual(t.generate(x=2), b"1")
+        key = list(cache._entries.keys())[0]
+        cache.set(key, b"1", -1)
+        self.assertEqual(t.generate(x=3), b"3")
+
+    def test_cache_parse_errors(self):
+        self.assertRaises(template.TemplateError, template.Template,
+                          r"{% cache 'k' %}{% end %}")
+        self.assertRaises(template.TemplateError, template.Template,
+                          r"{% for x in y %}{% cache x 1 %}{% break %}"
+                          r"{% end %}{% end %}")
+        self.assertRaises(template.TemplateError, template.Template,
+                          r"{% apply xhtml_escape %}{% cache 'k' 10 %}hi"
+                          r"{% end %}{% end %}")
+        loader = template.DictLoader({
+            "a.html": r"{% apply xhtml_escape %}{% include 'b.html' %}"
+                      r"{% end %}",
+            "b.html": r"{% cache 'k' 10 %}hi{% end %}",
+        })
+        self.assertRaises(template.TemplateError, loader.load, "a.html")
+
+    @defer.inlineCallbacks
+    def test_cache_deferred_backend(self):
+        values = {}
+        backend = Mock()
+        backend.get.side_effect = lambda key: defer.succeed(values.get(key))
+        backend.set.side_effect = \
+            lambda key, value, ttl: values.__setitem__(key, value)
+        loader = template.DictLoader({
+            "page.html": r"<{% cache 'nav' 5 %}{{ x }}{% end %}>",
+        }, cache=backend)
+        t = loader.load("page.html")
+        self.assertEqual((yield t.generate(x=1)), b"<1>")
+        self.assertEqual((yield t.generate(x=2)), b"<1>")
+        self.assertEqual(list(values.keys()), ["block:page.html:1:nav"])
+        backend.set.assert_called_once_with("block:page.html:1:nav", b"\n1",
+                                            5)
+
+    def test_renders_are_isolated(self):
+        t = template.Template(r"{% set y = x %}{{ y }}{{ z }}")
+        self.assertEqual(t.generate(x=1, z=2), b"12")
+        self.assertRaises(template.TemplateError, t.generate, x=1)
+        self.assertEqual(t.generate(x=3, z=4), b"34")
+
+    def test_linecache_kept(self):
+        linecache.cache["cyclone-test-entry"] = (0, None, [], "x")
+        template.Template(r"{{ x }}").generate(x=1)
+        self.assertTrue("cyclone-test-entry" in linecache.cache)
+        del linecache.cache["cyclone-test-entry"]
+
+    def test_apply(self):
+        t = template.Template(r"{% apply upper %}a{{ x }}{% end %}!")
+        self.assertEqual(t.generate(x="b", upper=lambda s: s.upper()),
+                         b"AB!")
+
+    @defer.inlineCallbacks
+    def test_deferred_failure(self):
+        d = defer.Deferred()
+        t = template.Template(r"{{ x }}{% try %}{{ y }}{% except %}-"
+                              r"{% end %}{{ z }}")
+        result = t.generate(x=1, y=d, z=2)
+        self.assertTrue(isinstance(result, defer.Deferred))
+        d.errback(ValueError())
+        self.assertEqual((yield result), b"1-2")
+
+
+class TestLoader(unittest.TestCase):
+    def setUp(self):
+        self.root = self.mktemp()
+        self.compiled_path = os.path.join(self.root, ".compiled")
+        os.mkdir(self.root)
+        self.write("base.html", "<{% block body %}{% end %}>")
+        self.write("page.html", '{% extends "base.html" %}'
+                                '{% block body %}{{ x }}{% end %}')
+
+    def write(self, name, source):
+        with open(os.path.join(self.root, name), "w") as f:
+            f.write(source)
+
+    def loader(self):
+        return template.Loader(self.root, compiled_path=self.compiled_path)
+
+    def test_precompile(self):
+        self.write("broken.html", "{% if %}")
+        self.write("app.js", "{{ x")
+        failures = self.loader().precompile()
+        self.assertEqual([name for name, e in failures], ["broken.html"])
+        self.assertEqual(len(os.listdir(self.compiled_path)), 2)
+
+        loader = self.loader()
+        page = loader.load("page.html")
+        self.assertTrue(page._file is None)
+        self.assertEqual(page.dependencies, frozenset(["base.html"]))
+        self.assertEqual(page.generate(x="&"), b"<&amp;>")
+
+    def test_extends_precompiled(self):
+        self.loader().precompile()
+        self.write("other.html", '{% extends "base.html" %}'
+                                 '{% block body %}other{% end %}')
+        loader = self.loader()
+        self.assertEqual(loader.load("other.html").generate(), b"<other>")
+        self.assertFalse(loader.load("base.html")._file is None)
+
+    def test_dependency_changed(self):
+        self.loader().precompile()
+        self.write("base.html", "[{% block body %}{% end %}]")
+        page = self.loader().load("page.html")
+        self.assertFalse(page._file is None)
+        self.assertEqual(page.generate(x=1), b"[1]")
+
+    def test_autoescape_changed(self):
+        self.loader().precompile()
+        loader = template.Loader(self.root, compiled_path=self.compiled_path,
+                                 autoescape=None)
+        self.assertEqual(loader.load("page.html").generate(x="&"), b"<&>")
+
+    def test_reload_changed(self):
+        self.write("other.html", "other")
+        loader = template.Loader(self.root)
+        page = loader.load("page.html")
+        other = loader.load("other.html")
+        loader.reload_changed()
+        self.assertTrue(loader.load("page.html") is page)
+        self.write("base.html", "[{% block body %}{% end %}]!")
+        loader.reload_changed()
+        self.assertFalse("page.html" in loader.templates)
+        self.assertTrue(loader.load("other.html") is other)
+        self.assertEqual(loader.load("page.html").generate(x=1), b"[1]!")
+
+    def test_reload_changed_dict(self):
+        sources = {"a.html": "a", "b.html": '{% include "a.html" %}b'}
+        loader = template.DictLoader(sources)
+        self.assertEqual(loader.load("b.html").generate(), b"ab")
+        sources["a.html"] = "A"
+        loader.reload_changed()
+        self.assertEqual(loader.templates, {})
+        self.assertEqual(loader.load("b.html").generate(), b"Ab")
@@ -14,18 +14,38 @@
 # under the License.
 
 from twisted.trial import unittest
-from cyclone.web import RequestHandler, HTTPError
+from cyclone.web import RequestHandler, HTTPError, RedirectHandler
 from cyclone.web import Application, URLSpec, URLReverseError
+from cyclone.web import stream_request_body, StaticFileHandler
+from cyclone.web import _RouteTable, SendQueue
+from cyclone import web
+from cyclone.web import ChunkedTransferEncoding, GZipContentEncoding
+from cyclone.web import BrotliContentEncoding, ZstdContentEncoding
+from cyclone.httputil import HTTPHeaders
+from cyclone.testing import Client
 from cyclone.escape import unicode_type
 from unittest.mock import Mock
 from datetime import datetime
 from http import cookies as http_cookies
 import email.utils
 import calendar
+import gzip
+import os
 import time
 from twisted.internet import defer, reactor
+from twisted.test.proto_helpers import StringTransport
 from cyclone.template import DictLoader
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 class RequestHandlerTest(unittest.TestCase):
     def assertHasAttr(self, obj, attr_name):
         assert hasattr(obj, attr_name)
@@ -45,6 +65,21 @@ class RequestHandlerTest(unittest.TestCase):
     def test_settings(self):
         self.assertEqual(self.rh.settings, {"some_setting": "foo"})
 
+    def test_precompiled_template_loader(self):
+        path = self.mktemp()
+        os.mkdir(path)
+        for name, data in (("page.html", b"{{ x }}"), ("app.js", b"{{ x"),
+                           ("logo.png", b"\x89PNG\r\n\x1a\n\xff")):
+            with open(os.path.join(path, name), "wb") as f:
+                f.write(data)
+        app = Application(template_path=path,
+                          compiled_template_path=os.path.join(path, ".c"))
+        self.assertEqual(list(app.template_loader.templates), ["page.html"])
+        rh = RequestHandler(app, self.request)
+        self.assertIs(rh.create_template_loader(path), app.template_loader)
+        self.assertIsNot(rh.create_template_loader(self.mktemp()),
+                         app.template_loader)
+
     def test_default(self):
         self.assertRaises(HTTPError, self.rh.default)
 
@@ -314,6 +349,330 @@ class RequestHandlerTest(unittest.TestCase):
         self.rh.static_url("/")
 
 
+@stream_request_body
+class StreamingHandler(RequestHandler):
+    def prepare(self):
+        self.chunks = []
+        self.pending = None
+
+    def data_received(self, chunk):
+        self.chunks.append(chunk)
+        if chunk == b"slow":
+            self.pending = defer.Deferred()
+            return self.pending
+
+    def put(self):
+        self.finish(b"|".join(self.chunks))
+
+
+class StreamRequestBodyTest(unittest.TestCase):
+    def setUp(self):
+        self.app = Application([(r"/", StreamingHandler)])
+        self.con = self.app.buildProtocol(None)
+        self.con.makeConnection(StringTransport())
+
+    def test_not_a_handler(self):
+        self.assertRaises(TypeError, stream_request_body, object)
+
+    def test_stream(self):
+        self.con.dataReceived(
+            b"PUT / HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc")
+        self.assertEqual(self.con.transport.value(), b"")
+        self.con.dataReceived(b"defg")
+        self.con.dataReceived(b"hij")
+        response = self.con.transport.value()
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK\r\n"))
+        self.assertTrue(response.endswith(b"\r\n\r\nabc|defg|hij"))
+
+    def test_stream_backpressure(self):
+        self.con.dataReceived(
+            b"PUT / HTTP/1.1\r\nContent-Length: 8\r\n\r\nslow")
+        handler = self.con._body_consumer
+        self.assertTrue(self.con.paused)
+        self.con.dataReceived(b"fast")
+        self.assertEqual(handler.chunks, [b"slow"])
+        handler.pending.callback(None)
+        self.assertFalse(self.con.paused)
+        self.assertEqual(handler.chunks, [b"slow", b"fast"])
+        self.assertTrue(self.con.transport.value().endswith(b"slow|fast"))
+
+    def test_not_streamed(self):
+        self.app = Application([(r"/", RequestHandler)])
+        self.assertEqual(self.app.stream_request(Mock()), None)
+
+
+class StaticFileHandlerTest(unittest.TestCase):
+    def setUp(self):
+        path = self.mktemp()
+        os.mkdir(path)
+        with open(os.path.join(path, "a.txt"), "wb") as f:
+            f.write(b"0123456789")
+        self.client = Client(Application([
+            (r"/(.*)", StaticFileHandler, {"path": path})]))
+
+    def get(self, **headers):
+        headers = dict((k.replace("_", "-"), v) for k, v in headers.items())
+        return self.client.get(
+            "/a.txt", version="HTTP/1.1", headers=HTTPHeaders(headers))
+
+    @defer.inlineCallbacks
+    def test_get(self):
+        response = yield self.get()
+        self.assertEqual(response.get_status(), 200)
+        self.assertEqual(response.content, b"0123456789")
+        self.assertEqual(response.headers["Content-Length"], "10")
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertEqual(response.headers["Content-Type"], "text/plain")
+
+    @defer.inlineCallbacks
+    def test_etag(self):
+        response = yield self.get()
+        response = yield self.get(If_None_Match=response.headers["Etag"])
+        self.assertEqual(response.get_status(), 304)
+        self.assertEqual(response.content, b"")
+
+    @defer.inlineCallbacks
+    def test_head(self):
+        response = yield self.client.head("/a.txt")
+        self.assertEqual(response.get_status(), 200)
+        self.assertEqual(response.headers["Content-Length"], "10")
+        self.assertEqual(response.content, b"")
+
+    @defer.inlineCallbacks
+    def test_range(self):
+        response = yield self.get(Range="bytes=2-4")
+        self.assertEqual(response.get_status(), 206)
+        self.assertEqual(response.content, b"234")
+        self.assertEqual(response.headers["Content-Range"], "bytes 2-4/10")
+        self.assertEqual(response.headers["Content-Length"], "3")
+        response = yield self.get(Range="bytes=-3")
+        self.assertEqual(response.content, b"789")
+
+    @defer.inlineCallbacks
+    def test_multiple_ranges(self):
+        response = yield self.get(Range="bytes=0-1,8-")
+        self.assertEqual(response.get_status(), 206)
+        ctype = response.headers["Content-Type"]
+        self.assertTrue(ctype.startswith("multipart/byteranges; boundary="))
+        boundary = ctype.split("=", 1)[1].encode()
+        self.assertEqual(
+            response.content,
+            b"--" + boundary + b"\r\n"
+            b"Content-Type: text/plain\r\n"
+            b"Content-Range: bytes 0-1/10\r\n\r\n01\r\n"
+            b"--" + boundary + b"\r\n"
+            b"Content-Type: text/plain\r\n"
+            b"Content-Range: bytes 8-9/10\r\n\r\n89\r\n"
+            b"--" + boundary + b"--\r\n")
+        self.assertEqual(int(response.headers["Content-Length"]),
+                         len(response.content))
+
+    @defer.inlineCallbacks
+    def test_range_not_satisfiable(self):
+        response = yield self.get(Range="bytes=10-")
+        self.assertEqual(response.get_status(), 416)
+        self.assertEqual(response.headers["Content-Range"], "bytes */10")
+        self.assertEqual(response.content, b"")
+
+    @defer.inlineCallbacks
+    def test_if_range(self):
+        response = yield self.get()
+        etag = response.headers["Etag"]
+        response = yield self.get(Range="bytes=2-4", If_Range=etag)
+        self.assertEqual(response.get_status(), 206)
+        response = yield self.get(Range="bytes=2-4", If_Range='"other"')
+        self.assertEqual(response.get_status(), 200)
+        self.assertEqual(response.content, b"0123456789")
+
+
+class StaticFilePrecompressedTest(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        os.mkdir(self.path)
+        self.write("a.js", b"var a = 1;")
+        self.write("a.js.gz", gzip.compress(b"var a = 1;"))
+        self.write("a.js.br", b"brotli")
+        self.client = Client(Application([
+            (r"/(.*)", StaticFileHandler, {"path": self.path})],
+            static_precompressed=True))
+
+    def write(self, name, data):
+        with open(os.path.join(self.path, name), "wb") as f:
+            f.write(data)
+
+    def get(self, **headers):
+        headers = dict((k.replace("_", "-"), v) for k, v in headers.items())
+        return self.client.get(
+            "/a.js", version="HTTP/1.1", headers=HTTPHeaders(headers))
+
+    @defer.inlineCallbacks
+    def test_sibling(self):
+        response = yield self.get(Accept_Encoding="gzip, br")
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(response.headers["Content-Length"], "6")
+        self.assertEqual(response.content, b"brotli")
+        response = yield self.get(Accept_Encoding="gzip")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), b"var a = 1;")
+
+    @defer.inlineCallbacks
+    def test_identity(self):
+        response = yield self.get()
+        self.assertFalse("Content-Encoding" in response.headers)
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(response.content, b"var a = 1;")
+        response = yield self.get(Accept_Encoding="br", Range="bytes=0-2")
+        self.assertFalse("Content-Encoding" in response.headers)
+        self.assertEqual(response.content, b"var")
+
+    @defer.inlineCallbacks
+    def test_etag(self):
+        etags = []
+        for accept_encoding in ("", "br", "gzip"):
+            response = yield self.get(Accept_Encoding=accept_encoding)
+            etags.append(response.headers["Etag"])
+        self.assertEqual(len(set(etags)), 3)
+        self.assertTrue(etags[2].endswith('-gzip"'))
+        response = yield self.get(Accept_Encoding="gzip",
+                                  If_None_Match=etags[2])
+        self.assertEqual(response.get_status(), 304)
+        response = yield self.get(If_None_Match=etags[2])
+        self.assertEqual(response.get_status(), 200)
+        self.assertEqual(response.headers["Etag"], etags[0])
+
+    @defer.inlineCallbacks
+    def test_stale_sibling(self):
+        os.utime(os.path.join(self.path, "a.js.br"), (0, 0))
+        response = yield self.get(Accept_Encoding="br")
+        self.assertFalse("Content-Encoding" in response.headers)
+        self.assertEqual(response.content, b"var a = 1;")
+
+    @defer.inlineCallbacks
+    def test_compressed_on_the_fly(self):
+        self.write("b.js", b"var b = 2;\n" * 500)
+        client = Client(Application([
+            (r"/(.*)", StaticFileHandler, {"path": self.path})],
+            static_precompressed=True, gzip=True))
+        headers = HTTPHeaders({"Accept-Encoding": "gzip"})
+        response = yield client.get("/b.js", version="HTTP/1.1",
+                                    headers=headers)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content),
+                         b"var b = 2;\n" * 500)
+        self.assertEqual(int(response.headers["Content-Length"]),
+                         len(response.content))
+        self.assertTrue(response.headers["Etag"].endswith('-gzip"'))
+        response = yield client.get("/a.js", version="HTTP/1.1",
+                                    headers=headers)
+        self.assertEqual(response.content, gzip.compress(b"var a = 1;"))
+        headers["Range"] = "bytes=0-2"
+        response = yield client.get("/b.js", version="HTTP/1.1",
+                                    headers=headers)
+        self.assertFalse("Content-Encoding" in response.headers)
+        self.assertEqual(response.content, b"var")
+
+    @defer.inlineCallbacks
+    def test_cached_sibling(self):
+        self.client.app.settings["static_cache_size"] = 4096
+        StaticFileHandler.reset()
+        self.addCleanup(StaticFileHandler.reset)
+        yield self.get()
+        os.remove(os.path.join(self.path, "a.js.br"))
+        response = yield self.get(Accept_Encoding="br")
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(response.content, b"brotli")
+
+
+class StaticFileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        os.mkdir(self.path)
+        self.write(b"body { color: red; }" * 10)
+        self.app = Application([
+            (r"/(.*)", StaticFileHandler, {"path": self.path})],
+            static_cache_size=4096, static_cache_revalidate=3600, gzip=True,
+            gzip_min_length=100)
+        self.client = Client(self.app)
+        StaticFileHandler.reset()
+        self.addCleanup(StaticFileHandler.reset)
+
+    def write(self, data):
+        with open(os.path.join(self.path, "a.css"), "wb") as f:
+            f.write(data)
+
+    def get(self, **headers):
+        headers = dict((k.replace("_", "-"), v) for k, v in headers.items())
+        return self.client.get(
+            "/a.css", version="HTTP/1.1", headers=HTTPHeaders(headers))
+
+    @defer.inlineCallbacks
+    def test_cached(self):
+        response = yield self.get()
+        self.assertEqual(response.content, b"body { color: red; }" * 10)
+        os.remove(os.path.join(self.path, "a.css"))
+        response = yield self.get(Range="bytes=0-3")
+        self.assertEqual(response.get_status(), 206)
+        self.assertEqual(response.content, b"body")
+
+    @defer.inlineCallbacks
+    def test_default_filename(self):
+        self.app = Application([
+            (r"/(.*)", StaticFileHandler,
+             {"path": self.path, "default_filename": "a.css"})],
+            static_cache_size=4096, static_cache_revalidate=3600)
+        client = Client(self.app)
+        response = yield client.get("/", version="HTTP/1.1")
+        self.assertEqual(response.content, b"body { color: red; }" * 10)
+        os.remove(os.path.join(self.path, "a.css"))
+        response = yield client.get("/", version="HTTP/1.1")
+        self.assertEqual(response.content, b"body { color: red; }" * 10)
+
+    @defer.inlineCallbacks
+    def test_revalidate(self):
+        yield self.get()
+        self.app.settings["static_cache_revalidate"] = 0
+        self.write(b"p {}")
+        response = yield self.get()
+        self.assertEqual(response.content, b"p {}")
+
+    def test_reload_changed(self):
+        settings = {"static_path": self.path}
+        version = StaticFileHandler.get_version(settings, "a.css")
+        StaticFileHandler.reload_changed()
+        self.assertEqual(StaticFileHandler.get_version(settings, "a.css"),
+                         version)
+        self.write(b"p {}")
+        StaticFileHandler.reload_changed()
+        self.assertNotEqual(StaticFileHandler.get_version(settings, "a.css"),
+                            version)
+
+    @defer.inlineCallbacks
+    def test_unknown_type(self):
+        with open(os.path.join(self.path, "LICENSE"), "wb") as f:
+            f.write(b"license " * 100)
+        response = yield self.client.get(
+            "/LICENSE", version="HTTP/1.1",
+            headers=HTTPHeaders({"Accept-Encoding": "gzip"}))
+        self.assertEqual(response.get_status(), 200)
+        self.assertFalse("Content-Encoding" in response.headers)
+        self.assertEqual(response.content, b"license " * 100)
+
+    @defer.inlineCallbacks
+    def test_gzip_variant(self):
+        yield self.get()
+        response = yield self.get(Accept_Encoding="gzip")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(response.content),
+                         b"body { color: red; }" * 10)
+        self.assertEqual(int(response.headers["Content-Length"]),
+                         len(response.content))
+        identity = yield self.get()
+        self.assertEqual(response.headers["Etag"],
+                         identity.headers["Etag"][:-1] + '-gzip"')
+
+
 class TestUrlSpec(unittest.TestCase):
 
     def test_reverse(self):
@@ -359,6 +718,223 @@ class TestUrlSpec(unittest.TestCase):
             "/page/11/22/33?hello=world")
 
 
+class TestRouteTable(unittest.TestCase):
+    def setUp(self):
+        self.specs = [URLSpec(pattern, None) for pattern in (
+            r"/static/(.*)", r"/(favicon\.ico)", r"/posts?/([0-9]+)",
+            r"/(.*)/edit", r"/post/new", r"/a|/b", r"/post/(?P<id>\w+)")]
+        self.table = _RouteTable(self.specs)
+
+    def linear_match(self, path):
+        for spec in self.specs:
+            if spec.regex.match(path):
+                return spec
+
+    def test_first_match(self):
+        for path in ("/static/a.css", "/favicon.ico", "/favicon-ico",
+                     "/post/12", "/posts/12", "/post/new", "/post/new/edit",
+                     "/post/x", "/a", "/b", "/bx", "/", "/unknown", ""):
+            spec, match = self.table.match(path)
+            self.assertIs(spec, self.linear_match(path), path)
+            self.assertEqual(match is None, spec is None)
+
+    def test_add_handlers(self):
+        app = Application([(r"/a", RequestHandler)])
+        request = Mock(host="example.com", path="/b", headers={})
+        self.assertEqual(app._find_handler(request)[0], app.error_handler)
+        app.add_handlers(r"example\.com", [(r"/b", StaticFileHandler)])
+        self.assertEqual(app._find_handler(request)[0], StaticFileHandler)
+        request.host = "other.com"
+        self.assertEqual(app._find_handler(request)[0], app.error_handler)
+        app.add_handlers(r".*", [(r"/b", RedirectHandler)])
+        self.assertEqual(app._find_handler(request)[0], RedirectHandler)
+
+
+class TestRouteCache(unittest.TestCase):
+    def test_cache(self):
+        app = Application([(r"/a/([^/]+)", RequestHandler)],
+                          route_cache_size=2)
+        request = Mock(host="example.com", path="/a/x%20y", headers={})
+        result = app._find_handler(request)
+        self.assertEqual(result[0], RequestHandler)
+        self.assertEqual(result[2], ["x y"])
+        self.assertIs(app._find_handler(request), result)
+        self.assertEqual((app.route_cache.hits, app.route_cache.misses),
+                         (1, 1))
+        request.path = "/b"
+        self.assertEqual(app._find_handler(request)[0], app.error_handler)
+        self.assertEqual(len(app.route_cache), 1)
+        app.add_handlers(r".*", [(r"/b", StaticFileHandler)])
+        self.assertEqual(len(app.route_cache), 0)
+        self.assertEqual(app._find_handler(request)[0], StaticFileHandler)
+
+    def test_disabled(self):
+        app = Application([(r"/a", RequestHandler)])
+        self.assertEqual(app.route_cache, None)
+
+
+class TestFlush(unittest.TestCase):
+    def setUp(self):
+        self.request = Mock()
+        self.request.method = "GET"
+        self.request.version = "HTTP/1.1"
+        self.request.headers = HTTPHeaders({"Accept-Encoding": "gzip"})
+        self.request.supports_http_1_1.return_value = True
+        app = Mock(ui_methods={}, ui_modules={}, settings={})
+        self.handler = RequestHandler(app, self.request)
+        self.handler._transforms = []
+
+    def test_write_sequence(self):
+        self.handler.write(b"abc")
+        self.handler.write(b"def")
+        self.handler.finish()
+        self.assertFalse(self.request.write.called)
+        parts = self.request.write_sequence.call_args[0][0]
+        self.assertEqual(len(parts), 3)
+        self.assertTrue(parts[0].endswith(b"Content-Length: 6\r\n\r\n"))
+        self.assertEqual(parts[1:], [b"abc", b"def"])
+
+    def test_chunked(self):
+        self.handler._transforms = [ChunkedTransferEncoding(self.request)]
+        self.handler.write(b"abc")
+        self.handler.write(b"de")
+        self.handler.flush()
+        parts = self.request.write_sequence.call_args[0][0]
+        self.assertTrue(b"Transfer-Encoding: chunked" in parts[0])
+        self.assertEqual(b"".join(parts[1:]), b"5\r\nabcde\r\n")
+        self.handler.finish()
+        self.request.write.assert_called_with(b"0\r\n\r\n")
+
+    def test_gzip(self):
+        self.handler._transforms = [GZipContentEncoding(self.request)]
+        self.handler.set_header("Content-Type", "text/plain")
+        self.handler.write(b"abc" * 200)
+        self.handler.write(b"def" * 200)
+        self.handler.finish()
+        headers, body = self.request.write_sequence.call_args[0][0]
+        self.assertTrue(b"Content-Encoding: gzip" in headers)
+        self.assertTrue(("Content-Length: %d" % len(body)).encode()
+                        in headers)
+        self.assertEqual(gzip.decompress(body), b"abc" * 200 + b"def" * 200)
+
+    def test_gzip_min_length(self):
+        self.handler._transforms = [GZipContentEncoding(self.request)]
+        self.handler.write(b"abc" * 10)
+        self.handler.finish()
+        headers, body = self.request.write_sequence.call_args[0][0]
+        self.assertFalse(b"Content-Encoding" in headers)
+        self.assertEqual(body, b"abc" * 10)
+
+    def test_gzip_streaming(self):
+        self.handler._transforms = [GZipContentEncoding(self.request)]
+        self.handler.set_header("Content-Type", "text/plain")
+        self.handler.write(b"abc")
+        self.handler.flush()
+        self.handler.write(b"def")
+        self.handler.finish()
+        first = self.request.write_sequence.call_args[0][0][1]
+        last = self.request.write.call_args[0][0]
+        self.assertEqual(gzip.decompress(first + last), b"abcdef")
+
+    def test_gzip_configure(self):
+        self.assertTrue(GZipContentEncoding.configure({}) is
+                        GZipContentEncoding)
+        transform = GZipContentEncoding.configure({
+            "gzip_compress_level": 1, "gzip_min_length": 0,
+            "gzip_content_types": ["text/*"]})
+        self.assertTrue(issubclass(transform, GZipContentEncoding))
+        self.assertEqual(transform.GZIP_LEVEL, 1)
+        self.assertTrue(transform.compressible_type("text/csv"))
+        self.assertFalse(transform.compressible_type("application/json"))
+        self.handler._transforms = [transform(self.request)]
+        self.handler.set_header("Content-Type", "text/csv")
+        self.handler.write(b"a,b")
+        self.handler.finish()
+        headers, body = self.request.write_sequence.call_args[0][0]
+        self.assertTrue(b"Content-Encoding: gzip" in headers)
+        self.assertEqual(gzip.decompress(body), b"a,b")
+
+    def test_encoding_negotiation(self):
+        transform = GZipContentEncoding.configure({}, ["br", "gzip"])
+        self.assertEqual(transform.ENCODINGS, ("br", "gzip"))
+        self.request.headers["Accept-Encoding"] = "gzip, br"
+        self.assertFalse(transform(self.request)._compressing)
+        self.request.headers["Accept-Encoding"] = "gzip, br;q=0.5"
+        self.assertTrue(transform(self.request)._compressing)
+        self.request.headers["Accept-Encoding"] = "*;q=0.1, br;q=0"
+        self.assertTrue(transform(self.request)._compressing)
+        self.request.headers["Accept-Encoding"] = "gzip;q=0, br"
+        self.assertFalse(transform(self.request)._compressing)
+
+    def _compressed_response(self, transform):
+        self.request.headers["Accept-Encoding"] = transform.ENCODING
+        self.handler._transforms = [transform(self.request)]
+        self.handler.write(b"abc" * 200)
+        self.handler.flush()
+        self.handler.write(b"def" * 200)
+        self.handler.finish()
+        headers, first = self.request.write_sequence.call_args[0][0]
+        self.assertTrue(("Content-Encoding: %s" % transform.ENCODING).encode()
+                        in headers)
+        return first + self.request.write.call_args[0][0]
+
+    def test_brotli(self):
+        body = self._compressed_response(BrotliContentEncoding)
+        self.assertEqual(brotli.decompress(body), b"abc" * 200 + b"def" * 200)
+
+    def test_zstd(self):
+        body = self._compressed_response(ZstdContentEncoding)
+        self.assertEqual(zstandard.ZstdDecompressor().decompressobj()
+                         .decompress(body), b"abc" * 200 + b"def" * 200)
+
+    if brotli is None:
+        test_brotli.skip = "brotli is not installed"
+    if zstandard is None:
+        test_zstd.skip = "zstandard is not installed"
+
+    def test_application_encodings(self):
+        app = Application(gzip=True, content_encodings=["gzip"])
+        self.assertEqual(len(app.transforms), 2)
+        self.assertTrue(issubclass(app.transforms[0], GZipContentEncoding))
+        self.assertEqual(app.transforms[0].ENCODINGS, ("gzip",))
+        app = Application(gzip=True)
+        self.assertEqual(app.transforms[0].ENCODINGS,
+                         tuple(t.ENCODING for t in app.transforms[:-1]))
+
+    def test_transform_chunk(self):
+        transform = ChunkedTransferEncoding(self.request)
+        self.assertEqual(transform.transform_chunk(b"abc", True),
+                         b"3\r\nabc\r\n0\r\n\r\n")
+
+    def test_generate_headers(self):
+        self.handler.set_status(404)
+        self.handler.set_header("X-Custom", "value")
+        headers = self.handler._generate_headers()
+        lines = headers.split(b"\r\n")
+        self.assertEqual(lines[0], b"HTTP/1.1 404 Not Found")
+        self.assertTrue(b"Server: cyclone/" in headers)
+        self.assertTrue(b"Content-Type: text/html; charset=UTF-8" in lines)
+        self.assertTrue(b"X-Custom: value" in lines)
+        self.assertTrue(headers.endswith(b"\r\n\r\n"))
+        self.handler.set_status(404, "Gone Fishing")
+        headers = self.handler._generate_headers()
+        self.assertTrue(headers.startswith(b"HTTP/1.1 404 Gone Fishing\r\n"))
+
+    def test_status_line_cache(self):
+        web._status_line("HTTP/1.1", 200, "OK")
+        self.assertIn(("HTTP/1.1", 200, "OK"), web._status_lines)
+        self.assertEqual(web._status_line("HTTP/9.x", 200, "OK"),
+                         b"HTTP/9.x 200 OK")
+        self.assertNotIn(("HTTP/9.x", 200, "OK"), web._status_lines)
+
+    def test_date_header(self):
+        date = self.handler._headers["Date"]
+        parsed = email.utils.parsedate_tz(date)
+        self.assertTrue(abs(email.utils.mktime_tz(parsed) - time.time()) < 2)
+        self.assertTrue(("Date: %s" % date).encode() in
+                        self.handler._generate_headers())
+
+
 class TestRequestHandler(unittest.TestCase):
 
     @defer.inlineCallbacks
@@ -380,6 +956,38 @@ class TestRequestHandler(unittest.TestCase):
         msg = yield d
         self.assertEqual(msg, b"simple: Hello Deferred!")
 
+    @defer.inlineCallbacks
+    def test_render_string_cached(self):
+        render = self.handler.render_string
+        self.assertEqual(render("simple.html", cache_key="a", msg="one"),
+                         b"simple: one")
+        self.assertEqual(render("simple.html", cache_key="a", msg="two"),
+                         b"simple: one")
+        self.assertEqual(render("simple.html", cache_key="b", msg="two"),
+                         b"simple: two")
+        d = render("simple.html", cache_key="c",
+                   msg=self._mkDeferred("three", 0.01))
+        self.assertEqual((yield d), b"simple: three")
+        self.assertEqual(render("simple.html", cache_key="c", msg="four"),
+                         b"simple: three")
+
+    def test_render_string_cached_modules(self):
+        class Sidebar(web.UIModule):
+            def render(self):
+                return "sidebar"
+
+            def embedded_javascript(self):
+                return "sidebar();"
+
+        self.app.ui_modules = {"Sidebar": Sidebar}
+        for template_name in ("block.html", "module.html"):
+            for i in range(2):
+                handler = RequestHandler(self.app, self.request)
+                self.assertEqual(handler.render_string(template_name,
+                                                       cache_key="k"),
+                                 b"[sidebar]")
+                self.assertEqual(list(handler._active_modules), ["Sidebar"])
+
     def test_generate_headers(self):
         headers = self.handler._generate_headers()
         self.assertIn(
@@ -416,6 +1024,9 @@ class TestRequestHandler(unittest.TestCase):
         app.settings = {
             "template_loader": DictLoader({
                 "simple.html": "simple: {{msg}}",
+                "block.html":
+                    "[{% cache 'k' 0 %}{% module Sidebar() %}{% end %}]",
+                "module.html": "[{% module Sidebar() %}]",
             }),
         }
 
@@ -462,3 +1073,63 @@ class TestRequestHandler(unittest.TestCase):
             self.assertEqual(len(args), 1)
             out += args[0]
         defer.returnValue(out)
+
+
+class SendQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = StringTransport()
+        self.on_backpressure = Mock()
+
+    def queue(self, policy):
+        queue = SendQueue(self.transport, 10, policy, self.on_backpressure)
+        self.assertTrue(self.transport.producer is queue)
+        self.assertTrue(self.transport.streaming)
+        self.assertTrue(queue.write(b"direct"))
+        queue.pauseProducing()
+        for data in (b"1234", b"5678", b"90"):
+            self.assertTrue(queue.write(data))
+        return queue
+
+    def test_default_policy(self):
+        queue = SendQueue(self.transport)
+        self.assertEqual(queue.policy, SendQueue.DISCONNECT)
+        self.assertEqual(queue.high_water_mark, SendQueue.HIGH_WATER_MARK)
+        self.assertRaises(ValueError, SendQueue, self.transport,
+                          policy="drop_everything")
+
+    def test_drop_oldest(self):
+        queue = self.queue(SendQueue.DROP_OLDEST)
+        self.assertTrue(queue.write(b"abcdef"))
+        self.assertEqual(queue.queued, 8)
+        self.assertFalse(queue.write(b"x" * 11))
+        self.assertEqual(self.on_backpressure.call_count, 2)
+        queue.resumeProducing()
+        self.assertEqual(self.transport.value(), b"direct90abcdef")
+        self.assertEqual(queue.queued, 0)
+
+    def test_drop_new(self):
+        queue = self.queue(SendQueue.DROP_NEW)
+        self.assertFalse(queue.write(b"abc"))
+        self.assertFalse(queue.write(b"a"))
+        self.assertEqual(self.on_backpressure.call_count, 2)
+        queue.resumeProducing()
+        self.assertEqual(self.transport.value(), b"direct1234567890")
+        self.assertTrue(queue.write(b"a"))
+
+    def test_disconnect(self):
+        queue = self.queue(SendQueue.DISCONNECT)
+        self.assertFalse(queue.write(b"abc"))
+        self.assertEqual(self.on_backpressure.call_count, 1)
+        self.assertTrue(self.transport.disconnecting)
+        self.assertEqual(queue.queued, 0)
+        self.assertFalse(queue.write(b"a"))
+        queue.resumeProducing()
+        self.assertEqual(self.transport.value(), b"direct")
+
+    def test_resume_pauses_again(self):
+        queue = self.queue(SendQueue.DISCONNECT)
+        self.transport.write = Mock(side_effect=lambda data:
+                                    queue.pauseProducing())
+        queue.resumeProducing()
+        self.assertEqual(self.transport.write.call_count, 1)
+        self.assertEqual(queue.queued, 6)
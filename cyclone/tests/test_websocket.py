@@ -0,0 +1,418 @@
+# coding: utf-8
+#
+# Copyright 2010 Alexandre Fiori
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import struct
+import zlib
+
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+from unittest.mock import Mock, patch
+
+from cyclone import websocket
+from cyclone.httputil import HTTPHeaders
+from cyclone.web import Application, SendQueue
+from cyclone.websocket import PerMessageDeflate, WebSocketGroup
+from cyclone.websocket import WebSocketHandler
+from cyclone.websocket import WebSocketProtocol17, _mask
+
+
+MASK = b"\x37\xfa\x21\x3d"
+
+
+def slow_mask(data, mask):
+    return bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+def client_frame(payload, opcode=0x1, fin=True, mask=MASK, rsv=0):
+    header = bytearray([(0x80 if fin else 0) | rsv << 4 | opcode])
+    length = len(payload)
+    if length < 126:
+        header.append(0x80 | length)
+    elif length < 65536:
+        header.append(0x80 | 126)
+        header += struct.pack("!H", length)
+    else:
+        header.append(0x80 | 127)
+        header += struct.pack("!Q", length)
+    return bytes(header) + mask + slow_mask(payload, mask)
+
+
+class TestMask(unittest.TestCase):
+    def test_mask(self):
+        for size in (0, 1, 3, 4, 5, 125, 4095, 4096, 4099, 70000):
+            data = bytes(range(256)) * (size // 256) + bytes(size % 256)
+            self.assertEqual(_mask(data, MASK), slow_mask(data, MASK))
+            self.assertEqual(_mask(_mask(data, MASK), MASK), data)
+
+    def test_mask_without_numpy(self):
+        data = bytes(range(256)) * 40
+        with patch.object(websocket, "numpy", None):
+            self.assertEqual(_mask(data, MASK), slow_mask(data, MASK))
+
+    def test_mask_leading_zeros(self):
+        self.assertEqual(_mask(MASK + b"\x00\x00", MASK),
+                         b"\x00" * 4 + MASK[:2])
+
+
+class TestWebSocketProtocol17(unittest.TestCase):
+    def setUp(self):
+        self.handler = Mock()
+        self.handler.transport = StringTransport()
+        self.handler.settings = {"websocket_max_message_size": 100000}
+        self.handler.send_queue = SendQueue(self.handler.transport)
+        self.protocol = WebSocketProtocol17(self.handler)
+
+    def received(self):
+        return [args[0] for args, kwargs in
+                self.handler.messageReceived.call_args_list]
+
+    def test_masked_message(self):
+        payload = "héllo wörld".encode("utf-8") * 1000
+        self.protocol.rawDataReceived(client_frame(payload))
+        self.assertEqual(self.received(), [payload])
+
+    def test_message_sizes(self):
+        payloads = [b"", b"a", b"x" * 125, b"y" * 126, b"z" * 70000]
+        self.protocol.rawDataReceived(b"".join(map(client_frame, payloads)))
+        self.assertEqual(self.received(), payloads)
+
+    def test_send_message(self):
+        self.protocol.sendMessage("ünicode")
+        self.assertEqual(self.handler.transport.value(),
+                         b"\x81\x08" + "ünicode".encode("utf-8"))
+
+    def test_partial_frames(self):
+        payloads = [b"x" * 70000, b"hello", b"y" * 300]
+        data = b"".join(map(client_frame, payloads))
+        for i in range(0, len(data), 7):
+            self.protocol.rawDataReceived(data[i:i + 7])
+        self.assertEqual(self.received(), payloads)
+        self.assertEqual(len(self.protocol._buffer), 0)
+
+    def test_fragmented_message(self):
+        data = client_frame(b"one ", fin=False) + \
+            client_frame(b"ping", opcode=0x9) + \
+            client_frame(b"two ", opcode=0x0, fin=False) + \
+            client_frame(b"three", opcode=0x0)
+        self.protocol.rawDataReceived(data[:10])
+        self.protocol.rawDataReceived(data[10:])
+        self.assertEqual(self.received(), [b"one two three"])
+        self.assertEqual(self.handler.transport.value(), b"\x8a\x04ping")
+
+    def test_max_message_size(self):
+        self.protocol.rawDataReceived(client_frame(b"x" * 60000, fin=False))
+        self.protocol.rawDataReceived(
+            client_frame(b"x" * 60000, opcode=0x0)[:100])
+        self.assertEqual(self.received(), [])
+        self.assertEqual(self.handler.transport.value(), b"\x88\x02\x03\xf1")
+        self.assertTrue(self.handler.transport.disconnecting)
+        self.protocol.rawDataReceived(client_frame(b"late"))
+        self.assertEqual(self.received(), [])
+
+
+def deflate(compressor, data):
+    return (compressor.compress(data) +
+            compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+
+def inflate(decompressor, frame):
+    # server frames are unmasked and these tests keep them under 126 bytes
+    assert frame[0] & 0x40 and frame[1] < 126
+    return decompressor.decompress(frame[2:] + b"\x00\x00\xff\xff")
+
+
+class TestPerMessageDeflate(unittest.TestCase):
+    def test_negotiate(self):
+        deflate = PerMessageDeflate.negotiate(
+            "x-foo, permessage-deflate; client_max_window_bits", {})
+        self.assertEqual(deflate.response, "permessage-deflate")
+        self.assertTrue(deflate.server_context_takeover)
+
+    def test_negotiate_params(self):
+        deflate = PerMessageDeflate.negotiate(
+            "permessage-deflate; server_max_window_bits=10; "
+            "server_no_context_takeover; client_no_context_takeover",
+            dict(max_window_bits=12))
+        self.assertEqual(deflate.window_bits, 10)
+        self.assertEqual(deflate.response,
+                         "permessage-deflate; server_no_context_takeover; "
+                         "client_no_context_takeover; "
+                         "server_max_window_bits=10")
+
+    def test_negotiate_max_window_bits_echoed(self):
+        deflate = PerMessageDeflate.negotiate(
+            "permessage-deflate; server_max_window_bits=15", {})
+        self.assertEqual(deflate.window_bits, 15)
+        self.assertEqual(deflate.response,
+                         "permessage-deflate; server_max_window_bits=15")
+        deflate = PerMessageDeflate.negotiate(
+            "permessage-deflate; server_max_window_bits=15",
+            dict(max_window_bits=12))
+        self.assertEqual(deflate.response,
+                         "permessage-deflate; server_max_window_bits=12")
+
+    def test_negotiate_options(self):
+        deflate = PerMessageDeflate.negotiate(
+            "permessage-deflate",
+            dict(max_window_bits=11, context_takeover=False,
+                 compression_level=9, mem_level=4))
+        self.assertEqual(deflate.response,
+                         "permessage-deflate; server_no_context_takeover; "
+                         "server_max_window_bits=11")
+        self.assertEqual((deflate.compression_level, deflate.mem_level),
+                         (9, 4))
+
+    def test_negotiate_fallback(self):
+        deflate = PerMessageDeflate.negotiate(
+            "permessage-deflate; server_max_window_bits=8, "
+            "permessage-deflate; x-unknown, "
+            "permessage-deflate; client_max_window_bits=9", {})
+        self.assertEqual(deflate.response, "permessage-deflate")
+        self.assertEqual(PerMessageDeflate.negotiate(
+            "permessage-deflate; server_max_window_bits", {}), None)
+        self.assertEqual(PerMessageDeflate.negotiate("x-foo", {}), None)
+
+    def test_context_takeover(self):
+        message = b'{"user": "someone", "text": "hello"}'
+        deflate = PerMessageDeflate()
+        first, second = deflate.compress(message), deflate.compress(message)
+        self.assertTrue(len(second) < len(first))
+        deflate = PerMessageDeflate(server_context_takeover=False)
+        self.assertEqual(deflate.compress(message), deflate.compress(message))
+
+    def test_decompress_max_length(self):
+        data = PerMessageDeflate().compress(b"x" * 1000)
+        self.assertEqual(PerMessageDeflate().decompress(data, 1000),
+                         b"x" * 1000)
+        self.assertEqual(PerMessageDeflate().decompress(data, 999), None)
+
+
+class TestWebSocketCompression(unittest.TestCase):
+    def setUp(self):
+        self.app = Application(websocket_compression=True)
+        self.request = Mock()
+        self.request.headers = HTTPHeaders({
+            "Upgrade": "websocket",
+            "Origin": "http://localhost",
+            "Sec-WebSocket-Key": "dGhlIHNhbXBsZSBub25jZQ==",
+            "Sec-WebSocket-Extensions":
+                "permessage-deflate; client_max_window_bits"})
+        self.request.host = "localhost"
+        self.request.path = "/ws"
+        self.request.connection.transport = StringTransport()
+        self.handler = WebSocketHandler(self.app, self.request)
+        self.handler.messageReceived = Mock()
+        self.transport = self.request.connection.transport
+
+    def accept(self):
+        self.handler.ws_protocol = WebSocketProtocol17(self.handler)
+        self.handler._connectionMade = Mock()
+        self.handler.ws_protocol.acceptConnection()
+        head, sep, rest = self.transport.value().partition(b"\r\n\r\n")
+        self.transport.clear()
+        return head
+
+    def test_handshake(self):
+        head = self.accept()
+        self.assertIn(b"Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=",
+                      head)
+        self.assertIn(b"\r\nSec-WebSocket-Extensions: permessage-deflate\r\n",
+                      head)
+
+    def test_opt_out(self):
+        self.handler.get_compression_options = lambda: None
+        self.assertNotIn(b"Sec-WebSocket-Extensions", self.accept())
+        self.handler.sendMessage("hello")
+        self.assertEqual(self.transport.value(), b"\x81\x05hello")
+
+    def test_disabled(self):
+        self.app.settings["websocket_compression"] = False
+        self.assertNotIn(b"Sec-WebSocket-Extensions", self.accept())
+
+    def test_send_message(self):
+        self.accept()
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        for i in range(3):
+            self.handler.sendMessage({"user": "someone", "n": i})
+            self.assertEqual(inflate(decompressor, self.transport.value()),
+                             b'{"user": "someone", "n": %d}' % i)
+            self.transport.clear()
+
+    def test_message_received(self):
+        self.accept()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        messages = [b"hello " * 100, b"hello " * 100, b"plain"]
+        data = deflate(compressor, messages[0])
+        data = client_frame(data[:10], fin=False, rsv=4) + \
+            client_frame(data[10:], opcode=0x0) + \
+            client_frame(deflate(compressor, messages[1]), rsv=4) + \
+            client_frame(messages[2])
+        self.handler.ws_protocol.rawDataReceived(data)
+        self.assertEqual([args[0] for args, kwargs in
+                          self.handler.messageReceived.call_args_list],
+                         messages)
+
+    def test_message_too_big(self):
+        self.app.settings["websocket_max_message_size"] = 1000
+        self.accept()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.handler.ws_protocol.rawDataReceived(client_frame(
+            deflate(compressor, b"x" * 1001), rsv=4))
+        self.assertFalse(self.handler.messageReceived.called)
+        self.assertEqual(self.transport.value(), b"\x88\x02\x03\xf1")
+
+    def test_control_frame_too_big(self):
+        self.app.settings["websocket_max_message_size"] = 1000
+        self.accept()
+        # only the header of a 500 KB ping, which is refused right away
+        self.handler.ws_protocol.rawDataReceived(
+            client_frame(b"x" * 500000, opcode=0x9)[:14])
+        self.assertEqual(self.transport.value(), b"\x88\x02\x03\xea")
+
+    def test_fragmented_control_frame(self):
+        self.accept()
+        self.handler.ws_protocol.rawDataReceived(
+            client_frame(b"ping", opcode=0x9, fin=False))
+        self.assertEqual(self.transport.value(), b"\x88\x02\x03\xea")
+
+
+class TestWebSocketGroup(unittest.TestCase):
+    def connection(self, buffered=0, deflate=None):
+        handler = Mock()
+        handler.settings = {}
+        handler.transport = Mock()
+        handler.transport.disconnecting = False
+        handler.send_queue = SendQueue(handler.transport)
+        if buffered:
+            # the transport buffer is full, so writes wait in the queue
+            handler.send_queue.pauseProducing()
+            handler.send_queue.write(b"x" * buffered)
+        handler.ws_protocol = WebSocketProtocol17(handler)
+        handler.ws_protocol._deflate = deflate
+        self.group.add(handler)
+        return handler
+
+    def written(self, handler):
+        return [args[0] for args, kwargs in
+                handler.transport.write.call_args_list]
+
+    def setUp(self):
+        self.group = WebSocketGroup(high_water_mark=1000)
+
+    def test_broadcast(self):
+        handlers = [self.connection() for i in range(3)]
+        self.assertEqual(self.group.broadcast("ünicode"), 3)
+        frames = [self.written(handler) for handler in handlers]
+        self.assertEqual(frames[0], [b"\x81\x08" + "ünicode".encode("utf-8")])
+        self.assertTrue(all(f[0] is frames[0][0] for f in frames))
+
+    def test_broadcast_dict(self):
+        handler = self.connection()
+        self.group.broadcast({"a": 1})
+        self.assertEqual(self.written(handler), [b'\x81\x08{"a": 1}'])
+
+    def test_exclude_and_skip(self):
+        sender = self.connection()
+        slow = self.connection(buffered=1001)
+        closing = self.connection()
+        closing.transport.disconnecting = True
+        unaccepted = self.connection()
+        unaccepted.ws_protocol = None
+        full = self.connection(buffered=1000)
+        self.assertEqual(self.group.broadcast("hi", exclude=sender), 1)
+        full.send_queue.resumeProducing()
+        self.assertEqual(self.written(full), [b"x" * 1000, b"\x81\x02hi"])
+        for handler in (sender, slow, closing):
+            self.assertEqual(self.written(handler), [])
+
+    def test_membership(self):
+        handler = self.connection()
+        self.assertIn(handler, self.group)
+        self.assertEqual(list(self.group), [handler])
+        self.group.discard(handler)
+        self.group.discard(handler)
+        self.assertEqual(len(self.group), 0)
+        self.assertEqual(self.group.broadcast("hi"), 0)
+
+    def test_compressed(self):
+        message = b"hello " * 10
+        shared = [self.connection(deflate=PerMessageDeflate(
+            server_context_takeover=False)) for i in range(2)]
+        takeover = self.connection(deflate=PerMessageDeflate())
+        self.group.broadcast(message)
+        self.group.broadcast(message)
+        first, second = map(self.written, shared)
+        self.assertTrue(first[0] is second[0])
+        self.assertEqual(first[0], first[1])
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        for frame in self.written(takeover):
+            self.assertEqual(inflate(decompressor, frame), message)
+        self.assertEqual(inflate(zlib.decompressobj(-zlib.MAX_WBITS),
+                                 first[0]), message)
+
+    def test_queued(self):
+        handler = self.connection(buffered=600)
+        self.assertEqual(self.group.broadcast("x" * 500), 1)
+        self.assertEqual(handler.ws_protocol.bufferedAmount(), 1104)
+        self.assertEqual(self.group.broadcast("x" * 500), 0)
+        self.assertEqual(self.written(handler), [])
+
+
+class TestBackpressure(unittest.TestCase):
+    def setUp(self):
+        self.app = Application(send_high_water_mark=10)
+        self.request = Mock()
+        self.request.headers = HTTPHeaders({
+            "Upgrade": "websocket",
+            "Origin": "http://localhost",
+            "Sec-WebSocket-Key": "dGhlIHNhbXBsZSBub25jZQ==",
+            "Sec-WebSocket-Extensions": "permessage-deflate"})
+        self.request.connection.transport = StringTransport()
+        self.handler = WebSocketHandler(self.app, self.request)
+        self.handler.ws_protocol = WebSocketProtocol17(self.handler)
+        self.transport = self.request.connection.transport
+
+    def test_settings(self):
+        self.app.settings["send_queue_policy"] = SendQueue.DROP_NEW
+        queue = self.handler.send_queue
+        self.assertTrue(self.transport.producer is queue)
+        self.assertEqual((queue.high_water_mark, queue.policy),
+                         (10, SendQueue.DROP_NEW))
+
+    def test_handler_options(self):
+        self.handler.high_water_mark = 0
+        self.handler.backpressure_policy = SendQueue.DROP_OLDEST
+        self.assertEqual((self.handler.send_queue.high_water_mark,
+                          self.handler.send_queue.policy),
+                         (0, SendQueue.DROP_OLDEST))
+
+    def test_compression_disconnects(self):
+        self.app.settings["websocket_compression"] = True
+        self.handler.backpressure_policy = SendQueue.DROP_NEW
+        self.handler._connectionMade = Mock()
+        self.handler.ws_protocol.acceptConnection()
+        self.assertEqual(self.handler.send_queue.policy, SendQueue.DISCONNECT)
+
+    def test_send_message(self):
+        self.handler.backpressure_policy = SendQueue.DROP_NEW
+        self.handler.on_backpressure = Mock()
+        self.handler.send_queue.pauseProducing()
+        self.assertTrue(self.handler.sendMessage("12345678"))
+        self.assertFalse(self.handler.sendMessage("1"))
+        self.assertEqual(self.handler.on_backpressure.call_count, 1)
+        self.assertEqual(self.transport.value(), b"")
+        self.handler.send_queue.resumeProducing()
+        self.assertEqual(self.transport.value(), b"\x81\x0812345678")
@@ -15,6 +15,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+
 from twisted.python import log
 
 
@@ -43,6 +45,77 @@ class ObjectDict(dict):
         self[name] = value
 
 
+class LRUCache(object):
+    """A mapping that evicts its least recently used entries when full.
+
+    ``capacity`` bounds the total weight of the entries. Each entry weighs
+    1 unless a ``weigh`` function is given, which returns the weight of a
+    value (e.g. its size in bytes). Values heavier than the whole capacity
+    are not stored. The ``hits`` and ``misses`` attributes count the
+    lookups made with `get`.
+
+    >>> cache = LRUCache(2)
+    >>> cache["a"] = 1
+    >>> cache["b"] = 2
+    >>> cache.get("a")
+    1
+    >>> cache["c"] = 3
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    """
+    def __init__(self, capacity, weigh=None):
+        self.capacity = capacity
+        self.weight = 0
+        self.hits = self.misses = 0
+        self._weigh = weigh
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        return self._entries.keys()
+
+    def get(self, key, default=None):
+        """Returns the value of key, marking it as the most recently used."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.pop(key)
+        weight = self._weigh(value) if self._weigh else 1
+        if weight > self.capacity:
+            return
+        entries = self._entries
+        entries[key] = value
+        self.weight += weight
+        while self.weight > self.capacity:
+            k, v = entries.popitem(last=False)
+            self.weight -= self._weigh(v) if self._weigh else 1
+
+    def pop(self, key, default=None):
+        """Removes key, returning its value, or default if not cached."""
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            return default
+        self.weight -= self._weigh(value) if self._weigh else 1
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.weight = 0
+
+
 def import_object(name):
     """Imports an object by name.
 
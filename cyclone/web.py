@@ -58,6 +58,7 @@ from http import client as http_client
 import base64
 import binascii
 import calendar
+import collections
 import datetime
 import email.utils
 import functools
@@ -76,6 +77,7 @@ import time
 import traceback
 import types
 import urllib
+import zlib
 #import urlparse
 from urllib import parse as urllib_parse
 import uuid
@@ -83,20 +85,31 @@ import uuid
 import cyclone
 from cyclone import escape
 from cyclone import httpserver
+from cyclone import httputil
 from cyclone import locale
 from cyclone import template
 from cyclone.escape import utf8, _unicode
 from cyclone.util import ObjectDict
 from cyclone.util import bytes_type
 from cyclone.util import import_object
+from cyclone.util import LRUCache
 from cyclone.util import unicode_type
-from io import BytesIO
 from twisted.python import failure
 from twisted.python import log
 from twisted.internet import defer
 from twisted.internet import protocol
 from twisted.internet import reactor
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 class RequestHandler(object):
     """Subclass this class and define get() or post() to make a handler.
@@ -117,6 +130,7 @@ class RequestHandler(object):
 
     serialize_lists = False
     no_keep_alive = False
+    _stream_request_body = False
     xsrf_cookie_name = "_xsrf"
     _template_loaders = {}  # {path: template.BaseLoader}
     _template_loader_lock = threading.Lock()
@@ -129,6 +143,7 @@ class RequestHandler(object):
         self._headers_written = False
         self._finished = False
         self._auto_finish = True
+        self._body_paused = False
         self._transforms = None  # will be set in _execute
         self.path_args = None
         self.path_kwargs = None
@@ -142,6 +157,11 @@ class RequestHandler(object):
         self.ui["_modules"] = ObjectDict((n, self._ui_module(n, m)) for n, m in
                                  application.ui_modules.items())
         self.ui["modules"] = self.ui["_modules"]
+        # Cached template output records the modules used to render it.
+        self._module_recorders = []
+        self.ui["_record_modules"] = self._record_modules
+        self.ui["_stop_recording"] = self._stop_recording
+        self.ui["_activate_modules"] = self._activate_modules
         self.clear()
         self.request.connection.no_keep_alive = self.no_keep_alive
         self.initialize(**kwargs)
@@ -204,6 +224,15 @@ class RequestHandler(object):
         """
         pass
 
+    def data_received(self, chunk):
+        """Implement this method to handle streamed request data.
+
+        Requires the `stream_request_body` decorator.  May return a
+        Deferred, in which case no more data is read from the connection
+        until it fires.
+        """
+        raise NotImplementedError()
+
     def on_connection_close(self, *args, **kwargs):
         """Called in async handlers if the client closed the connection.
 
@@ -228,10 +257,9 @@ class RequestHandler(object):
         # headers we generate on the server side, so use a plain dict
         # and list instead.
         self._headers = {
-            "Server": "cyclone/%s" % cyclone.version,
+            "Server": _SERVER,
             "Content-Type": "text/html; charset=UTF-8",
-            "Date": datetime.datetime.utcnow().strftime(
-                                                "%a, %d %b %Y %H:%M:%S GMT"),
+            "Date": _http_date(),
         }
         self._list_headers = []
         self.set_default_headers()
@@ -616,11 +644,16 @@ class RequestHandler(object):
             html = html[:hloc] + ''.join(html_bodies) + '\n' + html[hloc:]
         return html
 
-    def render_string(self, template_name, **kwargs):
+    def render_string(self, template_name, cache_key=None, ttl=0, **kwargs):
         """Generate the given template with the given arguments.
 
         We return the generated string. To generate and write a template
         as a response, use render() above.
+
+        If ``cache_key`` is given, the output is kept in the cache of the
+        template loader under that key for ``ttl`` seconds (0 keeps it
+        until it is evicted), and later calls with the same key return it
+        without running the template.
         """
         # If no template_path is specified, use the path of the calling file
         template_path = self.get_template_path()
@@ -639,7 +672,9 @@ class RequestHandler(object):
         t = loader.load(template_name)
         namespace = self.get_template_namespace()
         namespace.update(kwargs)
-        return t.generate(**namespace)
+        if cache_key is None:
+            return t.generate(**namespace)
+        return t.generate_cached(cache_key, ttl, **namespace)
 
     def get_template_namespace(self):
         """Returns a dictionary to be used as the default template namespace.
@@ -668,34 +703,43 @@ class RequestHandler(object):
 
         May be overridden by subclasses.  By default returns a
         directory-based loader on the given path, using the
-        ``autoescape`` application setting.  If a ``template_loader``
-        application setting is supplied, uses that instead.
+        ``autoescape`` application setting and keeping rendered output in
+        the ``template_cache`` backend, or in a `template.TemplateCache`
+        of ``template_cache_size`` bytes.  Compiled templates are kept in
+        the ``compiled_template_path`` directory if that setting is given,
+        and the loader the application precompiled them with is returned
+        for its ``template_path``.  If a ``template_loader`` application
+        setting is supplied, uses that instead.
         """
         settings = self.application.settings
         if "template_loader" in settings:
             return settings["template_loader"]
-        kwargs = {}
-        if "autoescape" in settings:
-            # autoescape=None means "no escaping", so we have to be sure
-            # to only pass this kwarg if the user asked for it.
-            kwargs["autoescape"] = settings["autoescape"]
-        return template.Loader(template_path, **kwargs)
+        loader = getattr(self.application, "template_loader", None)
+        if isinstance(loader, template.Loader) and \
+                loader.root == os.path.abspath(template_path):
+            return loader
+        return template.Loader(template_path,
+                               **_template_loader_kwargs(settings))
 
     def flush(self, include_footers=False):
-        """Flushes the current output buffer to the network."""
-        chunk = b"".join(self._write_buffer)
+        """Flushes the current output buffer to the network.
+
+        The buffered chunks are not joined: they are handed to the
+        transport as a sequence, along with the headers.
+        """
+        parts = self._write_buffer
         self._write_buffer = []
 
         if not self._headers_written:
             self._headers_written = True
             for transform in self._transforms:
-                self._status_code, self._headers, chunk = \
-                    transform.transform_first_chunk(
-                    self._status_code, self._headers, chunk, include_footers)
+                self._status_code, self._headers, parts = \
+                    transform.transform_first_parts(
+                    self._status_code, self._headers, parts, include_footers)
             headers = self._generate_headers()
         else:
             for transform in self._transforms:  # pragma: no cover
-                chunk = transform.transform_chunk(chunk, include_footers)
+                parts = transform.transform_parts(parts, include_footers)
             headers = b""
 
         # Ignore the chunk and only write the headers for HEAD requests
@@ -704,8 +748,13 @@ class RequestHandler(object):
                 self.request.write(headers)
             return
 
-        if headers or chunk:
-            self.request.write(headers + chunk)
+        parts = [part for part in parts if part]
+        if headers:
+            parts.insert(0, headers)
+        if len(parts) == 1:
+            self.request.write(parts[0])
+        elif parts:
+            self.request.write_sequence(parts)
 
     def notifyFinish(self):
         """Returns a deferred, which is fired when the request is terminated
@@ -1111,13 +1160,56 @@ class RequestHandler(object):
                     self.application.settings.get("xsrf_cookies"):  # is True
                 if not getattr(self, "no_xsrf", False):
                     self.check_xsrf_cookie()
-            defer.maybeDeferred(self.prepare).addCallbacks(
+            d = defer.maybeDeferred(self.prepare)
+            if self._stream_request_body:
+                # The body is still being received: data_received is
+                # chained after prepare, and the HTTP method is called
+                # by _body_received once the whole body is in.
+                self._body_stream = d
+                self._body_stream_args = (args, kwargs)
+                return
+            d.addCallbacks(
                     self._execute_handler,
                     lambda f: self._handle_request_exception(f.value),
                     callbackArgs=(args, kwargs))
         except Exception as e:
             self._handle_request_exception(e)
 
+    def _data_received(self, chunk):
+        """Feeds a chunk of a streamed request body to data_received.
+
+        Chunks are delivered in order and only after `prepare` has
+        completed. While the handler is busy, reading from the connection
+        is paused.
+        """
+        if self._finished or not hasattr(self, "_body_stream"):
+            return
+        d = self._body_stream
+        d.addCallback(self._feed_data_received, chunk)
+        if (not d.called or d.paused) and not self._body_paused:
+            self._body_paused = True
+            self.request.connection.pause_reading("body")
+            d.addBoth(self._resume_reading)
+
+    def _feed_data_received(self, ign, chunk):
+        if not self._finished:
+            return self.data_received(chunk)
+
+    def _resume_reading(self, result):
+        self._body_paused = False
+        self.request.connection.resume_reading("body")
+        return result
+
+    def _body_received(self):
+        """Called once the whole streamed request body has been received."""
+        if self._finished or not hasattr(self, "_body_stream"):
+            return
+        args, kwargs = self._body_stream_args
+        self._body_stream.addCallbacks(
+                self._execute_handler,
+                lambda f: self._handle_request_exception(f.value),
+                callbackArgs=(args, kwargs))
+
     def _deferred_handler(self, function, *args, **kwargs):
         try:
             result = function(*args, **kwargs)
@@ -1159,11 +1251,15 @@ class RequestHandler(object):
         return self._handle_request_exception(err)
 
     def _generate_headers(self):
-        reason = self._reason
-        lines = [utf8(self.request.version + " " +
-                      str(self._status_code) +
-                      " " + reason)]
-        lines.extend([(utf8(n) + b": " + utf8(v)) for n, v in itertools.chain(self._headers.items(), self._list_headers)])
+        lines = [_status_line(self.request.version, self._status_code,
+                              self._reason)]
+        get_line = _header_lines.get
+        for n, v in itertools.chain(self._headers.items(),
+                                    self._list_headers):
+            line = get_line((n, v))
+            if line is None:
+                line = utf8(n) + b": " + utf8(v)
+            lines.append(line)
         if hasattr(self, "_new_cookie"):
             for cookie in self._new_cookie.values():
                 lines.append(utf8("Set-Cookie: " + cookie.OutputString(None)))
@@ -1212,14 +1308,37 @@ class RequestHandler(object):
 
     def _ui_module(self, name, module):
         def render(*args, **kwargs):
-            if not hasattr(self, "_active_modules"):
-                self._active_modules = {}
-            if name not in self._active_modules:
-                self._active_modules[name] = module(self)
-            rendered = self._active_modules[name].render(*args, **kwargs)
+            rendered = self._activate_module(name, module).render(*args,
+                                                                  **kwargs)
             return rendered
         return render
 
+    def _activate_module(self, name, module):
+        if not hasattr(self, "_active_modules"):
+            self._active_modules = {}
+        if name not in self._active_modules:
+            self._active_modules[name] = module(self)
+        for names in self._module_recorders:
+            names.add(name)
+        return self._active_modules[name]
+
+    def _activate_modules(self, names):
+        # Output taken from the template cache skips the module calls that
+        # rendered it, but their JavaScript and CSS are still needed.
+        for name in names:
+            module = self.application.ui_modules.get(name)
+            if module is not None:
+                self._activate_module(name, module)
+
+    def _record_modules(self):
+        names = set()
+        self._module_recorders.append(names)
+        return names
+
+    def _stop_recording(self, names):
+        self._module_recorders = [n for n in self._module_recorders
+                                  if n is not names]
+
     def _ui_method(self, method):
         return lambda *args, **kwargs: method(self, *args, **kwargs)
 
@@ -1235,6 +1354,22 @@ class RequestHandler(object):
             self.clear_header(h)
 
 
+def _template_loader_kwargs(settings):
+    kwargs = {}
+    if "autoescape" in settings:
+        # autoescape=None means "no escaping", so we have to be sure
+        # to only pass this kwarg if the user asked for it.
+        kwargs["autoescape"] = settings["autoescape"]
+    if "template_cache" in settings:
+        kwargs["cache"] = settings["template_cache"]
+    elif "template_cache_size" in settings:
+        kwargs["cache"] = template.TemplateCache(
+            settings["template_cache_size"])
+    if "compiled_template_path" in settings:
+        kwargs["compiled_path"] = settings["compiled_template_path"]
+    return kwargs
+
+
 def asynchronous(method):
     """Wrap request handler methods with this if they are asynchronous.
 
@@ -1264,6 +1399,41 @@ def asynchronous(method):
     return wrapper
 
 
+def stream_request_body(cls):
+    """Apply to `RequestHandler` subclasses to enable streaming body support.
+
+    This decorator implies the following changes:
+
+    * `.HTTPRequest.body` is empty, and body arguments will not be included
+      in `RequestHandler.get_argument`.
+    * `RequestHandler.prepare` is called when the request headers have been
+      read instead of after the entire body has been read.
+    * The subclass must define a method ``data_received(self, chunk)``,
+      which will be called zero or more times as data is available.  If
+      it returns a Deferred, reading is paused until it fires.
+    * The regular HTTP method (``post``, ``put``, etc) will be called after
+      the entire body has been read.
+
+    Example::
+
+        @web.stream_request_body
+        class UploadHandler(web.RequestHandler):
+            def prepare(self):
+                self.file = open("/tmp/upload", "wb")
+
+            def data_received(self, chunk):
+                self.file.write(chunk)
+
+            def put(self):
+                self.file.close()
+                self.finish("ok")
+    """
+    if not issubclass(cls, RequestHandler):
+        raise TypeError("expected subclass of RequestHandler, got %r" % cls)
+    cls._stream_request_body = True
+    return cls
+
+
 def removeslash(method):
     """Use this decorator to remove trailing slashes from the request path.
 
@@ -1368,12 +1538,24 @@ class Application(protocol.ServerFactory):
         if transforms is None:
             self.transforms = []
             if settings.get("gzip"):
-                self.transforms.append(GZipContentEncoding)
+                encoders = [t for t in CONTENT_ENCODINGS if t.AVAILABLE and
+                            t.ENCODING in settings.get("content_encodings",
+                                                       (t.ENCODING,))]
+                encodings = [t.ENCODING for t in encoders]
+                for encoder in encoders:
+                    self.transforms.append(
+                        encoder.configure(settings, encodings))
             self.transforms.append(ChunkedTransferEncoding)
         else:
             self.transforms = transforms
         self.handlers = []
         self.named_handlers = {}
+        self._routes = None
+        self._host_routes = LRUCache(256)
+        self.route_cache = None
+        if settings.get("route_cache_size"):
+            self.route_cache = LRUCache(settings["route_cache_size"])
+        self._streaming_handlers = False
         self.error_handler = error_handler or ErrorHandler
         self.default_host = default_host
         self.settings = ObjectDict(settings)
@@ -1398,6 +1580,28 @@ class Application(protocol.ServerFactory):
                                     static_handler_args))
         if handlers:
             self.add_handlers(".*$", handlers)
+        self.template_loader = None
+        if "compiled_template_path" in self.settings and \
+                "template_path" in self.settings and \
+                "template_loader" not in self.settings:
+            self._precompile_templates()
+
+    def _precompile_templates(self):
+        """Compiles the templates under template_path into
+        compiled_template_path, so that workers load them from there
+        instead of compiling each on its first use.
+
+        The loader is kept as ``template_loader`` for the handlers to
+        render the templates it compiled.  Only the files ending with one
+        of the ``template_extensions`` are compiled.
+        """
+        self.template_loader = template.Loader(
+            self.settings["template_path"],
+            **_template_loader_kwargs(self.settings))
+        extensions = self.settings.get("template_extensions",
+                                       template.TEMPLATE_EXTENSIONS)
+        for name, e in self.template_loader.precompile(extensions):
+            log.msg("Skipped template %s: %s" % (name, e))
 
     def add_handlers(self, host_pattern, host_handlers):
         """Appends the given handlers to our handler list.
@@ -1441,11 +1645,17 @@ class Application(protocol.ServerFactory):
                     kwargs = {}
                 spec = URLSpec(pattern, handler, kwargs)
             handlers.append(spec)
+            if getattr(spec.handler_class, "_stream_request_body", False):
+                self._streaming_handlers = True
             if spec.name:
                 if spec.name in self.named_handlers:
                     log.msg("Multiple handlers named %s; "
                             "replacing previous value" % spec.name)
                 self.named_handlers[spec.name] = spec
+        self._routes = None
+        self._host_routes.clear()
+        if self.route_cache is not None:
+            self.route_cache.clear()
 
     def add_transform(self, transform_class):
         """Adds the given OutputTransform to our transform list."""
@@ -1464,6 +1674,30 @@ class Application(protocol.ServerFactory):
                     matches.extend(handlers)
         return matches or None
 
+    def _get_host_routes(self, request):
+        """Like `_get_host_handlers`, but returns the `_RouteTable` of each
+        matching host pattern.
+
+        Routes are compiled on first use after handlers were added, and the
+        tables of the most recently seen hosts are cached.
+        """
+        routes = self._routes
+        if routes is None:
+            routes = self._routes = [_RouteTable(handlers)
+                                     for pattern, handlers in self.handlers]
+        host = request.host.lower().split(':')[0]
+        key = (host, "X-Real-Ip" in request.headers)
+        tables = self._host_routes.get(key)
+        if tables is None:
+            tables = [table for (pattern, handlers), table in
+                      zip(self.handlers, routes) if pattern.match(host)]
+            if not tables and not key[1]:
+                tables = [table for (pattern, handlers), table in
+                          zip(self.handlers, routes)
+                          if pattern.match(self.default_host)]
+            self._host_routes[key] = tables
+        return tables
+
     def _load_ui_methods(self, methods):
         if isinstance(methods, types.ModuleType):
             self._load_ui_methods(dict((n, getattr(methods, n))
@@ -1493,51 +1727,90 @@ class Application(protocol.ServerFactory):
                 except TypeError:
                     pass
 
+    def _find_handler(self, request):
+        """Returns the handler class for the request along with the
+        keyword arguments for its constructor and the positional and
+        keyword arguments extracted from the path.
+
+        If the ``route_cache_size`` setting is given, the result for up to
+        that many distinct hosts and paths is kept in `route_cache`, an
+        `LRUCache` whose ``hits`` and ``misses`` count its lookups.
+        """
+        cache = self.route_cache
+        if cache is not None:
+            key = (request.host, "X-Real-Ip" in request.headers,
+                   request.path)
+            result = cache.get(key)
+            if result is not None:
+                return result
+        tables = self._get_host_routes(request)
+        if not tables:
+            return (RedirectHandler,
+                    {"url": "http://" + self.default_host + "/"}, [], {})
+        for table in tables:
+            spec, match = table.match(request.path)
+            if match:
+                args = []
+                kwargs = {}
+                if spec.regex.groups:
+                    # Pass matched groups to the handler.  Since
+                    # match.groups() includes both named and
+                    # unnamed groups,we want to use either groups
+                    # or groupdict but not both.
+                    # Note that args are passed as bytes so the handler can
+                    # decide what encoding to use.
+
+                    if spec.regex.groupindex:
+                        kwargs = dict((str(k), _unquote_group(v))
+                            for (k, v) in match.groupdict().items())
+                    else:
+                        args = [_unquote_group(s) for s in match.groups()]
+                result = spec.handler_class, spec.kwargs, args, kwargs
+                if cache is not None:
+                    cache[key] = result
+                return result
+        return self.error_handler, {"status_code": 404}, [], {}
+
     def __call__(self, request):
         """Called by HTTPServer to execute the request."""
+        handler_class, handler_kwargs, args, kwargs = \
+            self._find_handler(request)
+        return self._execute_handler(request, handler_class, handler_kwargs,
+                                     args, kwargs)
+
+    def stream_request(self, request):
+        """Called by HTTPServer when the headers of a request with a body
+        have been received.
+
+        If the request is routed to a handler decorated with
+        `stream_request_body`, the handler is executed right away and
+        returned, so that the body can be delivered to its
+        ``data_received`` method as it arrives.  Otherwise ``None`` is
+        returned, and the request is executed with `__call__` once the
+        whole body has been received.
+        """
+        if not self._streaming_handlers:
+            return None
+        handler_class, handler_kwargs, args, kwargs = \
+            self._find_handler(request)
+        if not getattr(handler_class, "_stream_request_body", False):
+            return None
+        return self._execute_handler(request, handler_class, handler_kwargs,
+                                     args, kwargs)
+
+    def _execute_handler(self, request, handler_class, handler_kwargs,
+                         args, kwargs):
         transforms = [t(request) for t in self.transforms]
-        handler = None
-        args = []
-        kwargs = {}
-        handlers = self._get_host_handlers(request)
-        if not handlers:
-            handler = RedirectHandler(self, request,
-                                      url="http://" + self.default_host + "/")
-        else:
-            for spec in handlers:
-                match = spec.regex.match(request.path)
-                if match:
-                    handler = spec.handler_class(self, request, **spec.kwargs)
-                    if spec.regex.groups:
-                        # None-safe wrapper around url_unescape to handle
-                        # unmatched optional groups correctly
-                        def unquote(s):
-                            if s is None:
-                                return s
-                            return escape.url_unescape(s)
-                        # Pass matched groups to the handler.  Since
-                        # match.groups() includes both named and
-                        # unnamed groups,we want to use either groups
-                        # or groupdict but not both.
-                        # Note that args are passed as bytes so the handler can
-                        # decide what encoding to use.
-
-                        if spec.regex.groupindex:
-                            kwargs = dict((str(k), unquote(v))
-                                for (k, v) in match.groupdict().items())
-                        else:
-                            args = [unquote(s) for s in match.groups()]
-                    break
-            if not handler:
-                handler = self.error_handler(self, request, status_code=404)
-
-        # In debug mode, re-compile templates and reload static files on every
-        # request so you don't need to restart to see changes
+        handler = handler_class(self, request, **handler_kwargs)
+
+        # In debug mode, re-compile the templates and re-hash the static
+        # files that changed on every request so you don't need to
+        # restart to see changes
         if self.settings.get("debug"):
             with RequestHandler._template_loader_lock:
                 for loader in RequestHandler._template_loaders.values():
-                    loader.reset()
-            StaticFileHandler.reset()
+                    loader.reload_changed()
+            StaticFileHandler.reload_changed()
 
         handler._execute(transforms, *args, **kwargs)
         return handler
@@ -1670,11 +1943,48 @@ class StaticFileHandler(RequestHandler):
     want browsers to cache a file indefinitely, send them to, e.g.,
     /static/images/myimage.png?v=xxx. Override ``get_cache_time`` method for
     more fine-grained cache control.
+
+    Files are streamed to the client rather than read in memory, and
+    ``Range`` requests (with ``If-Range``) are answered with partial
+    content, so that large downloads can be resumed and media seeked.
+
+    Small files can be cached in memory by setting the
+    ``static_cache_size`` application setting to the maximum number of
+    bytes to use. Cached files are checked for modifications at most once
+    every ``static_cache_revalidate`` seconds (1 by default, 0 in debug
+    mode), and if the ``gzip`` setting is on, their compressed variants
+    are built once when they are cached (brotli too, if the module is
+    installed).
+
+    If the ``static_precompressed`` application setting is on, files
+    compressed at build time next to the original ones (e.g. ``app.js.br``
+    and ``app.js.gz`` for ``app.js``) are served to clients that accept
+    those encodings, unless they are older than the original file.
+    Otherwise, with the ``gzip`` setting on, whole files of compressible
+    types are compressed on the fly by the output transforms, up to
+    `MAX_COMPRESSED_FILE_SIZE` bytes; bigger files and ranges are streamed
+    as they are.
     """
     CACHE_MAX_AGE = 86400 * 365 * 10  # 10 years
 
+    # Requests for more ranges than this get the whole file.
+    MAX_RANGES = 16
+
+    # Files bigger than this are never kept in the static cache.
+    MAX_CACHED_FILE_SIZE = 1048576
+
+    # Files bigger than this are streamed as they are rather than
+    # compressed on the fly by the content encoding transforms.
+    MAX_COMPRESSED_FILE_SIZE = 1048576
+
+    # Content encodings of precompressed files, in order of preference,
+    # and the extensions of their files.
+    PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
     _static_hashes = {}
-    _lock = threading.Lock()  # protects _static_hashes
+    _static_versions = {}  # mtimes and sizes of the hashed files
+    _lock = threading.Lock()  # protects _static_hashes and _static_versions
+    _static_cache = None
 
     def initialize(self, path, default_filename=None):
         self.root = "%s%s" % (os.path.abspath(path), os.path.sep)
@@ -1684,6 +1994,22 @@ class StaticFileHandler(RequestHandler):
     def reset(cls):
         with cls._lock:
             cls._static_hashes = {}
+            cls._static_versions = {}
+            cls._static_cache = None
+
+    @classmethod
+    def reload_changed(cls):
+        """Forgets the version hashes of the files modified since they
+        were hashed.
+
+        Cached files are checked for modifications on every request in
+        debug mode, so they need not be forgotten here.
+        """
+        with cls._lock:
+            for abs_path, version in list(cls._static_versions.items()):
+                if _file_version(abs_path) != version:
+                    cls._static_hashes.pop(abs_path, None)
+                    del cls._static_versions[abs_path]
 
     def head(self, path):
         self.get(path, include_body=False)
@@ -1695,24 +2021,65 @@ class StaticFileHandler(RequestHandler):
         # it needs to be temporarily added back for requests to root/
         if not (abspath + os.path.sep).startswith(self.root):
             raise HTTPError(403, "%s is not in root static directory", path)
-        if os.path.isdir(abspath) and self.default_filename is not None:
+        cache = self._get_static_cache()
+        # Only files are cached, so a cache hit needs no further checks.
+        entry = cache is not None and self._get_cached_file(cache, abspath)
+        if not entry and self.default_filename is not None and \
+                os.path.isdir(abspath):
             # need to look at the request.path here for when path is empty
             # but there is some prefix to the path that was already
             # trimmed by the routing
             if not self.request.path.endswith("/"):
                 self.redirect("%s/" % self.request.path)
             abspath = os.path.join(abspath, self.default_filename)
+            entry = cache is not None and \
+                self._get_cached_file(cache, abspath)
+        if entry:
+            return self._serve(path, abspath, entry.mtime, entry.size,
+                               entry.mime_type, entry, include_body)
         if not os.path.exists(abspath):
             raise HTTPError(404)
         if not os.path.isfile(abspath):
             raise HTTPError(403, "%s is not a file", path)
 
         stat_result = os.stat(abspath)
-        modified = datetime.datetime.fromtimestamp(stat_result[stat.ST_MTIME])
-
+        mtime = stat_result[stat.ST_MTIME]
+        size = stat_result[stat.ST_SIZE]
+        mime_type, encoding = mimetypes.guess_type(abspath)
+        entry = None
+        if cache is not None and size <= self.MAX_CACHED_FILE_SIZE and \
+                not self._finished:
+            entry = self._cache_file(cache, abspath, mtime, size, mime_type)
+        return self._serve(path, abspath, mtime, size, mime_type, entry,
+                           include_body)
+
+    def _serve(self, path, abspath, mtime, size, mime_type, entry,
+               include_body):
+        modified = datetime.datetime.fromtimestamp(mtime)
         self.set_header("Last-Modified", modified)
+        precompressed = self.settings.get("static_precompressed")
+        # Ranges are served from the file itself; whole responses may be
+        # a compressed variant, which gets its own strong validator.
+        encoding = variant = sibling = None
+        compress = False
+        if "Range" not in self.request.headers:
+            if entry:
+                encoding, variant = self._get_variant(entry)
+            elif precompressed:
+                encoding, sibling, sibling_size = \
+                    self._get_sibling(abspath, mtime)
+            if encoding is None and size <= self.MAX_COMPRESSED_FILE_SIZE:
+                encoding = self._get_transform_encoding(mime_type, size)
+                compress = encoding is not None
+        etag = '"%x-%x"' % (mtime, size)
+        if encoding is not None:
+            etag = '"%x-%x-%s"' % (mtime, size, encoding)
+        self.set_header("Etag", etag)
+        self.set_header("Accept-Ranges", "bytes")
+        if precompressed and not self.settings.get("gzip"):
+            # Otherwise GZipContentEncoding adds it.
+            self.set_header("Vary", "Accept-Encoding")
 
-        mime_type, encoding = mimetypes.guess_type(abspath)
         if mime_type:
             self.set_header("Content-Type", mime_type)
 
@@ -1725,23 +2092,241 @@ class StaticFileHandler(RequestHandler):
 
         self.set_extra_headers(path)
 
-        # Check the If-Modified-Since, and don't send the result if the
-        # content has not been modified
-        ims_value = self.request.headers.get("If-Modified-Since")
-        if ims_value is not None:
-            date_tuple = email.utils.parsedate(ims_value)
-            if_since = datetime.datetime.fromtimestamp(time.mktime(date_tuple))
-            if if_since >= modified:
+        # Check the If-None-Match and If-Modified-Since, and don't send the
+        # result if the content has not been modified
+        inm = self.request.headers.get("If-None-Match")
+        if inm is not None:
+            if inm.find(etag) != -1 or inm.strip() == "*":
                 self.set_status(304)
                 return
+        else:
+            ims_value = self.request.headers.get("If-Modified-Since")
+            if ims_value is not None:
+                date_tuple = email.utils.parsedate(ims_value)
+                if date_tuple is not None:
+                    if_since = datetime.datetime.fromtimestamp(
+                        time.mktime(date_tuple))
+                    if if_since >= modified:
+                        self.set_status(304)
+                        return
 
-        with open(abspath, "rb") as file:
-            data = file.read()
-            if include_body:
-                self.write(data)
+        ranges = self._get_ranges(size, etag)
+        if ranges == []:
+            self.set_status(416)  # Range Not Satisfiable
+            self.clear_header("Content-Type")
+            self.set_header("Content-Range", "bytes */%s" % size)
+            return
+        body = entry.body if entry else None
+        if compress:
+            # Without a Content-Length the body goes through the output
+            # transforms, which compress it.
+            if body is None:
+                with open(abspath, "rb") as file:
+                    body = file.read()
+            self.write(body)
+            return
+        if ranges is None:
+            ranges = [(0, size)]
+            if variant is not None:
+                self.set_header("Content-Encoding", encoding)
+                ranges = [(0, len(variant))]
+                body = variant
+            elif sibling is not None:
+                self.set_header("Content-Encoding", encoding)
+                ranges = [(0, sibling_size)]
+                abspath = sibling
+        else:
+            self.set_status(206)
+
+        boundary = None
+        if len(ranges) > 1:
+            boundary = binascii.hexlify(os.urandom(16))
+            parts = []
+            length = 0
+            for start, end in ranges:
+                part = (b"--" + boundary + b"\r\n" + utf8(
+                    "Content-Type: %s\r\nContent-Range: %s\r\n\r\n" % (
+                        mime_type or "application/octet-stream",
+                        httputil._get_content_range(start, end, size))))
+                parts.append(part)
+                length += len(part) + end - start + 2
+            footer = b"--" + boundary + b"--\r\n"
+            length += len(footer)
+            self.set_header("Content-Type", "multipart/byteranges; "
+                            "boundary=" + _unicode(boundary))
+        else:
+            start, end = ranges[0]
+            length = end - start
+            if self._status_code == 206:
+                self.set_header("Content-Range",
+                                httputil._get_content_range(start, end, size))
+        self.set_header("Content-Length", length)
+
+        if not include_body:
+            assert self.request.method == "HEAD"
+            return
+
+        # Send the headers first. Having a Content-Length, they go out
+        # untouched by output transforms, and so does the file content.
+        self.flush()
+        if not length:
+            return
+        if body is not None:
+            if boundary is None:
+                self.request.write(body[start:end])
             else:
-                assert self.request.method == "HEAD"
-                self.set_header("Content-Length", len(data))
+                for part, (start, end) in zip(parts, ranges):
+                    self.request.write(part + body[start:end] + b"\r\n")
+                self.request.write(footer)
+            return
+        file = open(abspath, "rb")
+        if boundary is None:
+            d = self.request.write_file(file, start, length)
+        else:
+            d = defer.succeed(None)
+            for part, (start, end) in zip(parts, ranges):
+                d.addCallback(lambda ign, part=part: self.request.write(part))
+                d.addCallback(lambda ign, start=start, end=end:
+                              self.request.write_file(file, start,
+                                                      end - start))
+                d.addCallback(lambda ign: self.request.write(b"\r\n"))
+            d.addCallback(lambda ign: self.request.write(footer))
+
+        def close(result):
+            file.close()
+            return result
+        d.addBoth(close)
+        return d
+
+    def _get_static_cache(self):
+        cls = self.__class__
+        if cls._static_cache is None:
+            size = self.settings.get("static_cache_size")
+            if not size:
+                return None
+            cls._static_cache = LRUCache(size, weigh=_StaticFile.weigh)
+        return cls._static_cache
+
+    def _get_cached_file(self, cache, abspath):
+        """Returns the cache entry of abspath, unless it is out of date."""
+        entry = cache.get(abspath)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry.checked < self.settings.get(
+                "static_cache_revalidate",
+                0 if self.settings.get("debug") else 1):
+            return entry
+        try:
+            stat_result = os.stat(abspath)
+        except OSError:
+            stat_result = None
+        if stat_result is None or \
+                stat_result[stat.ST_MTIME] != entry.mtime or \
+                stat_result[stat.ST_SIZE] != entry.size:
+            cache.pop(abspath)
+            return None
+        entry.checked = now
+        return entry
+
+    def _cache_file(self, cache, abspath, mtime, size, mime_type):
+        with open(abspath, "rb") as file:
+            body = file.read()
+        if len(body) != size:
+            # Modified while we were looking at it.
+            return None
+        entry = _StaticFile(body, mtime, mime_type)
+        if self.settings.get("static_precompressed"):
+            for encoding, ext in self.PRECOMPRESSED:
+                try:
+                    if os.stat(abspath + ext)[stat.ST_MTIME] < mtime:
+                        continue
+                    with open(abspath + ext, "rb") as file:
+                        setattr(entry, encoding, file.read())
+                except (IOError, OSError):
+                    pass
+        gzip_transform = GZipContentEncoding.configure(self.settings)
+        if self.settings.get("gzip") and \
+                gzip_transform.compressible_type(mime_type) and \
+                size >= gzip_transform.MIN_LENGTH:
+            if entry.gzip is None:
+                variant = gzip.compress(body)
+                if len(variant) < size:
+                    entry.gzip = variant
+            if entry.br is None and brotli is not None:
+                variant = brotli.compress(body)
+                if len(variant) < size:
+                    entry.br = variant
+        cache[abspath] = entry
+        return entry
+
+    def _accepted_encodings(self):
+        """Returns the precompressed encodings the client accepts, best
+        first.
+        """
+        if not self.request.supports_http_1_1():
+            return []
+        return httputil.accepted_encodings(
+            self.request.headers.get("Accept-Encoding", ""),
+            [encoding for encoding, ext in self.PRECOMPRESSED])
+
+    def _get_variant(self, entry):
+        """Returns the best precompressed variant the client accepts."""
+        if entry.gzip is None and entry.br is None:
+            return None, None
+        for encoding in self._accepted_encodings():
+            variant = getattr(entry, encoding)
+            if variant is not None:
+                return encoding, variant
+        return None, None
+
+    def _get_sibling(self, abspath, mtime):
+        """Returns the encoding, path and size of the best file compressed
+        at build time for abspath that the client accepts, if any.
+        """
+        extensions = dict(self.PRECOMPRESSED)
+        for encoding in self._accepted_encodings():
+            ext = extensions[encoding]
+            try:
+                stat_result = os.stat(abspath + ext)
+            except OSError:
+                continue
+            if stat.S_ISREG(stat_result[stat.ST_MODE]) and \
+                    stat_result[stat.ST_MTIME] >= mtime:
+                return encoding, abspath + ext, stat_result[stat.ST_SIZE]
+        return None, None, None
+
+    def _get_transform_encoding(self, mime_type, size):
+        """Returns the coding an output transform will apply to the whole
+        file, if any.
+        """
+        for transform in self._transforms or ():
+            if isinstance(transform, GZipContentEncoding) and \
+                    transform._compressing and \
+                    transform.compressible_type(mime_type) and \
+                    size >= transform.MIN_LENGTH:
+                return transform.ENCODING
+        return None
+
+    def _get_ranges(self, size, etag):
+        """Returns the ranges of the file that were requested.
+
+        ``None`` means the whole file, and an empty list that none of the
+        requested ranges can be satisfied.
+        """
+        range_header = self.request.headers.get("Range")
+        if range_header is None or self.request.method not in ("GET", "HEAD"):
+            return None
+        # If-Range holds the validator of the representation the client
+        # already has part of; if it changed, send the whole file.
+        if_range = self.request.headers.get("If-Range")
+        if if_range is not None and \
+                if_range.strip() not in (etag, self._headers["Last-Modified"]):
+            return None
+        ranges = httputil._parse_request_ranges(range_header, size)
+        if ranges is not None and len(ranges) > self.MAX_RANGES:
+            return None
+        return ranges
 
     def set_extra_headers(self, path):
         """For subclass to add extra headers to the response"""
@@ -1792,6 +2377,7 @@ class StaticFileHandler(RequestHandler):
         with cls._lock:
             hashes = cls._static_hashes
             if abs_path not in hashes:
+                cls._static_versions[abs_path] = _file_version(abs_path)
                 try:
                     f = open(abs_path, "rb")
                     hashes[abs_path] = hashlib.md5(f.read()).hexdigest()
@@ -1816,6 +2402,23 @@ class StaticFileHandler(RequestHandler):
         return url_path
 
 
+class _StaticFile(object):
+    """A file kept in the `StaticFileHandler` cache."""
+    __slots__ = ("body", "mtime", "size", "mime_type", "gzip", "br",
+                 "checked")
+
+    def __init__(self, body, mtime, mime_type):
+        self.body = body
+        self.mtime = mtime
+        self.size = len(body)
+        self.mime_type = mime_type
+        self.gzip = self.br = None
+        self.checked = time.time()
+
+    def weigh(self):
+        return self.size + len(self.gzip or b"") + len(self.br or b"")
+
+
 class FallbackHandler(RequestHandler):
     """A RequestHandler that wraps another HTTP server callback.
 
@@ -1846,54 +2449,218 @@ class OutputTransform(object):
     def transform_chunk(self, chunk, finishing):
         return chunk
 
+    def transform_first_parts(self, status_code, headers, parts, finishing):
+        """Like `transform_first_chunk`, with the chunk given and returned
+        as a list of byte strings, so that it needn't be joined.
+
+        By default, the parts are joined for subclasses that override
+        `transform_first_chunk`.
+        """
+        if type(self).transform_first_chunk is \
+                OutputTransform.transform_first_chunk:
+            return status_code, headers, parts
+        status_code, headers, chunk = self.transform_first_chunk(
+            status_code, headers, b"".join(parts), finishing)
+        return status_code, headers, [chunk]
+
+    def transform_parts(self, parts, finishing):
+        """Like `transform_chunk`, with the chunk given and returned as a
+        list of byte strings.
+        """
+        if type(self).transform_chunk is OutputTransform.transform_chunk:
+            return parts
+        return [self.transform_chunk(b"".join(parts), finishing)]
+
 
 class GZipContentEncoding(OutputTransform):
     """Applies the gzip content encoding to the response.
 
+    The compression level, the minimum size of a response worth
+    compressing and the set of compressible mime types can be changed
+    with the ``gzip_compress_level``, ``gzip_min_length`` and
+    ``gzip_content_types`` application settings.  Content types may be
+    given as ``major/*`` to match a whole family of types.
+
+    When several content encoding transforms are installed, each of them
+    only encodes the responses for which its coding is the best one the
+    client accepts among `ENCODINGS`, following the q-values of the
+    Accept-Encoding header.
+
     See http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.11
     """
-    CONTENT_TYPES = set([
+    CONTENT_TYPES = frozenset([
         "text/plain", "text/html", "text/css", "text/xml",
         "application/javascript", "application/x-javascript",
         "application/xml", "application/atom+xml",
-        "text/javascript", "application/json", "application/xhtml+xml"])
-    MIN_LENGTH = 5
+        "text/javascript", "application/json", "application/xhtml+xml",
+        "image/svg+xml"])
+
+    # Level 6 is zlib's default and compresses typical HTML within a few
+    # percent of level 9 at a fraction of the cost.
+    GZIP_LEVEL = 6
+
+    # Responses smaller than this are not worth the gzip framing overhead.
+    MIN_LENGTH = 1024
+
+    # The coding this transform applies.
+    ENCODING = "gzip"
+
+    # The codings offered by the application, in order of preference.
+    ENCODINGS = ("gzip",)
+
+    # Whether the library the coding needs is importable.
+    AVAILABLE = True
 
     def __init__(self, request):
-        self._gzipping = request.supports_http_1_1() and \
-            "gzip" in request.headers.get("Accept-Encoding", [])
+        accept = request.headers.get("Accept-Encoding", "")
+        self._compressing = bool(accept) and \
+            request.supports_http_1_1() and \
+            httputil.accepted_encodings(accept, self.ENCODINGS)[:1] == \
+            [self.ENCODING]
+
+    @classmethod
+    def configure(cls, settings, encodings=None):
+        """Returns this transform configured from application settings.
+
+        ``encodings`` is the sequence of codings offered next to this one.
+        The class itself is returned unless one of the settings or
+        ``encodings`` overrides its defaults.
+        """
+        attrs = {}
+        if settings.get("gzip_compress_level") is not None:
+            attrs["GZIP_LEVEL"] = settings["gzip_compress_level"]
+        if settings.get("brotli_quality") is not None:
+            attrs["BROTLI_QUALITY"] = settings["brotli_quality"]
+        if settings.get("zstd_level") is not None:
+            attrs["ZSTD_LEVEL"] = settings["zstd_level"]
+        if settings.get("gzip_min_length") is not None:
+            attrs["MIN_LENGTH"] = settings["gzip_min_length"]
+        if settings.get("gzip_content_types") is not None:
+            attrs["CONTENT_TYPES"] = frozenset(settings["gzip_content_types"])
+        if encodings is not None and tuple(encodings) != cls.ENCODINGS:
+            attrs["ENCODINGS"] = tuple(encodings)
+        if not attrs:
+            return cls
+        return type(cls.__name__, (cls,), attrs)
+
+    @classmethod
+    def compressible_type(cls, ctype):
+        """Returns True if responses of the given mime type are compressed."""
+        if not ctype:
+            return False
+        return ctype in cls.CONTENT_TYPES or \
+            ctype.split("/", 1)[0] + "/*" in cls.CONTENT_TYPES
 
     def transform_first_chunk(self, status_code, headers, chunk, finishing):
-        if 'Vary' in headers:
-            headers['Vary'] += ', Accept-Encoding'
-        else:
+        status_code, headers, parts = self.transform_first_parts(
+            status_code, headers, [chunk], finishing)
+        return status_code, headers, b"".join(parts)
+
+    def transform_chunk(self, chunk, finishing):
+        return b"".join(self.transform_parts([chunk], finishing))
+
+    def transform_first_parts(self, status_code, headers, parts, finishing):
+        if 'Vary' not in headers:
             headers['Vary'] = 'Accept-Encoding'
-        if self._gzipping:
+        elif 'Accept-Encoding' not in headers['Vary']:
+            headers['Vary'] += ', Accept-Encoding'
+        if self._compressing:
             ctype = _unicode(headers.get("Content-Type", "")).split(";")[0]
-            self._gzipping = (ctype in self.CONTENT_TYPES) and \
-                (not finishing or len(chunk) >= self.MIN_LENGTH) and \
+            self._compressing = self.compressible_type(ctype) and \
+                (not finishing or
+                 sum(len(part) for part in parts) >= self.MIN_LENGTH) and \
                 (finishing or "Content-Length" not in headers) and \
                 ("Content-Encoding" not in headers)
-        if self._gzipping:
-            headers["Content-Encoding"] = "gzip"
-            self._gzip_value = BytesIO()
-            self._gzip_file = gzip.GzipFile(mode="w", fileobj=self._gzip_value)
-            chunk = self.transform_chunk(chunk, finishing)
+        if self._compressing:
+            headers["Content-Encoding"] = self.ENCODING
+            self._start()
+            parts = self.transform_parts(parts, finishing)
             if "Content-Length" in headers:
-                headers["Content-Length"] = str(len(chunk))
-        return status_code, headers, chunk
+                headers["Content-Length"] = str(len(parts[0]))
+        return status_code, headers, parts
+
+    def transform_parts(self, parts, finishing):
+        if self._compressing:
+            # Parts are fed to the compressor as they are and only one
+            # flush is issued per call, so a response written in many
+            # small pieces is not padded with a sync marker per write.
+            chunks = [self._compress(part) for part in parts]
+            if finishing or parts:
+                chunks.append(self._flush(finishing))
+            return [b"".join(chunks)]
+        return parts
+
+    def _start(self):
+        # wbits of 16 + MAX_WBITS makes zlib write the gzip header
+        # and trailer itself.
+        self._compressor = zlib.compressobj(
+            self.GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def _compress(self, data):
+        return self._compressor.compress(data)
+
+    def _flush(self, finishing):
+        if finishing:
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class BrotliContentEncoding(GZipContentEncoding):
+    """Applies the brotli content encoding to the response.
+
+    Needs the ``brotli`` module.  The quality defaults to 4, which
+    compresses better than gzip at a comparable speed, and can be changed
+    with the ``brotli_quality`` application setting.
+
+    See https://tools.ietf.org/html/rfc7932
+    """
+    BROTLI_QUALITY = 4
+    ENCODING = "br"
+    ENCODINGS = ("br",)
+    AVAILABLE = brotli is not None
 
-    def transform_chunk(self, chunk, finishing):
-        if self._gzipping:
-            self._gzip_file.write(chunk)
-            if finishing:
-                self._gzip_file.close()
-            else:
-                self._gzip_file.flush()
-            chunk = self._gzip_value.getvalue()
-            self._gzip_value.truncate(0)
-            self._gzip_value.seek(0)
-        return chunk
+    def _start(self):
+        self._compressor = brotli.Compressor(quality=self.BROTLI_QUALITY)
+
+    def _compress(self, data):
+        return self._compressor.process(data)
+
+    def _flush(self, finishing):
+        if finishing:
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class ZstdContentEncoding(GZipContentEncoding):
+    """Applies the zstd content encoding to the response.
+
+    Needs the ``zstandard`` module.  The level defaults to 3 and can be
+    changed with the ``zstd_level`` application setting.
+
+    See https://tools.ietf.org/html/rfc8878
+    """
+    ZSTD_LEVEL = 3
+    ENCODING = "zstd"
+    ENCODINGS = ("zstd",)
+    AVAILABLE = zstandard is not None
+
+    def _start(self):
+        self._compressor = zstandard.ZstdCompressor(
+            level=self.ZSTD_LEVEL).compressobj()
+
+    def _compress(self, data):
+        return self._compressor.compress(data)
+
+    def _flush(self, finishing):
+        if finishing:
+            return self._compressor.flush()
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+# The content encoding transforms the gzip setting installs, in order of
+# preference when the client accepts several of them equally.
+CONTENT_ENCODINGS = (BrotliContentEncoding, ZstdContentEncoding,
+                     GZipContentEncoding)
 
 
 class ChunkedTransferEncoding(OutputTransform):
@@ -1905,6 +2672,14 @@ class ChunkedTransferEncoding(OutputTransform):
         self._chunking = request.supports_http_1_1()
 
     def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        status_code, headers, parts = self.transform_first_parts(
+            status_code, headers, [chunk], finishing)
+        return status_code, headers, b"".join(parts)
+
+    def transform_chunk(self, block, finishing):
+        return b"".join(self.transform_parts([block], finishing))
+
+    def transform_first_parts(self, status_code, headers, parts, finishing):
         # 304 responses have no body (not even a zero-length body), and so
         # should not have either Content-Length or Transfer-Encoding headers.
         if self._chunking and status_code != 304:
@@ -1913,18 +2688,143 @@ class ChunkedTransferEncoding(OutputTransform):
                 self._chunking = False
             else:
                 headers["Transfer-Encoding"] = "chunked"
-                chunk = self.transform_chunk(chunk, finishing)
-        return status_code, headers, chunk
+                parts = self.transform_parts(parts, finishing)
+        return status_code, headers, parts
 
-    def transform_chunk(self, block, finishing):
+    def transform_parts(self, parts, finishing):
         if self._chunking:
             # Don't write out empty chunks because that means END-OF-STREAM
             # with chunked encoding
-            if block:
-                block = "%s\r\n%s\r\n" % (utf8("%x" % len(block)), block)
+            length = sum(len(part) for part in parts)
+            if length:
+                parts = [utf8("%x\r\n" % length)] + parts + [b"\r\n"]
             if finishing:
-                block = "%s0\r\n\r\n" % block
-        return block
+                parts = parts + [b"0\r\n\r\n"]
+        return parts
+
+
+class SendQueue(object):
+    """Bounds the data a long-lived connection holds for a slow client.
+
+    The queue registers itself as the streaming producer of the transport.
+    Writes go straight to the transport until Twisted pauses the producer
+    because the transport buffer is full; then they wait in the queue,
+    which the transport drains as it resumes the producer. When queueing a
+    write would take the queue past ``high_water_mark`` bytes,
+    ``on_backpressure`` is called and then the policy applies:
+
+    - `DROP_OLDEST` drops queued writes, oldest first, to make room;
+    - `DROP_NEW` drops the new write;
+    - `DISCONNECT` drops the queue and aborts the connection.
+
+    Writes are dropped whole, so each one should be a complete message.
+    """
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEW = "drop_new"
+    DISCONNECT = "disconnect"
+    POLICIES = (DROP_OLDEST, DROP_NEW, DISCONNECT)
+
+    HIGH_WATER_MARK = 1024 * 1024
+
+    def __init__(self, transport, high_water_mark=None, policy=None,
+                 on_backpressure=None):
+        if policy is not None and policy not in self.POLICIES:
+            raise ValueError("Unknown send queue policy %r" % policy)
+        self.transport = transport
+        self.high_water_mark = self.HIGH_WATER_MARK \
+            if high_water_mark is None else high_water_mark
+        self.policy = policy or self.DISCONNECT
+        self.on_backpressure = on_backpressure
+        self.queued = 0
+        self._queue = collections.deque()
+        self._paused = False
+        self._stopped = False
+        transport.registerProducer(self, True)
+
+    def write(self, data):
+        """Writes or queues ``data``, and returns whether it was kept."""
+        if self._stopped:
+            return False
+        if not self._paused:
+            self.transport.write(data)
+            return True
+        if self.queued + len(data) > self.high_water_mark:
+            if self.on_backpressure is not None:
+                self.on_backpressure()
+            if self._stopped:
+                return False
+            if self.policy == self.DISCONNECT or \
+                    len(data) > self.high_water_mark:
+                if self.policy == self.DISCONNECT:
+                    self._disconnect()
+                return False
+            elif self.policy == self.DROP_NEW:
+                return False
+            while self.queued + len(data) > self.high_water_mark:
+                self.queued -= len(self._queue.popleft())
+        self._queue.append(data)
+        self.queued += len(data)
+        return True
+
+    def _disconnect(self):
+        log.msg("Send queue over %d bytes, disconnecting" %
+                self.high_water_mark)
+        self.stopProducing()
+        abort = getattr(self.transport, "abortConnection", None)
+        if abort is not None:
+            abort()
+        else:
+            self.transport.loseConnection()
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        queue = self._queue
+        # writing may pause us again as soon as the transport buffer fills
+        while queue and not self._paused:
+            data = queue.popleft()
+            self.queued -= len(data)
+            self.transport.write(data)
+
+    def stopProducing(self):
+        self._stopped = True
+        self._queue.clear()
+        self.queued = 0
+
+
+class BackpressureMixin(object):
+    """Gives a long-lived handler a `SendQueue` for what it pushes to the
+    client, see `cyclone.websocket.WebSocketHandler` and
+    `cyclone.sse.SSEHandler`.
+
+    The ``send_high_water_mark`` and ``send_queue_policy`` application
+    settings configure the queue, and the ``high_water_mark`` and
+    ``backpressure_policy`` attributes override them per handler.
+    """
+    high_water_mark = None
+    backpressure_policy = None
+
+    _send_queue = None
+
+    @property
+    def send_queue(self):
+        if self._send_queue is None:
+            high_water_mark = self.high_water_mark
+            if high_water_mark is None:
+                high_water_mark = self.settings.get("send_high_water_mark")
+            self._send_queue = SendQueue(
+                self.transport, high_water_mark,
+                self.backpressure_policy or
+                self.settings.get("send_queue_policy"),
+                self.on_backpressure)
+        return self._send_queue
+
+    def on_backpressure(self):
+        """Gets called when a write would take the send queue past its
+        high-water mark, before the policy drops data or disconnects."""
+        pass
 
 
 def authenticated(method):
@@ -2169,6 +3069,201 @@ class URLSpec(object):
 url = URLSpec
 
 
+def _unquote_group(s):
+    # None-safe wrapper around url_unescape to handle unmatched optional
+    # groups correctly
+    if s is None:
+        return s
+    return escape.url_unescape(s)
+
+
+def _literal_prefix(pattern):
+    """Returns the literal text every match of a url pattern starts with.
+
+    >>> _literal_prefix(r"/static/(.*)")
+    '/static/'
+    >>> _literal_prefix(r"/favicon\\.ico$")
+    '/favicon.ico'
+    >>> _literal_prefix(r"/posts?/([0-9]+)")
+    '/post'
+    >>> _literal_prefix(r"/a|/b")
+    ''
+    """
+    if pattern.startswith("^"):
+        pattern = pattern[1:]
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            if i + 1 == len(pattern) or pattern[i + 1].isalnum():
+                break  # \d, \w, \A...
+            c = pattern[i + 1]
+            i += 1
+        elif c in "*?{+":
+            # The quantifier applies to the last literal character.
+            if prefix:
+                prefix.pop()
+            break
+        elif c in ".^$([|":
+            break
+        prefix.append(c)
+        i += 1
+    # A top level alternation may match anything.
+    depth = 0
+    in_class = escaped = False
+    for c in pattern:
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif in_class:
+            in_class = c != "]"
+        elif c == "[":
+            in_class = True
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            return ""
+    return "".join(prefix)
+
+
+class _RouteTable(object):
+    """Finds the first `URLSpec` of a list that matches a path.
+
+    Specs are stored in a radix tree by the literal prefix of their
+    pattern, so that only the regexes of specs whose prefix matches the
+    path are tried, in the order of the list. Each node is a list of the
+    indices of the specs whose prefix ends there, and of a dictionary
+    mapping the first character of each outgoing edge to the edge label
+    and the child node.
+    """
+    def __init__(self, specs):
+        self.specs = list(specs)
+        self._root = [[], {}]
+        for index, spec in enumerate(self.specs):
+            self._insert(_literal_prefix(spec.regex.pattern), index)
+
+    def _insert(self, prefix, index):
+        node = self._root
+        while prefix:
+            edge = node[1].get(prefix[0])
+            if edge is None:
+                child = [[], {}]
+                node[1][prefix[0]] = (prefix, child)
+                node, prefix = child, ""
+                break
+            label, child = edge
+            common = 0
+            while common < min(len(label), len(prefix)) and \
+                    label[common] == prefix[common]:
+                common += 1
+            if common < len(label):
+                # Split the edge where the prefix diverges from it.
+                middle = [[], {label[common]: (label[common:], child)}]
+                node[1][label[0]] = (label[:common], middle)
+                child = middle
+            node, prefix = child, prefix[common:]
+        node[0].append(index)
+
+    def __len__(self):
+        return len(self.specs)
+
+    def match(self, path):
+        """Returns the first matching spec and its match object, or
+        ``(None, None)``.
+        """
+        candidates, children = self._root
+        merged = False
+        pos = 0
+        while children and pos < len(path):
+            edge = children.get(path[pos])
+            if edge is None or not path.startswith(edge[0], pos):
+                break
+            pos += len(edge[0])
+            indices, children = edge[1]
+            if indices:
+                if candidates:
+                    candidates = candidates + indices
+                    merged = True
+                else:
+                    candidates = indices
+        if merged:
+            candidates = sorted(candidates)
+        specs = self.specs
+        for index in candidates:
+            spec = specs[index]
+            match = spec.regex.match(path)
+            if match:
+                return spec, match
+        return None, None
+
+
+_SERVER = "cyclone/%s" % cyclone.version
+
+# Encoded status lines, keyed by (version, status_code, reason).  Only
+# standard reason phrases of the versions below are cached so the table
+# stays small; the version comes from the client.
+_status_lines = {}
+_CACHED_VERSIONS = frozenset(("HTTP/1.0", "HTTP/1.1"))
+
+# Encoded "Name: value" lines for headers that are identical across
+# responses.  The current Date line is swapped in once per second by
+# _http_date().
+_header_lines = dict((item, utf8("%s: %s" % item)) for item in (
+    ("Server", _SERVER),
+    ("Content-Type", "text/html; charset=UTF-8"),
+    ("Content-Type", "text/plain; charset=UTF-8"),
+    ("Content-Type", "application/json; charset=UTF-8"),
+    ("Connection", "Keep-Alive"),
+    ("Transfer-Encoding", "chunked"),
+    ("Content-Encoding", "gzip"),
+    ("Vary", "Accept-Encoding"),
+    ("Accept-Ranges", "bytes"),
+))
+
+_date = [None, None]  # [second, formatted date]
+
+
+def _http_date():
+    """Returns the current time formatted for the ``Date`` header.
+
+    The value is formatted at most once per second and shared by every
+    response generated within that second.
+    """
+    now = int(time.time())
+    if now != _date[0]:
+        value = email.utils.formatdate(now, usegmt=True)
+        _header_lines.pop(("Date", _date[1]), None)
+        _header_lines[("Date", value)] = utf8("Date: " + value)
+        _date[0] = now
+        _date[1] = value
+    return _date[1]
+
+
+def _status_line(version, status_code, reason):
+    key = (version, status_code, reason)
+    line = _status_lines.get(key)
+    if line is None:
+        line = utf8("%s %d %s" % key)
+        if version in _CACHED_VERSIONS and \
+                reason == http_client.responses.get(status_code):
+            _status_lines[key] = line
+    return line
+
+
+def _file_version(path):
+    # The size catches most changes made within the mtime resolution of
+    # the filesystem.
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
 def _time_independent_equals(a, b):
     if len(a) != len(b):
         return False
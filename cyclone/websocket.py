@@ -27,19 +27,172 @@ import base64
 import functools
 import hashlib
 import struct
+import zlib
 
 import cyclone
 import cyclone.web
 import cyclone.escape
 
+from cyclone.httputil import parse_websocket_extensions
+
 from twisted.python import log
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# payloads shorter than this are unmasked as one big integer, which is
+# cheaper than setting up numpy arrays for them
+_NUMPY_MASK_MIN = 4096
 
-class _NotEnoughFrame(Exception):
-    pass
 
+def _mask(data, mask):
+    """XORs ``data`` with the 4-byte ``mask`` repeated over its length.
 
-class WebSocketHandler(cyclone.web.RequestHandler):
+    Masking and unmasking are the same operation (RFC 6455, section 5.3).
+    Uses numpy when it is installed, and XORs the payload as a single
+    integer otherwise; both run in C instead of once per byte.
+    """
+    length = len(data)
+    if numpy is not None and length >= _NUMPY_MASK_MIN:
+        words = length // 4
+        head = numpy.frombuffer(data, dtype=numpy.uint32, count=words)
+        head = (head ^ numpy.frombuffer(mask, dtype=numpy.uint32)).tobytes()
+        return head + _mask(data[words * 4:], mask)
+    mask = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, "little") ^
+            int.from_bytes(mask, "little")).to_bytes(length, "little")
+
+
+def _frame(payload, code=0x81):
+    """Returns ``payload`` as a single unmasked RFC 6455 frame."""
+    length = len(payload)
+    if length <= 125:
+        return struct.pack("!BB", code, length) + payload
+    elif length < 65536:
+        return struct.pack("!BBH", code, 126, length) + payload
+    else:
+        return struct.pack("!BBQ", code, 127, length) + payload
+
+
+class PerMessageDeflate(object):
+    """The permessage-deflate extension (RFC 7692) of one connection.
+
+    Messages are compressed as raw deflate streams that end in a sync
+    flush, which is stripped off the wire. Unless context takeover is
+    turned off, one compressor and one decompressor live as long as the
+    connection so later messages refer back to earlier ones, which is what
+    makes repetitive JSON compress well.
+    """
+    NAME = "permessage-deflate"
+    COMPRESSION_LEVEL = 6
+    MEM_LEVEL = 8
+    MAX_WINDOW_BITS = zlib.MAX_WBITS
+
+    def __init__(self, compression_level=None, mem_level=None,
+                 window_bits=None, server_context_takeover=True,
+                 client_context_takeover=True, window_bits_requested=False):
+        self.compression_level = self.COMPRESSION_LEVEL \
+            if compression_level is None else compression_level
+        self.mem_level = self.MEM_LEVEL if mem_level is None else mem_level
+        self.window_bits = self.MAX_WINDOW_BITS \
+            if window_bits is None else window_bits
+        self.server_context_takeover = server_context_takeover
+        self.client_context_takeover = client_context_takeover
+        # an offer with server_max_window_bits is only accepted by a
+        # response that has it too
+        self.window_bits_requested = window_bits_requested
+        self._compressor = None
+        self._decompressor = None
+
+    @classmethod
+    def negotiate(cls, header, options):
+        """Returns an instance for the first offer in a
+        Sec-WebSocket-Extensions header that can be accepted with
+        ``options`` (see `WebSocketHandler.get_compression_options`), or
+        None if there is none.
+        """
+        for name, params in parse_websocket_extensions(header):
+            if name == cls.NAME:
+                deflate = cls._accept(params, options)
+                if deflate is not None:
+                    return deflate
+        return None
+
+    @classmethod
+    def _accept(cls, params, options):
+        # zlib can not deflate with a window smaller than 9 bits
+        window_bits = max(9, min(cls.MAX_WINDOW_BITS, options.get(
+            "max_window_bits", cls.MAX_WINDOW_BITS)))
+        server_takeover = options.get("context_takeover", True)
+        client_takeover = True
+        window_bits_requested = False
+        for key, value in params.items():
+            if key == "server_no_context_takeover" and value is None:
+                server_takeover = False
+            elif key == "client_no_context_takeover" and value is None:
+                client_takeover = False
+            elif key == "server_max_window_bits" and value and \
+                    value.isdigit() and 8 <= int(value) <= 15:
+                if int(value) < 9:
+                    return None
+                window_bits = min(window_bits, int(value))
+                window_bits_requested = True
+            elif key == "client_max_window_bits" and (
+                    value is None or value.isdigit() and
+                    8 <= int(value) <= 15):
+                # the full window decompresses whatever the client sends
+                pass
+            else:
+                return None
+        return cls(options.get("compression_level"),
+                   options.get("mem_level"), window_bits,
+                   server_takeover, client_takeover, window_bits_requested)
+
+    @property
+    def response(self):
+        """The Sec-WebSocket-Extensions value that accepts the offer."""
+        params = [self.NAME]
+        if not self.server_context_takeover:
+            params.append("server_no_context_takeover")
+        if not self.client_context_takeover:
+            params.append("client_no_context_takeover")
+        if self.window_bits_requested or \
+                self.window_bits < self.MAX_WINDOW_BITS:
+            params.append("server_max_window_bits=%d" % self.window_bits)
+        return "; ".join(params)
+
+    def compress(self, data):
+        compressor = self._compressor
+        if compressor is None:
+            compressor = zlib.compressobj(self.compression_level,
+                                          zlib.DEFLATED, -self.window_bits,
+                                          self.mem_level)
+            if self.server_context_takeover:
+                self._compressor = compressor
+        data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        # drop the 00 00 ff ff that ends every sync flush
+        return data[:-4]
+
+    def decompress(self, data, max_length):
+        """Returns the decompressed message, or None if it would be longer
+        than ``max_length``. Raises zlib.error on invalid data.
+        """
+        decompressor = self._decompressor
+        if decompressor is None:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            if self.client_context_takeover:
+                self._decompressor = decompressor
+        data = decompressor.decompress(data + b"\x00\x00\xff\xff",
+                                       max_length + 1)
+        if len(data) > max_length:
+            return None
+        return data
+
+
+class WebSocketHandler(cyclone.web.RequestHandler,
+                       cyclone.web.BackpressureMixin):
     """Subclass this class to create a basic WebSocket handler.
 
     Override messageReceived to handle incoming messages.
@@ -78,6 +231,9 @@ class WebSocketHandler(cyclone.web.RequestHandler):
       };
 
     This script pops up an alert box that says "You said: Hello, world".
+
+    Messages for a client that reads slower than they are sent wait in
+    `send_queue`, see `cyclone.web.BackpressureMixin` for its limits.
     """
     def __init__(self, application, request, **kwargs):
         cyclone.web.RequestHandler.__init__(self, application, request,
@@ -101,6 +257,29 @@ class WebSocketHandler(cyclone.web.RequestHandler):
         """Gets called when a message is received from the peer."""
         pass
 
+    def get_compression_options(self):
+        """Returns the permessage-deflate options for this connection, or
+        None to only exchange uncompressed messages.
+
+        Compression is turned on with the ``websocket_compression``
+        application setting and tuned with ``websocket_compression_level``,
+        ``websocket_mem_level``, ``websocket_max_window_bits`` and
+        ``websocket_context_takeover``. Override this method to opt a
+        handler out, or to return a dict with any of the keys
+        ``compression_level``, ``mem_level``, ``max_window_bits`` and
+        ``context_takeover``.
+        """
+        settings = self.settings
+        if not settings.get("websocket_compression"):
+            return None
+        return dict(
+            compression_level=settings.get("websocket_compression_level"),
+            mem_level=settings.get("websocket_mem_level"),
+            max_window_bits=settings.get("websocket_max_window_bits",
+                                         PerMessageDeflate.MAX_WINDOW_BITS),
+            context_takeover=settings.get("websocket_context_takeover",
+                                          True))
+
     def sendMessage(self, message):
         """Sends the given message to the client of this Web Socket.
 
@@ -109,10 +288,9 @@ class WebSocketHandler(cyclone.web.RequestHandler):
         """
         if isinstance(message, dict):
             message = cyclone.escape.json_encode(message)
-        if isinstance(message, unicode):
-            message = message.encode("utf-8")
-        assert isinstance(message, str)
-        self.ws_protocol.sendMessage(message)
+        message = cyclone.escape.utf8(message)
+        assert isinstance(message, bytes)
+        return self.ws_protocol.sendMessage(message)
 
     def _rawDataReceived(self, data):
         self.ws_protocol.handleRawData(data)
@@ -144,12 +322,101 @@ class WebSocketHandler(cyclone.web.RequestHandler):
         self.ws_protocol.acceptConnection()
 
     def forbidConnection(self, message):
-        self.transport.write(
-            "HTTP/1.1 403 Forbidden\r\nContent-Length: %s\r\n\r\n%s" %
-            (str(len(message)), message))
+        message = cyclone.escape.utf8(message)
+        self.transport.write(cyclone.escape.utf8(
+            "HTTP/1.1 403 Forbidden\r\nContent-Length: %d\r\n\r\n" %
+            len(message)) + message)
         return self.transport.loseConnection()
 
 
+class WebSocketGroup(object):
+    """A set of WebSocket connections that are sent the same messages.
+
+    `broadcast` encodes and frames a message once and writes the same
+    bytes object to every connection, instead of building a frame per
+    connection as looping over `WebSocketHandler.sendMessage` does.
+    Connections that already hold more than ``high_water_mark`` bytes in
+    their `cyclone.web.SendQueue` are skipped, so one slow client can not
+    make the process hold a copy of every message for it::
+
+      class ChatSocketHandler(websocket.WebSocketHandler):
+          chatters = websocket.WebSocketGroup()
+
+          def connectionMade(self):
+              self.chatters.add(self)
+
+          def connectionLost(self, reason):
+              self.chatters.discard(self)
+
+          def messageReceived(self, message):
+              self.chatters.broadcast(message)
+    """
+    HIGH_WATER_MARK = 1024 * 1024
+
+    def __init__(self, high_water_mark=None):
+        self.high_water_mark = self.HIGH_WATER_MARK \
+            if high_water_mark is None else high_water_mark
+        self._handlers = set()
+
+    def add(self, handler):
+        self._handlers.add(handler)
+
+    def discard(self, handler):
+        self._handlers.discard(handler)
+
+    def __contains__(self, handler):
+        return handler in self._handlers
+
+    def __iter__(self):
+        return iter(self._handlers)
+
+    def __len__(self):
+        return len(self._handlers)
+
+    def broadcast(self, message, exclude=None):
+        """Sends ``message`` to every connection in the group but
+        ``exclude``, and returns how many connections it was sent to.
+
+        The message may be a string or a dict, which is encoded as json.
+        """
+        if isinstance(message, dict):
+            message = cyclone.escape.json_encode(message)
+        message = cyclone.escape.utf8(message)
+        # frames shared by the connections that can use them, keyed by the
+        # compression options or None for uncompressed ones
+        frames = {}
+        sent = 0
+        for handler in tuple(self._handlers):
+            protocol = handler.ws_protocol
+            if handler is exclude or protocol is None or \
+                    protocol.transport.disconnecting or \
+                    protocol.bufferedAmount() > self.high_water_mark:
+                continue
+            if not isinstance(protocol, WebSocketProtocol17):
+                protocol.sendMessage(message)
+                sent += 1
+                continue
+            deflate = protocol._deflate
+            if deflate is None:
+                key = None
+            elif deflate.server_context_takeover:
+                # the compressor depends on what this connection was sent
+                sent += protocol.sendMessage(message)
+                continue
+            else:
+                key = (deflate.compression_level, deflate.mem_level,
+                       deflate.window_bits)
+            frame = frames.get(key)
+            if frame is None:
+                if key is None:
+                    frame = _frame(message)
+                else:
+                    frame = _frame(deflate.compress(message), 0xC1)
+                frames[key] = frame
+            sent += protocol._write(frame)
+        return sent
+
+
 class WebSocketProtocol(object):
     def __init__(self, handler):
         self.handler = handler
@@ -165,24 +432,43 @@ class WebSocketProtocol(object):
     def sendMessage(self, message):
         pass
 
+    def bufferedAmount(self):
+        """Returns how many bytes were sent but wait in the send queue,
+        because the transport paused it while its own buffer is full."""
+        return self.handler.send_queue.queued
+
 
 class WebSocketProtocol17(WebSocketProtocol):
+    # largest message, in bytes, accepted from a client; frames that would
+    # grow a message past it close the connection with status 1009. The
+    # ``websocket_max_message_size`` application setting overrides it.
+    MAX_MESSAGE_SIZE = 10 * 1024 * 1024
+
     def __init__(self, handler):
         WebSocketProtocol.__init__(self, handler)
 
-        self._partial_data = None
+        # received data is appended to _buffer and parsed from _offset on,
+        # so frames are never copied again while they are incomplete
+        self._buffer = bytearray()
+        self._offset = 0
+        self._closed = False
 
         self._frame_fin = None
         self._frame_rsv = None
         self._frame_ops = None
         self._frame_mask = None
-        self._frame_payload_length = None
-        self._frame_header_length = None
+        self._frame_payload_len = None
+        self._frame_header_len = None
 
-        self._data_len = None
-        self._header_index = None
+        self._fragments = []
+        self._fragments_len = 0
+        self._compressed = False
 
-        self._message_buffer = ""
+        # permessage-deflate state, when the client negotiated it
+        self._deflate = None
+
+        self.max_message_size = handler.settings.get(
+            "websocket_max_message_size", self.MAX_MESSAGE_SIZE)
 
     def acceptConnection(self):
         log.msg('Using ws spec (draft 17)')
@@ -195,70 +481,83 @@ class WebSocketProtocol17(WebSocketProtocol):
         else:
             origin = self.request.headers['Sec-Websocket-Origin']
 
+        extensions = ""
+        header = self.request.headers.get("Sec-Websocket-Extensions")
+        if header:
+            options = self.handler.get_compression_options()
+            if options is not None:
+                self._deflate = PerMessageDeflate.negotiate(header, options)
+            if self._deflate is not None:
+                extensions = "Sec-WebSocket-Extensions: %s\r\n" % \
+                    self._deflate.response
+                if self._deflate.server_context_takeover:
+                    # dropping a frame would break the client's
+                    # decompression context, so slow clients are dropped
+                    self.handler.send_queue.policy = \
+                        cyclone.web.SendQueue.DISCONNECT
+
         key = self.request.headers['Sec-Websocket-Key']
-        accept = base64.b64encode(hashlib.sha1("%s%s" %
-            (key, '258EAFA5-E914-47DA-95CA-C5AB0DC85B11')).digest())
+        accept = base64.b64encode(hashlib.sha1(cyclone.escape.utf8(
+            "%s%s" % (key, '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'))).digest())
 
-        self.transport.write(
+        self.transport.write(cyclone.escape.utf8(
             "HTTP/1.1 101 Web Socket Protocol Handshake\r\n"
             "Upgrade: WebSocket\r\n"
             "Connection: Upgrade\r\n"
             "Sec-WebSocket-Accept: %s\r\n"
+            "%s"
             "Server: cyclone/%s\r\n"
             "WebSocket-Origin: %s\r\n"
             "WebSocket-Location: ws://%s%s\r\n\r\n" %
-            (accept, cyclone.version, origin,
-             self.request.host, self.request.path))
+            (cyclone.escape.native_str(accept), extensions, cyclone.version,
+             origin,
+             self.request.host, self.request.path)))
 
         self.handler._connectionMade()
 
     def rawDataReceived(self, data):
-        while True:
-            if self._partial_data:
-                data = self._partial_data + data
-                self._partial_data = None
-
-            try:
-                self._processFrameHeader(data)
-            except _NotEnoughFrame:
-                self._partial_data = data
-                return
-
-            self._message_buffer += self._extractMessageFromFrame(data)
-
-            if self._frame_fin:
-                if self._frame_ops == 8:
-                    self.sendMessage(self._message_buffer, code=0x88)
-                    #self.handler.connectionLost(self._message_buffer)
-                elif self._frame_ops == 9:
-                    self.sendMessage(self._message_buffer, code=0x8A)
-                else:
-                    self.handler.messageReceived(self._message_buffer)
-                self._message_buffer = ""
-
-            # if there is still data after this frame, process again
-            current_len = self._frame_header_len + self._frame_payload_len
-            if current_len < self._data_len:
-                data = data[current_len:]
-            else:
+        if self._closed:
+            return
+        self._buffer += data
+        while self._frame_header_len is not None or \
+                self._processFrameHeader():
+            start = self._offset + self._frame_header_len
+            end = start + self._frame_payload_len
+            if len(self._buffer) < end:
                 break
+            payload = self._extractMessageFromFrame(start, end)
+            self._offset = end
+            self._frame_header_len = None
+            self._processFrame(payload)
+            if self._closed:
+                return
+        if self._offset:
+            del self._buffer[:self._offset]
+            self._offset = 0
 
-    def _processFrameHeader(self, data):
+    def _processFrameHeader(self):
+        """Parses the header of the next frame in the buffer.
 
-        self._data_len = len(data)
+        Returns False when the header is not complete yet. Otherwise the
+        ``_frame_*`` attributes describe the frame, whose payload may still
+        be partial.
+        """
+        data = self._buffer
+        offset = self._offset
+        available = len(data) - offset
 
         # we need at least 2 bytes to start processing a frame
-        if self._data_len < 2:
-            raise _NotEnoughFrame()
+        if available < 2:
+            return False
 
         # first byte contains fin, rsv and ops
-        b = ord(data[0])
+        b = data[offset]
         self._frame_fin = (b & 0x80) != 0
         self._frame_rsv = (b & 0x70) >> 4
         self._frame_ops = b & 0x0f
 
         # second byte contains mask and payload length
-        b = ord(data[1])
+        b = data[offset + 1]
         self._frame_mask = (b & 0x80) != 0
         frame_payload_len1 = b & 0x7f
 
@@ -269,59 +568,108 @@ class WebSocketProtocol17(WebSocketProtocol):
             self._frame_payload_len = frame_payload_len1
         elif frame_payload_len1 == 126:
             i += 2
-            if self._data_len < i:
-                raise _NotEnoughFrame()
-            self._frame_payload_len = struct.unpack("!H", data[i - 2:i])[0]
+            if available < i:
+                return False
+            self._frame_payload_len = struct.unpack_from(
+                "!H", data, offset + 2)[0]
         elif frame_payload_len1 == 127:
             i += 8
-            if self._data_len < i:
-                raise _NotEnoughFrame()
-            self._frame_payload_len = struct.unpack("!Q", data[i - 8:i])[0]
+            if available < i:
+                return False
+            self._frame_payload_len = struct.unpack_from(
+                "!Q", data, offset + 2)[0]
 
         if self._frame_mask:
             i += 4
-
-        if (self._data_len - i) < self._frame_payload_len:
-            raise _NotEnoughFrame()
+            if available < i:
+                return False
+
+        if self._frame_ops >= 0x8 and (not self._frame_fin or
+                                       self._frame_payload_len > 125):
+            # RFC 6455 5.5: control frames are never fragmented and carry
+            # at most 125 bytes
+            self._failConnection(1002, "Invalid WebSocket control frame")
+            return False
+        if self._frame_ops < 0x8 and self._frame_payload_len + \
+                self._fragments_len > self.max_message_size:
+            self._failConnection(1009, "WebSocket message larger than %d "
+                                 "bytes" % self.max_message_size)
+            return False
 
         self._frame_header_len = i
+        return True
 
-    def _extractMessageFromFrame(self, data):
-        i = self._frame_header_len
-
-        # when payload is masked, extract frame mask
-        frame_mask = None
-        frame_mask_array = []
-        if self._frame_mask:
-            frame_mask = data[i - 4:i]
-            for j in range(0, 4):
-                frame_mask_array.append(ord(frame_mask[j]))
-            payload = bytearray(data[i:i + self._frame_payload_len])
-            for k in xrange(0, self._frame_payload_len):
-                payload[k] ^= frame_mask_array[k % 4]
-
-            return str(payload)
-        else:
-            return data[i:i+self._frame_payload_len]
+    def _extractMessageFromFrame(self, start, end):
+        view = memoryview(self._buffer)
+        try:
+            # when payload is masked, extract frame mask
+            if self._frame_mask:
+                return _mask(view[start:end], bytes(view[start - 4:start]))
+            else:
+                return bytes(view[start:end])
+        finally:
+            view.release()
+
+    def _processFrame(self, payload):
+        ops = self._frame_ops
+        # control frames may arrive between the fragments of a message
+        if ops == 0x8:
+            self.sendMessage(payload, code=0x88)
+            #self.handler.connectionLost(payload)
+            return
+        elif ops == 0x9:
+            self.sendMessage(payload, code=0x8A)
+            return
+        elif ops > 0x8:
+            return
+
+        # RSV1 on the first frame of a message marks it as compressed
+        if ops:
+            self._compressed = self._deflate is not None and \
+                bool(self._frame_rsv & 0x4)
+        self._fragments.append(payload)
+        self._fragments_len += len(payload)
+        if self._frame_fin:
+            fragments = self._fragments
+            message = fragments[0] if len(fragments) == 1 else \
+                b"".join(fragments)
+            self._fragments = []
+            self._fragments_len = 0
+            if self._compressed:
+                try:
+                    message = self._deflate.decompress(
+                        message, self.max_message_size)
+                except zlib.error as e:
+                    self._failConnection(1007, "Invalid compressed "
+                                         "WebSocket message: %s" % e)
+                    return
+                if message is None:
+                    self._failConnection(1009, "WebSocket message larger "
+                                         "than %d bytes" %
+                                         self.max_message_size)
+                    return
+            self.handler.messageReceived(message)
+
+    def _failConnection(self, code, reason):
+        log.msg("%s, closing" % reason)
+        self._closed = True
+        self._buffer = bytearray()
+        self._offset = 0
+        self._fragments = []
+        self._fragments_len = 0
+        self.sendMessage(struct.pack("!H", code), code=0x88)
+        self.transport.loseConnection()
 
     def sendMessage(self, message, code=0x81):
-        if isinstance(message, unicode):
-            message = message.encode('utf8')
-        length = len(message)
-        newFrame = []
-        newFrame.append(code)
-        newFrame = bytearray(newFrame)
-        if length <= 125:
-            newFrame.append(length)
-        elif length > 125 and length < 65536:
-            newFrame.append(126)
-            newFrame += struct.pack('!H', length)
-        elif length >= 65536:
-            newFrame.append(127)
-            newFrame += struct.pack('!Q', length)
-
-        newFrame += message
-        self.transport.write(str(newFrame))
+        message = cyclone.escape.utf8(message)
+        # only data frames are compressed, and marked so with RSV1
+        if self._deflate is not None and code in (0x81, 0x82):
+            message = self._deflate.compress(message)
+            code |= 0x40
+        return self._write(_frame(message, code))
+
+    def _write(self, data):
+        return self.handler.send_queue.write(data)
 
 
 class WebSocketProtocol76(WebSocketProtocol):
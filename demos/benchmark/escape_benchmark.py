@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# Copyright 2010 Alexandre Fiori
+# based on the original Tornado by Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Measures how many calls per second the functions of cyclone.escape
+# make on typical template values, and compares xhtml_escape with the
+# regex substitution cyclone used to do and with xhtml_escape_list.
+#
+# Run with:
+#   python escape_benchmark.py --calls=100000
+
+import re
+import time
+
+from cyclone import escape
+from cyclone.options import define, options, parse_command_line
+
+define("calls", default=100000, help="number of calls per run")
+
+_XHTML_ESCAPE_RE = re.compile('[&<>"\']')
+_XHTML_ESCAPE_DICT = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;',
+                      "'": "&#39;"}
+
+
+def regex_xhtml_escape(value):
+    """The original xhtml_escape."""
+    return _XHTML_ESCAPE_RE.sub(
+        lambda match: _XHTML_ESCAPE_DICT[match.group(0)],
+        escape.to_basestring(value))
+
+
+VALUES = (
+    ("plain", "John Smith"),
+    ("special", "<a href='/users?id=1&page=2'>Tom & Jerry</a>"),
+    ("long", "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20),
+    ("bytes", b"caf\xc3\xa9 & cr\xc3\xa8me"),
+)
+
+
+def run(function, value, calls):
+    function(value)
+    start = time.time()
+    for i in range(calls):
+        function(value)
+    return time.time() - start
+
+
+def report(name, function, value, calls, per_call=1):
+    rate = calls * per_call / run(function, value, calls)
+    print("%-28s %12.0f/s" % (name, rate))
+
+
+def main():
+    parse_command_line()
+    calls = options.calls
+    for label, value in VALUES:
+        report("regex_xhtml_escape %s" % label, regex_xhtml_escape, value,
+               calls)
+        report("xhtml_escape %s" % label, escape.xhtml_escape, value, calls)
+    values = [value for label, value in VALUES] * 25
+    report("xhtml_escape_list x%d" % len(values), escape.xhtml_escape_list,
+           values, calls // len(values), len(values))
+    report("url_escape", escape.url_escape, "a b&c=d/é?", calls)
+    report("json_encode", escape.json_encode,
+           {"id": 1, "name": "</script>", "tags": ["a", "b"]}, calls)
+    report("linkify", escape.linkify,
+           "see http://cyclone.io/ & www.example.com", calls // 10)
+
+
+if __name__ == "__main__":
+    main()
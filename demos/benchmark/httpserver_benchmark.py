@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# Copyright 2010 Alexandre Fiori
+# based on the original Tornado by Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Measures how many keep-alive requests per second HTTPConnection can
+# parse, compared with the line based parser cyclone used to have.
+# No sockets are involved: requests are fed to the protocol through a
+# StringTransport and finished right away, so the numbers reflect the
+# parsing overhead only.
+#
+# Run with:
+#   python httpserver_benchmark.py --requests=20000 --headers=10
+
+import time
+
+from twisted.test import proto_helpers
+
+from cyclone import httputil
+from cyclone.escape import to_unicode
+from cyclone.httpserver import HTTPConnection, HTTPRequest
+from cyclone.options import define, options, parse_command_line
+from cyclone.util import ObjectDict
+
+define("requests", default=20000, help="number of requests per run")
+define("headers", default=10, help="number of headers per request")
+define("chunk", default=4096, help="bytes per dataReceived call")
+
+
+class LineHTTPConnection(HTTPConnection):
+    """The original parser: accumulates one header line at a time."""
+    def connectionMade(self):
+        HTTPConnection.connectionMade(self)
+        self._headersbuffer = []
+        self._buffer = b""
+
+    def dataReceived(self, data):
+        return super(HTTPConnection, self).dataReceived(data)
+
+    def lineReceived(self, line):
+        if line:
+            self._headersbuffer.append(line + self.delimiter)
+        else:
+            buff = b"".join(self._headersbuffer)
+            self._headersbuffer = []
+            self._on_headers(buff)
+
+    def _on_headers(self, data):
+        eol = data.find(b"\r\n")
+        method, uri, version = data[:eol].split(b" ")
+        headers = httputil.HTTPHeaders.parse(to_unicode(data[eol:]))
+        self._request = HTTPRequest(
+            connection=self, method=to_unicode(method), uri=to_unicode(uri),
+            version=to_unicode(version), headers=headers,
+            remote_ip=to_unicode(self._remote_ip))
+        self.request_callback(self._request)
+
+
+def make_payload(count, nheaders):
+    request = [b"GET /index.html?page=1 HTTP/1.1", b"Host: localhost"]
+    for i in range(nheaders):
+        request.append(b"X-Header-" + str(i).encode() + b": some value")
+    request = b"\r\n".join(request) + b"\r\n\r\n"
+    return request * count
+
+
+def run(protocol_class, payload, chunk):
+    factory = ObjectDict(settings={})
+    proto = protocol_class()
+    proto.factory = factory
+    proto.makeConnection(proto_helpers.StringTransport())
+    proto.request_callback = lambda request: request.finish()
+    start = time.time()
+    for i in range(0, len(payload), chunk):
+        proto.dataReceived(payload[i:i + chunk])
+    return time.time() - start
+
+
+def main():
+    parse_command_line()
+    payload = make_payload(options.requests, options.headers)
+    for name, cls in (("line based", LineHTTPConnection),
+                      ("incremental", HTTPConnection)):
+        elapsed = run(cls, payload, options.chunk)
+        print("%-12s %10.0f requests/sec" % (name, options.requests / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# Copyright 2010 Alexandre Fiori
+# based on the original Tornado by Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Measures how many paths per second Application can dispatch to their
+# handler, for route tables of several sizes, compared with trying every
+# URLSpec regex in order as cyclone used to do. Lookups are made for the
+# first route, the last route and a path that matches no route, also
+# with the route cache enabled.
+#
+# Run with:
+#   python routing_benchmark.py --routes=10,100,300,1000
+
+import time
+
+from cyclone.options import define, options, parse_command_line
+from cyclone.web import Application, RequestHandler
+
+define("routes", default=[10, 100, 300, 1000], multiple=True, type=int,
+       help="route table sizes")
+define("lookups", default=20000, help="number of lookups per run")
+
+
+class Request(object):
+    host = "localhost"
+    headers = {}
+
+    def __init__(self, path):
+        self.path = path
+
+
+class LinearRoutes(object):
+    def __init__(self, specs):
+        self.specs = specs
+
+    def match(self, path):
+        for spec in self.specs:
+            match = spec.regex.match(path)
+            if match:
+                return spec, match
+        return None, None
+
+
+class LinearApplication(Application):
+    """The original dispatcher: tries every URLSpec in order."""
+    def _get_host_routes(self, request):
+        handlers = self._get_host_handlers(request)
+        return [LinearRoutes(handlers)] if handlers else []
+
+
+def make_routes(count):
+    routes = []
+    for i in range(count):
+        if i % 2:
+            routes.append((r"/api/v1/resource%d/([0-9]+)" % i,
+                           RequestHandler))
+        else:
+            routes.append((r"/page%d/(?P<slug>[a-z-]+)/?" % i,
+                           RequestHandler))
+    return routes
+
+
+def run(app, path, lookups):
+    request = Request(path)
+    find = app._find_handler
+    find(request)
+    start = time.time()
+    for i in range(lookups):
+        find(request)
+    return time.time() - start
+
+
+def main():
+    parse_command_line()
+    for count in options.routes:
+        routes = make_routes(count)
+        last = routes[-1][0].replace("([0-9]+)", "42").replace(
+            "(?P<slug>[a-z-]+)/?", "some-slug")
+        paths = (("first", "/page0/some-slug"), ("last", last),
+                 ("404", "/not/found"))
+        for name, app in (
+                ("linear", LinearApplication(routes)),
+                ("trie", Application(routes)),
+                ("cached", Application(routes, route_cache_size=1024))):
+            results = ["%s: %8.0f/s" % (label, options.lookups /
+                                         run(app, path, options.lookups))
+                       for label, path in paths]
+            print("%5d routes %-7s %s" % (count, name, "  ".join(results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# Copyright 2010 Alexandre Fiori
+# based on the original Tornado by Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Measures how many times per second templates of several sizes can be
+# generated, compared with running the whole generated module again on
+# every call as cyclone used to do, and with always driving the template
+# through inlineCallbacks even when it waits on no Deferred. The per-call
+# overhead dominates for small templates.
+#
+# Run with:
+#   python template_benchmark.py --renders=20000
+
+import linecache
+import time
+import types
+
+from twisted.internet.defer import inlineCallbacks
+
+from cyclone.options import define, options, parse_command_line
+from cyclone.template import Template
+
+define("renders", default=20000, help="number of renders per run")
+
+TEMPLATES = (
+    ("tiny", "Hello {{ name }}!"),
+    ("small", "<ul>{% for item in items %}<li>{{ item }}</li>{% end %}</ul>"),
+    ("page", "<html><head><title>{{ title }}</title></head><body>"
+             "{% for item in items %}<div class=\"item\">"
+             "{% if item % 2 %}<b>{{ item }}</b>{% else %}{{ item }}"
+             "{% end %}</div>{% end %}</body></html>"),
+)
+
+
+class ReexecTemplate(Template):
+    """The original generate: runs the generated module on every call."""
+    def generate(self, **kwargs):
+        namespace = self._default_namespace()
+        namespace.update(kwargs)
+        exec(self.compiled, namespace, namespace)
+        linecache.clearcache()
+        return inlineCallbacks(namespace["_execute"])().result
+
+
+class DeferredTemplate(Template):
+    """Runs the compiled template through inlineCallbacks on every call."""
+    def generate(self, **kwargs):
+        namespace = self._namespace.copy()
+        namespace.update(kwargs)
+        return inlineCallbacks(types.FunctionType(
+            self._execute_code, namespace, "_execute"))().result
+
+
+def run(template, renders, **kwargs):
+    template.generate(**kwargs)
+    start = time.time()
+    for i in range(renders):
+        template.generate(**kwargs)
+    return time.time() - start
+
+
+def main():
+    parse_command_line()
+    kwargs = dict(name="world", title="Benchmark", items=list(range(20)))
+    for name, source in TEMPLATES:
+        results = ["%s: %8.0f/s" % (label, options.renders /
+                                     run(cls(source), options.renders,
+                                         **kwargs))
+                   for label, cls in (("reexec", ReexecTemplate),
+                                      ("deferred", DeferredTemplate),
+                                      ("compiled", Template))]
+        print("%-6s %s" % (name, "  ".join(results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# Copyright 2010 Alexandre Fiori
+# based on the original Tornado by Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Measures how long it takes to send one chat message to many WebSocket
+# connections, looping over WebSocketHandler.sendMessage as the chat demo
+# used to do and with WebSocketGroup.broadcast. The transports only count
+# what is written to them, so this is the cost of encoding and framing.
+#
+# Run with:
+#   python websocket_broadcast_benchmark.py --connections=50000
+
+import time
+
+from cyclone.options import define, options, parse_command_line
+from cyclone.web import SendQueue
+from cyclone.websocket import WebSocketGroup, WebSocketHandler
+from cyclone.websocket import WebSocketProtocol17
+
+define("connections", default=50000, help="number of connections")
+define("messages", default=10, help="number of messages per run")
+
+MESSAGE = {"id": "9a3c5e0e-5b2f-4d7b-8c1e-0f3c2b7a9d41",
+           "body": "hello everyone",
+           "html": "<div class=\"message\">hello everyone</div>"}
+
+
+class Transport(object):
+    disconnecting = False
+    written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+
+class Connection(object):
+    """Enough of a WebSocketHandler for sending messages."""
+    settings = {}
+    request = None
+    sendMessage = WebSocketHandler.sendMessage
+
+    def __init__(self):
+        self.transport = Transport()
+        self.send_queue = SendQueue(self.transport)
+        self.ws_protocol = WebSocketProtocol17(self)
+
+
+def loop(connections, message):
+    for connection in connections:
+        connection.sendMessage(message)
+
+
+def main():
+    parse_command_line()
+    group = WebSocketGroup()
+    connections = [Connection() for i in range(options.connections)]
+    for connection in connections:
+        group.add(connection)
+    for label, function in (("sendMessage loop", loop),
+                            ("broadcast", lambda c, m: group.broadcast(m))):
+        start = time.time()
+        for i in range(options.messages):
+            function(connections, MESSAGE)
+        elapsed = (time.time() - start) / options.messages
+        print("%-16s %8.1f ms per message to %d connections" %
+              (label, elapsed * 1000, len(connections)))
+
+
+if __name__ == "__main__":
+    main()
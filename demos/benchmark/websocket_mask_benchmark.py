@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# Copyright 2010 Alexandre Fiori
+# based on the original Tornado by Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Measures how many megabytes per second of client WebSocket payload can
+# be unmasked, for several message sizes, comparing the per-byte loop
+# cyclone used to run with cyclone.websocket._mask, both with and without
+# numpy installed.
+#
+# Run with:
+#   python websocket_mask_benchmark.py --megabytes=16
+
+import os
+import time
+
+from cyclone import websocket
+from cyclone.options import define, options, parse_command_line
+
+define("megabytes", default=16, help="megabytes to unmask per size")
+
+SIZES = (125, 1024, 16 * 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+
+
+def loop_mask(data, mask):
+    """The original unmasking loop."""
+    payload = bytearray(data)
+    for k in range(len(payload)):
+        payload[k] ^= mask[k % 4]
+    return bytes(payload)
+
+
+def int_mask(data, mask):
+    numpy, websocket.numpy = websocket.numpy, None
+    try:
+        return websocket._mask(data, mask)
+    finally:
+        websocket.numpy = numpy
+
+
+def run(function, size, total):
+    data = os.urandom(size)
+    mask = os.urandom(4)
+    calls = max(1, total // size)
+    function(data, mask)
+    start = time.time()
+    for i in range(calls):
+        function(data, mask)
+    return calls * size / (time.time() - start) / 1024 / 1024
+
+
+def main():
+    parse_command_line()
+    total = options.megabytes * 1024 * 1024
+    functions = [("loop", loop_mask), ("int", int_mask)]
+    if websocket.numpy is not None:
+        functions.append(("numpy", websocket._mask))
+    for size in SIZES:
+        # the per-byte loop needs about a second per megabyte
+        results = ["%s: %9.1f MB/s" % (label, run(
+            function, size, total if function is not loop_mask
+            else min(total, 1024 * 1024)))
+            for label, function in functions]
+        print("%9d bytes  %s" % (size, "  ".join(results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -63,7 +63,7 @@ class MainHandler(cyclone.web.RequestHandler):
 
 
 class ChatSocketHandler(cyclone.websocket.WebSocketHandler):
-    waiters = set()
+    waiters = cyclone.websocket.WebSocketGroup()
     cache = []
     cache_size = 200
 
@@ -75,7 +75,7 @@ class ChatSocketHandler(cyclone.websocket.WebSocketHandler):
         self.stats.newChatter()
 
     def connectionLost(self, reason):
-        ChatSocketHandler.waiters.remove(self)
+        ChatSocketHandler.waiters.discard(self)
         self.stats.lostChatter()
 
     @classmethod
@@ -86,12 +86,8 @@ class ChatSocketHandler(cyclone.websocket.WebSocketHandler):
 
     @classmethod
     def send_updates(cls, chat):
-        log.msg("sending message to %d waiters" % len(cls.waiters))
-        for waiter in cls.waiters:
-            try:
-                waiter.sendMessage(chat)
-            except Exception as e:
-                log.err("Error sending message. %s" % str(e))
+        sent = cls.waiters.broadcast(chat)
+        log.msg("sent message to %d of %d waiters" % (sent, len(cls.waiters)))
 
     def messageReceived(self, message):
         log.msg("got message %s" % message)